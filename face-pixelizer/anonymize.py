@@ -0,0 +1,306 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import glob
+from itertools import islice, repeat, takewhile
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+import cv2
+
+from face_pixelizer import FacePixelizer
+
+
+IMAGE_EXTENSIONS = {".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"}
+VIDEO_EXTENSIONS = {".avi", ".mkv", ".mov", ".mp4", ".webm"}
+
+
+def list_inputs(inputs: List[str]) -> List[Tuple[str, str]]:
+    """Images and videos of directories (recursively), globs or files.
+
+    Returns:
+        (path, output path relative to the output directory) of each file,
+        directories keep their tree, other files their name
+    """
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    files.append((path, os.path.relpath(path, pattern)))
+            continue
+
+        paths = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+        if len(paths) == 0:
+            print(f"Nothing matches {pattern}")
+        files += [(path, os.path.basename(path)) for path in paths]
+
+    extensions = IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
+    return [
+        (path, output)
+        for path, output in files
+        if os.path.splitext(path)[1].lower() in extensions
+    ]
+
+
+def partial_path(path: str) -> str:
+    """Path outputs are written to before being complete, keeping their format."""
+    root, extension = os.path.splitext(path)
+    return f"{root}.partial{extension}"
+
+
+def read_ahead(
+    executor: ThreadPoolExecutor, func: Callable, items: Iterable, depth: int
+) -> Iterator:
+    """`executor.map`, with at most `depth` results computed ahead."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+class Progress:
+    """Processed files and frames, logged every `interval` secs."""
+
+    def __init__(self, num_files: int, interval: float = 5):
+        self.num_files = num_files
+        self.interval = interval
+        self.files = {"done": 0, "skipped": 0, "failed": 0}
+        self.frames = 0
+        # files are written from the writer threads
+        self.lock = threading.Lock()
+        self.start = self.last_log = time.perf_counter()
+
+    def add_file(self, status: str):
+        with self.lock:
+            self.files[status] += 1
+
+    def add_frames(self, num_frames: int):
+        self.frames += num_frames
+        if time.perf_counter() - self.last_log >= self.interval:
+            self.log()
+
+    def log(self):
+        self.last_log = time.perf_counter()
+        duration = self.last_log - self.start
+        files = sum(self.files.values())
+        print(
+            f"{files}/{self.num_files} files ({self.files['skipped']} skipped, "
+            + f"{self.files['failed']} failed), {self.frames} frames in "
+            + f"{duration:.1f} secs, {self.frames / max(duration, 1e-9):.1f} frames / s"
+        )
+
+
+class Writer:
+    """Encode outputs on a thread pool, with at most `depth` pending writes."""
+
+    def __init__(self, executor: ThreadPoolExecutor, depth: int):
+        self.executor = executor
+        self.depth = depth
+        self.pending = deque()
+
+    def submit(self, func: Callable, *args):
+        self.pending.append(self.executor.submit(func, *args))
+        while len(self.pending) > self.depth:
+            self.pending.popleft().result()
+
+    def wait(self):
+        while self.pending:
+            self.pending.popleft().result()
+
+
+def write_image(path: str, img, progress: Progress):
+    if cv2.imwrite(partial_path(path), img):
+        os.replace(partial_path(path), path)
+        progress.add_file("done")
+    else:
+        print(f"Can not write {path}")
+        progress.add_file("failed")
+
+
+def anonymize_images(
+    model: FacePixelizer,
+    files: List[Tuple[str, str]],
+    batch_size: int,
+    num_readers: int,
+    num_writers: int,
+    progress: Progress,
+):
+    """Anonymize images, decoded and encoded on thread pools."""
+    with ThreadPoolExecutor(num_readers) as readers, ThreadPoolExecutor(
+        num_writers
+    ) as writers:
+        depth = 2 * batch_size * max(num_readers, num_writers)
+        imgs = read_ahead(readers, cv2.imread, (path for path, _ in files), depth)
+        writer = Writer(writers, depth)
+        outputs = deque()
+
+        def batches():
+            for batch in batched(zip(files, imgs), batch_size):
+                for (path, _), img in batch:
+                    if img is None:
+                        print(f"Can not read {path}")
+                        progress.add_file("failed")
+                batch = [(out, img) for (_, out), img in batch if img is not None]
+                if len(batch) > 0:
+                    outputs.append([out for out, _ in batch])
+                    yield [img for _, img in batch]
+
+        # decoded images are not used afterwards, they are anonymized in place
+        for processed_imgs in model.pipeline(batches(), inplace=True):
+            for output, img in zip(outputs.popleft(), processed_imgs):
+                writer.submit(write_image, output, img, progress)
+            progress.add_frames(len(processed_imgs))
+        writer.wait()
+
+
+def anonymize_video(
+    model: FacePixelizer,
+    path: str,
+    output: str,
+    batch_size: int,
+    fourcc: str,
+    progress: Progress,
+):
+    """Anonymize a video, decoded and encoded on their own threads."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        print(f"Can not read {path}")
+        progress.add_file("failed")
+        return
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    video_writer = cv2.VideoWriter(
+        partial_path(output), cv2.VideoWriter_fourcc(*fourcc), fps, (width, height)
+    )
+    if not video_writer.isOpened():
+        cap.release()
+        print(f"Can not write {output}")
+        progress.add_file("failed")
+        return
+
+    # frames are decoded and encoded in order, each on a single thread
+    with ThreadPoolExecutor(1) as decoder, ThreadPoolExecutor(1) as encoder:
+        reads = read_ahead(decoder, lambda _: cap.read(), repeat(None), 2 * batch_size)
+        frames = (frame for _, frame in takewhile(lambda read: read[0], reads))
+        writer = Writer(encoder, 2 * batch_size)
+
+        model.reset_stream()
+        for processed_frames in model.pipeline(batched(frames, batch_size), True):
+            for frame in processed_frames:
+                writer.submit(video_writer.write, frame)
+            progress.add_frames(len(processed_frames))
+        writer.wait()
+
+    cap.release()
+    video_writer.release()
+    os.replace(partial_path(output), output)
+    progress.add_file("done")
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Anonymize the faces of images and videos, headless"
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="Directories, globs, image or video files"
+    )
+    parser.add_argument("--output_dir", required=True)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--readers", default=4, type=int, help="Decoding threads")
+    parser.add_argument("--writers", default=4, type=int, help="Encoding threads")
+    parser.add_argument(
+        "--anonymize_threads",
+        default=2,
+        type=int,
+        help="Anonymization threads, overlapped with the next batch inference",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Process files whose output exists (skipped by default, to resume)",
+    )
+    parser.add_argument("--log_interval", default=5, type=float)
+    parser.add_argument(
+        "--anonymization", default="pixelize", choices=["pixelize", "emoji"]
+    )
+    parser.add_argument("--emoji_path", default="imgs/emoji.png")
+    parser.add_argument("--input_size", default=512, type=int)
+    parser.add_argument("--state_dict", default="retinaface_mobilenet_0.25.pth")
+    parser.add_argument(
+        "--torchscript_cache", default=None, help="Frozen TorchScript models"
+    )
+    parser.add_argument("--tiling", action="store_true")
+    parser.add_argument(
+        "--keyframe_interval",
+        default=1,
+        type=int,
+        help="Videos: scan full frames for faces every N frames only",
+    )
+    parser.add_argument("--stream_mode", default="track", choices=["track", "roi"])
+    parser.add_argument("--fourcc", default="mp4v", help="Output videos codec")
+    args = parser.parse_args()
+
+    files = list_inputs(args.inputs)
+    progress = Progress(len(files), args.log_interval)
+    todo = []
+    for path, output in files:
+        output = os.path.join(args.output_dir, output)
+        if os.path.isfile(output) and not args.overwrite:
+            progress.add_file("skipped")
+        else:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            todo.append((path, output))
+
+    def is_video(path):
+        return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+    images = [(path, output) for path, output in todo if not is_video(path)]
+    videos = [(path, output) for path, output in todo if is_video(path)]
+    print(f"{len(images)} images and {len(videos)} videos to anonymize")
+
+    kwargs = dict(
+        input_size=args.input_size,
+        state_dict=args.state_dict,
+        anonymization=args.anonymization,
+        emoji_path=args.emoji_path,
+        torchscript_cache=args.torchscript_cache,
+        tiling=args.tiling,
+        anonymize_threads=args.anonymize_threads,
+    )
+    model = FacePixelizer(**kwargs)
+    anonymize_images(
+        model, images, args.batch_size, args.readers, args.writers, progress
+    )
+
+    if len(videos) > 0 and args.keyframe_interval > 1:
+        # images are independent, only video frames are a stream
+        model = FacePixelizer(
+            keyframe_interval=args.keyframe_interval,
+            stream_mode=args.stream_mode,
+            **kwargs,
+        )
+    for path, output in videos:
+        anonymize_video(model, path, output, args.batch_size, args.fourcc, progress)
+
+    progress.log()
@@ -0,0 +1,230 @@
+import hashlib
+import inspect
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class TorchScriptBackend:
+    """Run a TorchScript RetinaFaceDetector with PyTorch."""
+
+    def __init__(self, model: torch.jit.ScriptModule):
+        self.model = model
+
+    def __call__(
+        self, tensors: torch.Tensor, score_threshold: float
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        score_threshold = torch.tensor(score_threshold, device=tensors.device)
+        with torch.no_grad():
+            return self.model(tensors, score_threshold)
+
+
+class LazyBackend:
+    """Build a backend on its first call.
+
+    Args:
+        setup: returns the backend
+    """
+
+    def __init__(self, setup: Callable[[], Callable]):
+        self.setup = setup
+        self.backend = None
+        self.lock = threading.Lock()
+
+    def __call__(
+        self, tensors: torch.Tensor, score_threshold: float
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        if self.backend is None:
+            with self.lock:
+                if self.backend is None:
+                    start = time.perf_counter()
+                    self.backend = self.setup()
+                    duration = time.perf_counter() - start
+                    print(f"model built on first use in {duration:.2f} secs")
+        return self.backend(tensors, score_threshold)
+
+
+class OnnxRuntimeBackend:
+    """Run an exported RetinaFaceDetector with onnxruntime on cpu.
+
+    Args:
+        onnx_path: model exported with `export_onnx`
+        intra_op_threads: threads used inside an operator (0: onnxruntime default)
+        inter_op_threads: threads used across operators (0: onnxruntime default)
+    """
+
+    def __init__(
+        self, onnx_path: str, intra_op_threads: int = 0, inter_op_threads: int = 0
+    ):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("`onnxruntime` is required by the onnx backend")
+
+        if not os.path.isfile(onnx_path):
+            raise FileNotFoundError(f"{onnx_path} do not exist")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        self.session = ort.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(
+        self, tensors: torch.Tensor, score_threshold: float
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        inputs = {
+            "input": tensors.cpu().numpy(),
+            "score_threshold": np.array(score_threshold, dtype=np.float32),
+        }
+        outputs = self.session.run(["boxes", "scores", "counts"], inputs)
+        return tuple(torch.from_numpy(output) for output in outputs)
+
+
+def trace_retinaface(
+    model: nn.Module, input_size: int, device: str = "cpu", freeze: bool = False
+) -> torch.jit.ScriptModule:
+    """Trace RetinaFaceDetector, optionally frozen for inference.
+
+    Freezing inlines the weights as constants and lets the JIT fold and fuse
+    operators (e.g. batch norms into convolutions).
+
+    Args:
+        model (nn.Module): RetinaFaceDetector in eval mode
+        input_size: size of the dummy input used for the tracing
+        device: device to run the model on
+        freeze: freeze the traced model
+    """
+    # traced on its device, since priors are created in the graph
+    dump_inputs = (
+        torch.randn(1, 3, input_size, input_size, device=device),
+        torch.tensor(0.5, device=device),
+    )
+    model = torch.jit.trace(model.to(device), dump_inputs)
+    if freeze:
+        model = torch.jit.freeze(model.eval())
+    return model
+
+
+def save_atomically(path: str, save: Callable[[str], None]):
+    """Write a file with `save(tmp_path)` then move it to `path` at once.
+
+    Processes starting together (e.g. replicas) may build the same artifact:
+    each one writes its own temporary file in the destination directory, so
+    none of them ever loads a partially written one.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=directory, prefix=".", suffix=".tmp", delete=False
+    ) as f:
+        tmp_path = f.name
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def torchscript_artifact(
+    state_dict: str, input_size: int, device: str, cache_dir: str, top_k: int = 750
+) -> str:
+    """Path of the frozen TorchScript model for given weights, size, top-k and
+    device."""
+    with open(state_dict, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    device = torch.device(device).type
+    name = f"retinaface_detector_{digest}_{input_size}_top{top_k}_{device}.pt"
+    return os.path.join(cache_dir, name)
+
+
+def onnx_artifact(state_dict: str, top_k: int = 750) -> str:
+    """Default path of the ONNX export for given weights and top-k, next to the
+    weights (the default top-k export is named after them only)."""
+    path = os.path.splitext(state_dict)[0]
+    if top_k != 750:
+        path += f"_top{top_k}"
+    return path + ".onnx"
+
+
+def export_onnx(model: nn.Module, onnx_path: str, input_size: int = 512):
+    """Export RetinaFaceDetector to ONNX with dynamic batch and spatial axes.
+
+    Args:
+        model (nn.Module): float RetinaFaceDetector in eval mode
+        onnx_path: where to write the model
+        input_size: size of the dummy input used for the export
+    """
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript based exporter is the one handling `dynamic_axes`
+        kwargs["dynamo"] = False
+
+    torch.onnx.export(
+        model.cpu().eval(),
+        (torch.randn(1, 3, input_size, input_size), torch.tensor(0.5)),
+        onnx_path,
+        input_names=["input", "score_threshold"],
+        output_names=["boxes", "scores", "counts"],
+        dynamic_axes={
+            "input": {0: "batch", 2: "height", 3: "width"},
+            "boxes": {0: "batch", 1: "detections"},
+            "scores": {0: "batch", 1: "detections"},
+            "counts": {0: "batch"},
+        },
+        opset_version=11,
+        **kwargs,
+    )
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from functools import partial
+
+    from retinaface import RetinaFaceDetector, retinaface
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state_dict", default="retinaface_mobilenet_0.25.pth")
+    parser.add_argument("--onnx_path", default=None)
+    parser.add_argument(
+        "--torchscript_cache",
+        default=None,
+        help="Directory where the frozen TorchScript model is saved",
+    )
+    parser.add_argument("--input_size", default=512, type=int)
+    parser.add_argument("--top_k", default=750, type=int)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    model = RetinaFaceDetector(retinaface(args.state_dict), args.top_k).eval()
+
+    if args.onnx_path is not None:
+        save_atomically(
+            args.onnx_path,
+            lambda path: export_onnx(model, path, args.input_size),
+        )
+        print(f"onnx model saved at: {args.onnx_path}")
+
+    if args.torchscript_cache is not None:
+        path = torchscript_artifact(
+            args.state_dict,
+            args.input_size,
+            args.device,
+            args.torchscript_cache,
+            args.top_k,
+        )
+        traced = trace_retinaface(model, args.input_size, args.device, freeze=True)
+        save_atomically(path, partial(torch.jit.save, traced))
+        print(f"torchscript model saved at: {path}")
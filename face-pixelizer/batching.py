@@ -0,0 +1,132 @@
+from collections import deque
+from concurrent.futures import Future
+import queue
+import threading
+import time
+from typing import Callable, List
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Gather concurrent requests into batches processed by a single call.
+
+    Callers (e.g. the threads serving each client) block on `__call__` while a
+    scheduler thread gathers pending requests until the batch is full or the
+    first one waited `max_wait`, runs one batched `process` and scatters the
+    results back. With a latency budget, the batch size limit adapts (AIMD) to
+    keep the p99 request latency under it. Latencies are measured from the
+    start of the gathering of their batch: under overload, requests queued
+    behind previous batches would not wait less with smaller batches. When a
+    batch fails, its requests are processed again one by one, so a bad request
+    only fails itself.
+
+    Args:
+        process: batch function, its results are in the order of its inputs
+        max_batch_size: maximal number of items per batch
+        max_wait: maximal time (secs) a request waits for others
+        latency_budget: Optional; p99 request latency target (secs)
+        window: number of request latencies the p99 is estimated on
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List], List],
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        latency_budget: float = None,
+        window: int = 100,
+    ):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.latency_budget = latency_budget
+        self.window = window
+
+        self.batch_size = max_batch_size
+        self.latencies = deque(maxlen=window)
+        self.requests = queue.Queue()
+        self.next_request = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __call__(self, items: List) -> List:
+        """Process items within a batch, blocking until their results are ready."""
+        future = Future()
+        self.requests.put((list(items), future, time.perf_counter()))
+        return future.result()
+
+    def get_request(self, timeout: float = None):
+        if self.next_request is not None:
+            request, self.next_request = self.next_request, None
+            return request
+        return self.requests.get(timeout=timeout)
+
+    def run(self):
+        while True:
+            requests = [self.get_request()]
+            gathering = time.perf_counter()
+            size = len(requests[0][0])
+            deadline = requests[0][2] + self.max_wait
+
+            while size < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.get_request(timeout)
+                except queue.Empty:
+                    break
+                if size + len(request[0]) > self.batch_size:
+                    # first of the next batch
+                    self.next_request = request
+                    break
+                requests.append(request)
+                size += len(request[0])
+
+            self.dispatch(requests, gathering)
+
+    def dispatch(self, requests, gathering: float):
+        items = [item for request_items, _, _ in requests for item in request_items]
+        try:
+            results = self.process(items)
+        except Exception as error:
+            if len(requests) == 1:
+                requests[0][1].set_exception(error)
+            else:
+                # e.g. a malformed image: only the requests failing on their
+                # own fail, as without batching
+                self.dispatch_each(requests)
+            return
+
+        done = time.perf_counter()
+        start = 0
+        for request_items, future, submitted in requests:
+            future.set_result(results[start : start + len(request_items)])
+            start += len(request_items)
+            self.latencies.append(done - max(submitted, gathering))
+        self.adapt()
+
+    def dispatch_each(self, requests):
+        """Process the requests of a failed batch one by one."""
+        for request_items, future, _ in requests:
+            try:
+                future.set_result(self.process(request_items))
+            except Exception as error:
+                future.set_exception(error)
+
+    def adapt(self):
+        """Halve the batch size over the latency budget, grow it well under."""
+        if self.latency_budget is None or len(self.latencies) < self.window // 4:
+            return
+
+        p99 = np.percentile(self.latencies, 99)
+        if p99 > self.latency_budget and self.batch_size > 1:
+            self.batch_size = max(self.batch_size // 2, 1)
+        elif p99 < 0.8 * self.latency_budget and self.batch_size < self.max_batch_size:
+            self.batch_size += 1
+        else:
+            return
+        # latencies of the previous batch size are outdated
+        self.latencies.clear()
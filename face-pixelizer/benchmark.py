@@ -0,0 +1,916 @@
+import argparse
+from datetime import datetime
+import glob
+from itertools import product
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from batching import MicroBatcher
+from face_pixelizer import FacePixelizer
+from quantization import match_detections
+from replicas import FacePixelizerPool
+from utils import pixelize, pixelize_boxes
+
+
+def legacy_pixelize(img, blocks=6):
+    """Reference per-block implementation, used to check the vectorized one."""
+    h, w = img.shape[:2]
+    x_steps = np.linspace(0, w, blocks + 1, dtype="int")
+    y_steps = np.linspace(0, h, blocks + 1, dtype="int")
+    for y in range(1, len(y_steps)):
+        for x in range(1, len(x_steps)):
+            x_start, x_end = x_steps[x - 1], x_steps[x]
+            y_start, y_end = y_steps[y - 1], y_steps[y]
+            roi = img[y_start:y_end, x_start:x_end]
+            (B, G, R) = [int(x) for x in cv2.mean(roi)[:3]]
+            cv2.rectangle(img, (x_start, y_start), (x_end, y_end), (B, G, R), -1)
+    return img
+
+
+def grid_boxes(num_faces, face_size, height, width):
+    """Non overlapping [x1, y1, x2, y2] boxes laid out on a grid."""
+    stride = face_size + face_size // 4
+    cols = width // stride
+    if num_faces > cols * (height // stride):
+        raise ValueError(f"{num_faces} faces of {face_size}px do not fit the image")
+    inds = np.arange(num_faces)
+    x1, y1 = (inds % cols) * stride, (inds // cols) * stride
+    return np.stack([x1, y1, x1 + face_size, y1 + face_size], axis=1)
+
+
+def timeit(func, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return np.median(durations)
+
+
+def bench_pixelize(args):
+    img = cv2.imread(args.image_path)
+    if img is None:
+        raise ValueError(f"{args.image_path} is invalid")
+    img = cv2.resize(img, (args.width, args.height))
+
+    print(
+        f"{'faces':>6} {'legacy (ms)':>12} {'per box (ms)':>13} "
+        + f"{'all boxes (ms)':>15} {'mean diff':>9}"
+    )
+    for num_faces in args.faces:
+        boxes = grid_boxes(num_faces, args.face_size, args.height, args.width)
+
+        def legacy(out):
+            for x1, y1, x2, y2 in boxes:
+                out[y1:y2, x1:x2] = legacy_pixelize(out[y1:y2, x1:x2], args.blocks)
+            return out
+
+        def per_box(out):
+            for x1, y1, x2, y2 in boxes:
+                pixelize(out[y1:y2, x1:x2], args.blocks)
+            return out
+
+        legacy_out, vectorized_out = legacy(img.copy()), img.copy()
+        pixelize_boxes(vectorized_out, boxes, args.blocks)
+        mean_diff = np.abs(legacy_out.astype(int) - vectorized_out).mean()
+
+        # outputs are overwritten in place, the copy is not timed
+        out = img.copy()
+        legacy_time = timeit(lambda: legacy(out), args.repeats)
+        per_box_time = timeit(lambda: per_box(out), args.repeats)
+        vectorized_time = timeit(
+            lambda: pixelize_boxes(out, boxes, args.blocks), args.repeats
+        )
+        print(
+            f"{num_faces:>6} {legacy_time * 1e3:>12.3f} {per_box_time * 1e3:>13.3f} "
+            + f"{vectorized_time * 1e3:>15.3f} {mean_diff:>9.4f}"
+        )
+
+
+def bench_quantization(args):
+    paths = sorted(glob.glob(args.image_paths))
+    imgs = [cv2.imread(p) for p in paths]
+    if len(imgs) == 0:
+        raise FileNotFoundError(f"No images: {args.image_paths}")
+
+    print(
+        f"{'input size':>10} {'float32 (ms)':>13} {'int8 (ms)':>10} "
+        + f"{'recall':>7} {'precision':>10}"
+    )
+    for input_size in args.input_sizes:
+        # measured here on `image_paths`, the recall gate of the int8 model
+        # (on held out calibration images) is disabled
+        models = {
+            name: FacePixelizer(
+                input_size=input_size,
+                state_dict=args.state_dict,
+                quantize=quantize,
+                calibration_images=args.calibration_images,
+                min_quantized_recall=0.0,
+            )
+            for name, quantize in [("float32", False), ("int8", True)]
+        }
+
+        detections, latencies = {}, {}
+        for name, model in models.items():
+            detections[name] = [model.detect([img])[0][0] for img in imgs]
+            latency = timeit(
+                lambda: [model.detect([img]) for img in imgs], args.repeats
+            )
+            latencies[name] = latency / len(imgs)
+
+        # float32 detections are the reference
+        num_reference = sum(len(d) for d in detections["float32"])
+        num_int8 = sum(len(d) for d in detections["int8"])
+        matched = sum(
+            match_detections(ref, det)
+            for ref, det in zip(detections["float32"], detections["int8"])
+        )
+        print(
+            f"{input_size:>10} {latencies['float32'] * 1e3:>13.3f} "
+            + f"{latencies['int8'] * 1e3:>10.3f} "
+            + f"{matched / max(num_reference, 1):>7.3f} "
+            + f"{matched / max(num_int8, 1):>10.3f}"
+        )
+
+
+BACKEND_RUN = """
+import json, resource, sys, time
+
+start = time.perf_counter()
+import cv2
+from face_pixelizer import FacePixelizer
+
+kwargs = json.loads(sys.argv[1])
+repeats, image_path = kwargs.pop("repeats"), kwargs.pop("image_path")
+model = FacePixelizer(**kwargs)
+startup = time.perf_counter() - start
+
+img = cv2.imread(image_path)
+model.detect([img])
+durations = []
+for _ in range(repeats):
+    start = time.perf_counter()
+    model.detect([img])
+    durations.append(time.perf_counter() - start)
+durations.sort()
+
+print(json.dumps({
+    "startup": startup,
+    "latency": durations[len(durations) // 2],
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def bench_backends(args):
+    configs = {
+        "torchscript": {"backend": "torchscript"},
+        "frozen": {"backend": "torchscript", "torchscript_cache": args.cache_dir},
+        "onnx": {"backend": "onnx"},
+    }
+
+    print(f"{'backend':>12} {'startup (s)':>12} {'latency (ms)':>13} {'RSS (MB)':>9}")
+    for name, config in configs.items():
+        kwargs = {
+            "input_size": args.input_size,
+            "state_dict": args.state_dict,
+            "intra_op_threads": args.intra_op_threads,
+            "inter_op_threads": args.inter_op_threads,
+            "repeats": args.repeats,
+            "image_path": args.image_path,
+            **config,
+        }
+        # a first run builds the cached models (onnx export, frozen torchscript),
+        # then a fresh process so startup includes imports and model loading
+        for _ in range(2):
+            run = subprocess.run(
+                [sys.executable, "-c", BACKEND_RUN, json.dumps(kwargs)],
+                capture_output=True,
+                check=True,
+                text=True,
+            )
+        stats = json.loads(run.stdout.strip().splitlines()[-1])
+        print(
+            f"{name:>12} {stats['startup']:>12.3f} "
+            + f"{stats['latency'] * 1e3:>13.3f} {stats['max_rss_mb']:>9.1f}"
+        )
+
+
+def synthetic_images(img, face, num_faces, face_size, height, width, batch_size):
+    """Images with `num_faces` copies of a face crop on a blurred background.
+
+    Args:
+        img (np.array): source image, blurred as background
+        face (np.array): face crop, pasted on a grid
+    """
+    boxes = grid_boxes(num_faces, face_size, height, width)
+    face = cv2.resize(face, (face_size, face_size), interpolation=cv2.INTER_AREA)
+    background = cv2.GaussianBlur(cv2.resize(img, (width, height)), (0, 0), 25)
+
+    imgs = []
+    for i in range(batch_size):
+        img = background.copy()
+        # a different layout per image of the batch
+        offset = (i * face_size // 8) % max(face_size // 4, 1)
+        for x1, y1, x2, y2 in boxes + offset:
+            img[y1:y2, x1:x2] = face[: y2 - y1, : x2 - x1]
+        imgs.append(img)
+    return imgs
+
+
+SWEEP_RUN = """
+import json, resource, sys, time
+
+import cv2
+import numpy as np
+from benchmark import synthetic_images
+from face_pixelizer import FacePixelizer
+
+kwargs = json.loads(sys.argv[1])
+model = FacePixelizer(
+    input_size=kwargs["input_size"],
+    state_dict=kwargs["state_dict"],
+    torchscript_cache=kwargs["cache_dir"],
+    adaptive_sizes=kwargs["adaptive_sizes"],
+)
+
+# the face to replicate is the most confident one of the source image,
+# with some context around it
+img = cv2.imread(kwargs["image_path"])
+(x1, y1, x2, y2), *_ = model.detect([img])[0][0]
+cx, cy, side = (x1 + x2) // 2, (y1 + y2) // 2, max(x2 - x1, y2 - y1) * 3 // 4
+face = img[max(cy - side, 0) : cy + side, max(cx - side, 0) : cx + side]
+imgs = synthetic_images(
+    img,
+    face,
+    kwargs["num_faces"],
+    kwargs["face_size"],
+    kwargs["height"],
+    kwargs["width"],
+    kwargs["batch_size"],
+)
+
+model.warmup([kwargs["batch_size"]], [(kwargs["height"], kwargs["width"])], 1)
+durations = []
+for _ in range(kwargs["repeats"]):
+    start = time.perf_counter()
+    model(imgs)
+    durations.append(time.perf_counter() - start)
+durations = np.array(durations)
+
+print(json.dumps({
+    "throughput": kwargs["batch_size"] * len(durations) / durations.sum(),
+    "latency_mean": durations.mean(),
+    "latency_p50": np.percentile(durations, 50),
+    "latency_p90": np.percentile(durations, 90),
+    "latency_p99": np.percentile(durations, 99),
+    "faces_per_image": model.stats()["faces_per_image"]["mean"],
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+STARTUP_RUN = """
+import json, sys, time
+
+start = time.perf_counter()
+import numpy as np
+from face_pixelizer import FacePixelizer
+
+
+def rss():
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {
+        key: int(fields[key].split()[0]) / 1024
+        for key in ["VmRSS", "RssAnon", "RssFile"]
+    }
+
+
+kwargs = json.loads(sys.argv[1])
+model = FacePixelizer(**kwargs)
+startup = time.perf_counter() - start
+rss_ready = rss()
+
+img = np.zeros((720, 1280, 3), dtype=np.uint8)
+start = time.perf_counter()
+model([img])
+first = time.perf_counter() - start
+
+print(json.dumps({
+    "startup": startup, "first": first, "ready": rss_ready, "served": rss()
+}))
+"""
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_sweep(args):
+    keys = ["batch_size", "input_size", "height", "width", "num_faces"]
+    configs = [
+        dict(zip(keys, (batch_size, input_size, *resolution, num_faces)))
+        for batch_size, input_size, resolution, num_faces in product(
+            args.batch_sizes,
+            args.input_sizes,
+            [tuple(map(int, r.split("x"))) for r in args.resolutions],
+            args.faces,
+        )
+    ]
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            for result in json.load(f)["results"]:
+                baseline[tuple(result[k] for k in keys)] = result
+
+    print(
+        f"{'batch':>5} {'input':>5} {'resolution':>10} {'faces':>5} {'found':>5} "
+        + f"{'img / s':>8} {'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9} "
+        + f"{'RSS (MB)':>9} {'vs baseline':>11}"
+    )
+    results = []
+    for config in configs:
+        kwargs = {
+            **config,
+            "face_size": args.face_size,
+            "state_dict": args.state_dict,
+            "cache_dir": args.cache_dir,
+            "image_path": args.image_path,
+            "repeats": args.repeats,
+            "adaptive_sizes": args.adaptive_sizes,
+        }
+        # one process per config, for its own peak RSS
+        run = subprocess.run(
+            [sys.executable, "-c", SWEEP_RUN, json.dumps(kwargs)],
+            capture_output=True,
+            text=True,
+        )
+        if run.returncode != 0:
+            error = run.stderr.strip().splitlines()[-1]
+            print(f"{config} failed: {error}")
+            continue
+        result = {**config, **json.loads(run.stdout.strip().splitlines()[-1])}
+        results.append(result)
+
+        reference = baseline.get(tuple(config[k] for k in keys))
+        change = ""
+        if reference is not None:
+            change = f"{result['throughput'] / reference['throughput'] - 1:+.1%}"
+        print(
+            f"{config['batch_size']:>5} {config['input_size']:>5} "
+            + f"{config['height']:>4}x{config['width']:<5} {config['num_faces']:>5} "
+            + f"{result['faces_per_image']:>5.1f} "
+            + f"{result['throughput']:>8.1f} "
+            + f"{result['latency_p50'] * 1e3:>9.2f} "
+            + f"{result['latency_p90'] * 1e3:>9.2f} "
+            + f"{result['latency_p99'] * 1e3:>9.2f} "
+            + f"{result['max_rss_mb']:>9.1f} {change:>11}"
+        )
+
+    if args.output is not None:
+        report = {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "face_size": args.face_size,
+            "repeats": args.repeats,
+            "adaptive_sizes": args.adaptive_sizes,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results saved at: {args.output}")
+
+
+def bench_tiling(args):
+    img = cv2.imread(args.image_path)
+    height, width = map(int, args.resolution.split("x"))
+
+    configs = {
+        "letterbox": {},
+        "tiled": {
+            "tiling": True,
+            "tile_overlap": args.tile_overlap,
+            "max_tiles": 0,
+        },
+        "tiled, no coarse": {
+            "tiling": True,
+            "tile_overlap": args.tile_overlap,
+            "coarse_pass": False,
+            "max_tiles": 0,
+        },
+        f"tiled, max {args.max_tiles}": {
+            "tiling": True,
+            "tile_overlap": args.tile_overlap,
+            "max_tiles": args.max_tiles,
+        },
+    }
+    models = {
+        name: FacePixelizer(
+            input_size=args.input_size,
+            state_dict=args.state_dict,
+            torchscript_cache=args.cache_dir,
+            **config,
+        )
+        for name, config in configs.items()
+    }
+
+    # the face to replicate is the most confident one of the source image,
+    # pasted with some context: the face is the center 2/3 of each pasted crop
+    (x1, y1, x2, y2), *_ = models["letterbox"].detect([img])[0][0]
+    cx, cy, side = (x1 + x2) // 2, (y1 + y2) // 2, max(x2 - x1, y2 - y1) * 3 // 4
+    face = img[max(cy - side, 0) : cy + side, max(cx - side, 0) : cx + side]
+
+    print(f"{'face size':>9} {'mode':>16} {'recall':>7} {'ms / img':>9}")
+    for face_size in args.face_sizes:
+        imgs = synthetic_images(img, face, args.num_faces, face_size, height, width, 1)
+        reference = grid_boxes(args.num_faces, face_size, height, width)
+        reference += np.array([1, 1, -1, -1]) * face_size // 6
+        for name, model in models.items():
+            boxes = model.detect(imgs)[0][0]
+            latency = timeit(lambda: model.detect(imgs), args.repeats)
+            recall = match_detections(reference, boxes) / args.num_faces
+            print(f"{face_size:>9} {name:>16} {recall:>7.3f} {latency * 1e3:>9.1f}")
+
+
+def bench_batching(args):
+    img = cv2.imread(args.image_path)
+    height, width = map(int, args.resolution.split("x"))
+    img = cv2.resize(img, (width, height))
+    model = FacePixelizer(
+        input_size=args.input_size,
+        state_dict=args.state_dict,
+        torchscript_cache=args.cache_dir,
+    )
+    model.warmup(list(range(1, max(args.max_batch_sizes) + 1)), [(height, width)], 1)
+
+    lock = threading.Lock()
+
+    def sequential(imgs):
+        with lock:
+            return model(imgs)
+
+    print(
+        f"{'max batch':>9} {'img / s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} "
+        + f"{'final batch':>11}"
+    )
+    for max_batch_size in args.max_batch_sizes:
+        batcher = None
+        process = sequential
+        if max_batch_size > 1:
+            budget = args.budget_ms / 1e3 if args.budget_ms else None
+            batcher = MicroBatcher(
+                model, max_batch_size, args.max_wait_ms / 1e3, budget
+            )
+            process = batcher
+
+        # closed loop clients, sending one image at a time
+        latencies = []
+        stop = time.perf_counter() + args.duration
+
+        def client():
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                process([img.copy()])
+                latencies.append(time.perf_counter() - start)
+
+        clients = [threading.Thread(target=client) for _ in range(args.clients)]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        batch_size = batcher.batch_size if batcher is not None else 1
+        print(
+            f"{max_batch_size:>9} {len(latencies) / duration:>8.1f} "
+            + f"{np.percentile(latencies, 50) * 1e3:>9.1f} "
+            + f"{np.percentile(latencies, 99) * 1e3:>9.1f} {batch_size:>11}"
+        )
+
+
+def bench_scaling(args):
+    img = cv2.imread(args.image_path)
+    height, width = map(int, args.resolution.split("x"))
+    imgs = [cv2.resize(img, (width, height))] * args.batch_size
+    num_cores = len(os.sched_getaffinity(0))
+
+    print(f"{'replicas':>8} {'threads':>7} {'img / s':>8} {'speedup':>7}")
+    reference = None
+    for replicas, threads in product(args.replicas, args.threads):
+        if replicas * threads > num_cores:
+            print(f"{replicas:>8} {threads:>7} skipped, only {num_cores} cores")
+            continue
+
+        pool = FacePixelizerPool(
+            replicas,
+            threads,
+            cores=sorted(os.sched_getaffinity(0))[: replicas * threads],
+            input_size=args.input_size,
+            state_dict=args.state_dict,
+            torchscript_cache=args.cache_dir,
+        )
+        pool.warmup([args.batch_size], [(height, width)], 1)
+
+        num_imgs = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.duration:
+            pool(imgs)
+            num_imgs += len(imgs)
+        throughput = num_imgs / (time.perf_counter() - start)
+        pool.close()
+
+        reference = reference or throughput
+        print(
+            f"{replicas:>8} {threads:>7} {throughput:>8.1f} "
+            + f"{throughput / reference:>7.2f}"
+        )
+
+
+def bench_startup(args):
+    configs = {
+        "eager": {},
+        # memory-mapped weights are only used by the traced (not frozen) model
+        "mmap": {"mmap_weights": True, "torchscript_cache": None},
+        "lazy": {"lazy_init": True},
+        "mmap, lazy": {
+            "mmap_weights": True,
+            "torchscript_cache": None,
+            "lazy_init": True,
+        },
+    }
+
+    print(
+        f"{'weights':>10} {'startup (s)':>11} {'first (ms)':>10} "
+        + f"{'RSS ready (MB)':>14} {'RSS served (MB)':>15} {'file backed':>11}"
+    )
+    for name, config in configs.items():
+        kwargs = {
+            "input_size": args.input_size,
+            "state_dict": args.state_dict,
+            "torchscript_cache": args.cache_dir,
+            **config,
+        }
+        run = subprocess.run(
+            [sys.executable, "-c", STARTUP_RUN, json.dumps(kwargs)],
+            capture_output=True,
+            text=True,
+        )
+        if run.returncode != 0:
+            print(f"{name:>10} failed: {run.stderr.strip().splitlines()[-1]}")
+            continue
+
+        result = json.loads(run.stdout.strip().splitlines()[-1])
+        print(
+            f"{name:>10} {result['startup']:>11.2f} {result['first'] * 1e3:>10.1f} "
+            + f"{result['ready']['VmRSS']:>14.1f} "
+            + f"{result['served']['VmRSS']:>15.1f} "
+            + f"{result['served']['RssFile']:>11.1f}"
+        )
+
+
+def bench_pipeline(args):
+    img = cv2.imread(args.image_path)
+    height, width = map(int, args.resolution.split("x"))
+
+    models = {
+        threads: FacePixelizer(
+            input_size=args.input_size,
+            state_dict=args.state_dict,
+            anonymization=args.anonymization,
+            emoji_path="imgs/emoji.png",
+            torchscript_cache=args.cache_dir,
+            anonymize_threads=threads,
+        )
+        for threads in args.threads
+    }
+
+    (x1, y1, x2, y2), *_ = models[args.threads[0]].detect([img])[0][0]
+    cx, cy, side = (x1 + x2) // 2, (y1 + y2) // 2, max(x2 - x1, y2 - y1) * 3 // 4
+    face = img[max(cy - side, 0) : cy + side, max(cx - side, 0) : cx + side]
+    imgs = synthetic_images(
+        img, face, args.num_faces, args.face_size, height, width, args.batch_size
+    )
+
+    print(f"{'threads':>7} {'img / s':>8} {'anonymize (ms / img)':>20}")
+    for threads, model in models.items():
+        model.warmup([args.batch_size], [(height, width)], 1)
+        batches = (imgs for _ in range(args.batches))
+        start = time.perf_counter()
+        for _ in model.pipeline(batches):
+            pass
+        throughput = args.batches * args.batch_size / (time.perf_counter() - start)
+        anonymize = model.stats()["stages"]["anonymize"]["wall_mean"]
+        print(f"{threads:>7} {throughput:>8.1f} {anonymize * 1e3:>20.2f}")
+
+
+def read_frames(args):
+    """Frames of `--video_path`, or the image of `--image_path` panning slowly."""
+    if args.video_path is not None:
+        cap = cv2.VideoCapture(args.video_path)
+        frames = []
+        while len(frames) < args.num_frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+        return frames
+
+    img = cv2.imread(args.image_path)
+    shifts = np.arange(args.num_frames) * args.speed
+    return [
+        cv2.warpAffine(
+            img,
+            np.float32([[1, 0, shift], [0, 1, 0]]),
+            img.shape[1::-1],
+            borderMode=cv2.BORDER_REFLECT,
+        )
+        for shift in shifts
+    ]
+
+
+def bench_video(args):
+    frames = read_frames(args)
+
+    print(
+        f"{'keyframe interval':>18} {'full scans':>11} {'ms / frame':>11} "
+        + f"{'recall':>7}"
+    )
+    reference = None
+    for interval in [1] + args.keyframe_intervals:
+        model = FacePixelizer(
+            input_size=args.input_size,
+            state_dict=args.state_dict,
+            keyframe_interval=interval,
+            stream_mode=args.stream_mode,
+            roi_input_size=args.roi_input_size,
+        )
+        detect, num_detections = model.detect, [0]
+
+        def counted_detect(imgs):
+            num_detections[0] += len(imgs)
+            return detect(imgs)
+
+        model.detect = counted_detect
+
+        faces = []
+        start = time.perf_counter()
+        for frame in frames:
+            faces += model.find_faces([frame])
+            model.anonymize(frame.copy(), faces[-1])
+        duration = (time.perf_counter() - start) / len(frames)
+
+        # per frame detection is the reference
+        reference = faces if reference is None else reference
+        matched = sum(match_detections(r, f) for r, f in zip(reference, faces))
+        recall = matched / max(sum(len(r) for r in reference), 1)
+        print(
+            f"{interval:>18} {num_detections[0]:>11} {duration * 1e3:>11.3f} "
+            + f"{recall:>7.3f}"
+        )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    pixelize_parser = subparsers.add_parser(
+        "pixelize", help="Per-block vs vectorized pixelization"
+    )
+    pixelize_parser.add_argument("--image_path", default="imgs/example_01.jpg")
+    pixelize_parser.add_argument("--height", default=1080, type=int)
+    pixelize_parser.add_argument("--width", default=1920, type=int)
+    pixelize_parser.add_argument("--face_size", default=64, type=int)
+    pixelize_parser.add_argument(
+        "--faces", default=[1, 10, 50, 100, 300], type=int, nargs="+"
+    )
+    pixelize_parser.add_argument("--blocks", default=6, type=int)
+    pixelize_parser.add_argument("--repeats", default=20, type=int)
+    pixelize_parser.set_defaults(func=bench_pixelize)
+
+    quantization_parser = subparsers.add_parser(
+        "quantization", help="Float32 vs INT8 RetinaFace latency and accuracy"
+    )
+    # representative images, the calibration and evaluation sets must differ
+    quantization_parser.add_argument("--image_paths", required=True)
+    quantization_parser.add_argument("--calibration_images", required=True)
+    quantization_parser.add_argument(
+        "--input_sizes", default=[256, 512], type=int, nargs="+"
+    )
+    quantization_parser.add_argument(
+        "--state_dict", default="retinaface_mobilenet_0.25.pth"
+    )
+    quantization_parser.add_argument("--repeats", default=10, type=int)
+    quantization_parser.set_defaults(func=bench_quantization)
+
+    backends_parser = subparsers.add_parser(
+        "backends", help="Traced, frozen and onnx models startup, latency and memory"
+    )
+    backends_parser.add_argument("--image_path", default="imgs/example_01.jpg")
+    backends_parser.add_argument("--input_size", default=512, type=int)
+    backends_parser.add_argument(
+        "--state_dict", default="retinaface_mobilenet_0.25.pth"
+    )
+    backends_parser.add_argument(
+        "--cache_dir", default="torchscript", help="Frozen TorchScript models"
+    )
+    backends_parser.add_argument("--intra_op_threads", default=0, type=int)
+    backends_parser.add_argument("--inter_op_threads", default=0, type=int)
+    backends_parser.add_argument("--repeats", default=20, type=int)
+    backends_parser.set_defaults(func=bench_backends)
+
+    video_parser = subparsers.add_parser(
+        "video", help="Per-frame detection vs keyframe detection + tracking / ROIs"
+    )
+    video_parser.add_argument("--video_path", default=None)
+    video_parser.add_argument("--image_path", default="imgs/example_01.jpg")
+    video_parser.add_argument("--num_frames", default=100, type=int)
+    video_parser.add_argument(
+        "--speed", default=1.0, type=float, help="Synthetic pan, in px / frame"
+    )
+    video_parser.add_argument(
+        "--keyframe_intervals", default=[5, 10, 30], type=int, nargs="+"
+    )
+    video_parser.add_argument(
+        "--stream_mode", default="track", choices=["track", "roi"]
+    )
+    video_parser.add_argument("--roi_input_size", default=128, type=int)
+    video_parser.add_argument("--input_size", default=512, type=int)
+    video_parser.add_argument("--state_dict", default="retinaface_mobilenet_0.25.pth")
+    video_parser.set_defaults(func=bench_video)
+
+    tiling_parser = subparsers.add_parser(
+        "tiling", help="Letterbox vs tiled detection recall on large images"
+    )
+    tiling_parser.add_argument("--image_path", default="imgs/example_01.jpg")
+    tiling_parser.add_argument("--resolution", default="2160x3840")
+    tiling_parser.add_argument(
+        "--face_sizes", default=[32, 64, 256], type=int, nargs="+"
+    )
+    tiling_parser.add_argument("--num_faces", default=20, type=int)
+    tiling_parser.add_argument("--tile_overlap", default=0.25, type=float)
+    tiling_parser.add_argument("--max_tiles", default=16, type=int)
+    tiling_parser.add_argument("--input_size", default=512, type=int)
+    tiling_parser.add_argument("--state_dict", default="retinaface_mobilenet_0.25.pth")
+    tiling_parser.add_argument(
+        "--cache_dir", default="torchscript", help="Frozen TorchScript models"
+    )
+    tiling_parser.add_argument("--repeats", default=3, type=int)
+    tiling_parser.set_defaults(func=bench_tiling)
+
+    batching_parser = subparsers.add_parser(
+        "batching", help="Concurrent single image clients, with micro-batching"
+    )
+    batching_parser.add_argument("--image_path", default="imgs/example_01.jpg")
+    batching_parser.add_argument("--resolution", default="720x1280")
+    batching_parser.add_argument("--clients", default=8, type=int)
+    batching_parser.add_argument(
+        "--max_batch_sizes",
+        default=[1, 4, 8],
+        type=int,
+        nargs="+",
+        help="1: requests are processed one by one",
+    )
+    batching_parser.add_argument("--max_wait_ms", default=10, type=float)
+    batching_parser.add_argument(
+        "--budget_ms", default=None, type=float, help="p99 latency budget"
+    )
+    batching_parser.add_argument("--duration", default=10, type=float)
+    batching_parser.add_argument("--input_size", default=256, type=int)
+    batching_parser.add_argument(
+        "--state_dict", default="retinaface_mobilenet_0.25.pth"
+    )
+    batching_parser.add_argument(
+        "--cache_dir", default="torchscript", help="Frozen TorchScript models"
+    )
+    batching_parser.set_defaults(func=bench_batching)
+
+    scaling_parser = subparsers.add_parser(
+        "scaling",
+        help="Throughput of data parallel replicas across replica and thread counts",
+    )
+    scaling_parser.add_argument("--image_path", default="imgs/example_01.jpg")
+    scaling_parser.add_argument("--resolution", default="720x1280")
+    scaling_parser.add_argument("--batch_size", default=16, type=int)
+    scaling_parser.add_argument("--replicas", default=[1, 2, 4], type=int, nargs="+")
+    scaling_parser.add_argument(
+        "--threads",
+        default=[1, 2, 4],
+        type=int,
+        nargs="+",
+        help="torch threads per replica, replicas x threads being at most the cores",
+    )
+    scaling_parser.add_argument("--duration", default=10, type=float)
+    scaling_parser.add_argument("--input_size", default=256, type=int)
+    scaling_parser.add_argument("--state_dict", default="retinaface_mobilenet_0.25.pth")
+    scaling_parser.add_argument(
+        "--cache_dir", default="torchscript", help="Frozen TorchScript models"
+    )
+    scaling_parser.set_defaults(func=bench_scaling)
+
+    startup_parser = subparsers.add_parser(
+        "startup",
+        help="Startup time, first request latency and RSS with memory-mapped "
+        + "and lazily loaded weights",
+    )
+    startup_parser.add_argument("--input_size", default=256, type=int)
+    startup_parser.add_argument("--state_dict", default="retinaface_mobilenet_0.25.pth")
+    startup_parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="Frozen TorchScript models (their weights are not memory-mapped)",
+    )
+    startup_parser.set_defaults(func=bench_startup)
+
+    pipeline_parser = subparsers.add_parser(
+        "pipeline",
+        help="Stream throughput with faces anonymized in a thread pool, "
+        + "overlapped with the next batch",
+    )
+    pipeline_parser.add_argument("--image_path", default="imgs/example_01.jpg")
+    pipeline_parser.add_argument("--resolution", default="1080x1920")
+    pipeline_parser.add_argument("--batch_size", default=4, type=int)
+    pipeline_parser.add_argument("--batches", default=20, type=int)
+    pipeline_parser.add_argument("--num_faces", default=20, type=int)
+    pipeline_parser.add_argument("--face_size", default=128, type=int)
+    pipeline_parser.add_argument(
+        "--anonymization", default="pixelize", choices=["pixelize", "emoji"]
+    )
+    pipeline_parser.add_argument(
+        "--threads",
+        default=[0, 2, 4],
+        type=int,
+        nargs="+",
+        help="Anonymization threads, 0: sequential",
+    )
+    pipeline_parser.add_argument("--input_size", default=512, type=int)
+    pipeline_parser.add_argument(
+        "--state_dict", default="retinaface_mobilenet_0.25.pth"
+    )
+    pipeline_parser.add_argument(
+        "--cache_dir", default="torchscript", help="Frozen TorchScript models"
+    )
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    sweep_parser = subparsers.add_parser(
+        "sweep",
+        help="Throughput, latency percentiles and peak RSS of FacePixelizer "
+        + "across batch sizes, input sizes, resolutions and faces per image",
+    )
+    sweep_parser.add_argument("--batch_sizes", default=[1, 4], type=int, nargs="+")
+    sweep_parser.add_argument("--input_sizes", default=[256, 512], type=int, nargs="+")
+    sweep_parser.add_argument(
+        "--resolutions",
+        default=["720x1280", "1080x1920"],
+        nargs="+",
+        help="Image shapes, HEIGHTxWIDTH",
+    )
+    sweep_parser.add_argument("--faces", default=[0, 5, 20], type=int, nargs="+")
+    sweep_parser.add_argument(
+        "--adaptive_sizes",
+        default=None,
+        type=int,
+        nargs="+",
+        help="Adaptive input sizes, the input size is then the largest one",
+    )
+    sweep_parser.add_argument("--face_size", default=128, type=int)
+    sweep_parser.add_argument(
+        "--image_path",
+        default="imgs/example_01.jpg",
+        help="Image the synthetic faces are cropped from",
+    )
+    sweep_parser.add_argument("--state_dict", default="retinaface_mobilenet_0.25.pth")
+    sweep_parser.add_argument(
+        "--cache_dir", default="torchscript", help="Frozen TorchScript models"
+    )
+    sweep_parser.add_argument("--repeats", default=20, type=int)
+    sweep_parser.add_argument("--output", default=None, help="JSON results")
+    sweep_parser.add_argument(
+        "--baseline", default=None, help="JSON results to compare the throughput to"
+    )
+    sweep_parser.set_defaults(func=bench_sweep)
+
+    args = parser.parse_args()
+    args.func(args)
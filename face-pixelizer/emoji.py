@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import os
+import threading
+
+import cv2
+import numpy as np
+
+
+class EmojiAnonymizer:
+    """Cover faces with an emoji.
+
+    Resizing and alpha-blending the emoji for every face of every frame is more
+    expensive than pixelization, so resized sprites are cached by size bucket
+    (with LRU eviction) and stored with premultiplied alpha: blending a face is
+    then a single multiply-add on the ROI.
+    """
+
+    def __init__(
+        self,
+        emoji_path: str = "/opt/face_pixelizer/imgs/emoji.png",
+        bucket_size: int = 8,
+        cache_size: int = 64,
+    ):
+        if not os.path.isfile(emoji_path):
+            raise FileNotFoundError(f"{emoji_path} do not exist")
+
+        emoji = cv2.imread(emoji_path, cv2.IMREAD_UNCHANGED)
+        if emoji is None or emoji.ndim != 3 or emoji.shape[2] != 4:
+            raise ValueError(f"{emoji_path} is not a BGRA image")
+
+        self.emoji = emoji
+        self.bucket_size = bucket_size
+        self.cache_size = cache_size
+        self.sprites = OrderedDict()
+        # faces may be anonymized from several threads
+        self.lock = threading.Lock()
+
+    def get_sprite(self, size: int):
+        """Get the premultiplied sprite and its inverse alpha for a face size.
+
+        The size is rounded up to the next bucket so the sprite always covers
+        the face and a handful of sprites serves every face size.
+
+        Args:
+            size: largest side of the face to cover
+        Return:
+            premultiplied BGR sprite and inverse alpha (float32),
+                Shape: [bucket, bucket, 3] and [bucket, bucket, 1]
+        """
+        bucket = -(-size // self.bucket_size) * self.bucket_size
+
+        with self.lock:
+            if bucket in self.sprites:
+                self.sprites.move_to_end(bucket)
+                return self.sprites[bucket]
+
+        sprite = cv2.resize(
+            self.emoji, (bucket, bucket), interpolation=cv2.INTER_AREA
+        ).astype(np.float32)
+        alpha = sprite[:, :, 3:] / 255
+        sprite = (sprite[:, :, :3] * alpha, 1 - alpha)
+
+        with self.lock:
+            self.sprites[bucket] = sprite
+            if len(self.sprites) > self.cache_size:
+                self.sprites.popitem(last=False)
+        return sprite
+
+    def placements(self, boxes, shape):
+        """Sprite bucket, sprite origin and clipped region of each face.
+
+        Sprites are centered on the faces and clipped to the image, faces
+        falling outside of it are skipped.
+        """
+        h, w = shape
+        for x1, y1, x2, y2 in np.array(boxes, dtype=int).reshape(-1, 4):
+            size = max(x2 - x1, y2 - y1)
+            if size <= 0:
+                continue
+            bucket = -(-size // self.bucket_size) * self.bucket_size
+            sx1 = (x1 + x2 - bucket) // 2
+            sy1 = (y1 + y2 - bucket) // 2
+            cx1, cy1 = max(sx1, 0), max(sy1, 0)
+            cx2, cy2 = min(sx1 + bucket, w), min(sy1 + bucket, h)
+            if cx1 >= cx2 or cy1 >= cy2:
+                continue
+            yield bucket, (sx1, sy1), (cx1, cy1, cx2, cy2)
+
+    def regions(self, boxes, shape):
+        """Image regions modified by `__call__`, in [x1, y1, x2, y2] format."""
+        regions = [region for _, _, region in self.placements(boxes, shape)]
+        return np.array(regions, dtype=int).reshape(-1, 4)
+
+    def __call__(self, img, boxes):
+        """Overlay an emoji on each face, in place.
+
+        Args:
+            img (np.array): image to anonymize
+            boxes (np.array): faces in [x1, y1, x2, y2] format,
+                Shape: [num_boxes, 4]
+        """
+        for bucket, (sx1, sy1), (cx1, cy1, cx2, cy2) in self.placements(
+            boxes, img.shape[:2]
+        ):
+            premultiplied, inv_alpha = self.get_sprite(bucket)
+            crop = np.s_[cy1 - sy1 : cy2 - sy1, cx1 - sx1 : cx2 - sx1]
+
+            roi = img[cy1:cy2, cx1:cx2]
+            roi[:] = roi * inv_alpha[crop] + premultiplied[crop]
+        return img
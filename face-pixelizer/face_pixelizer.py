@@ -1,8 +1,12 @@
 import argparse
-import copy
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import glob
+from itertools import product
 import os
+import threading
 import time
-from typing import List
+from typing import Dict, Hashable, Iterable, Iterator, List, Tuple
 import warnings
 
 import albumentations as A
@@ -12,13 +16,72 @@ import numpy as np
 import torch
 import torchvision
 
-from retinaface import retinaface
-from utils import decode_boxes, get_prior_box, pixelize
+from backends import (
+    LazyBackend,
+    OnnxRuntimeBackend,
+    TorchScriptBackend,
+    export_onnx,
+    onnx_artifact,
+    save_atomically,
+    torchscript_artifact,
+    trace_retinaface,
+)
+from emoji import EmojiAnonymizer
+from profiling import Profiler
+from quantization import MIN_CALIBRATION_IMAGES, detection_recall, quantize_retinaface
+from retinaface import RetinaFaceDetector, mmap_supported, retinaface
+from tracker import FaceTracker
+from utils import clip_boxes, pixelize_boxes
 
 
 warnings.simplefilter("ignore")
 
 
+def model_device(quantize: bool = False, backend: str = "torchscript") -> str:
+    """Device the model runs on, quantized kernels and onnxruntime are cpu only."""
+    use_cuda = torch.cuda.is_available() and not quantize and backend != "onnx"
+    return "cuda" if use_cuda else "cpu"
+
+
+def builds_from_weights(
+    state_dict: str,
+    input_size: int = 512,
+    quantize: bool = False,
+    backend: str = "torchscript",
+    torchscript_cache: str = None,
+    onnx_path: str = None,
+    top_k: int = 750,
+) -> bool:
+    """Whether the model is built from the state dict, or loaded from a frozen
+    TorchScript model or an ONNX export, which hold their own weights."""
+    if backend == "onnx":
+        if onnx_path is None:
+            onnx_path = onnx_artifact(state_dict, top_k)
+        return not os.path.isfile(onnx_path)
+    if torchscript_cache is None or quantize:
+        return True
+    device = model_device(quantize, backend)
+    artifact = torchscript_artifact(
+        state_dict, input_size, device, torchscript_cache, top_k
+    )
+    return not os.path.isfile(artifact)
+
+
+class StreamState:
+    """Faces seen on the previous frames of a video stream.
+
+    Args:
+        tracker: Optional; optical flow tracker ("track" stream mode)
+    """
+
+    def __init__(self, tracker: FaceTracker = None):
+        self.tracker = tracker
+        self.prev_boxes = None
+        self.prev_scores = None
+        self.prev_shape = None
+        self.since_keyframe = 0
+
+
 class FacePixelizer:
     def __init__(
         self,
@@ -26,69 +89,360 @@ class FacePixelizer:
         score_threshold: float = 0.5,
         nms_threshold: float = 0.5,
         state_dict: str = "/opt/face_pixelizer/retinaface_mobilenet_0.25.pth",
+        *,
+        top_k: int = 750,
+        pixelize_blocks: int = 6,
+        anonymization: str = "pixelize",
+        emoji_path: str = "/opt/face_pixelizer/imgs/emoji.png",
+        quantize: bool = False,
+        calibration_images: str = "/opt/face_pixelizer/calibration/*.jpg",
+        min_quantized_recall: float = 0.95,
+        backend: str = "torchscript",
+        torchscript_cache: str = None,
+        onnx_path: str = None,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        keyframe_interval: int = 1,
+        stream_mode: str = "track",
+        roi_input_size: int = 128,
+        roi_scale: float = 2.0,
+        trace_dir: str = None,
+        trace_batches: int = 10,
+        tiling: bool = False,
+        tile_overlap: float = 0.25,
+        coarse_pass: bool = True,
+        max_tiles: int = 16,
+        adaptive_sizes: List[int] = None,
+        min_face_size: int = 16,
+        weights: Dict[str, torch.Tensor] = None,
+        anonymize_threads: int = 0,
+        reuse_outputs: bool = False,
+        mmap_weights: bool = False,
+        lazy_init: bool = False,
     ):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = model_device(quantize, backend)
         self.score_threshold = score_threshold
         self.nms_threshold = nms_threshold
+        # best scored boxes kept per image before NMS, several per face: dense
+        # crowds at large input sizes need more than the default
+        self.top_k = top_k
         self.input_size = input_size
+        self.profiler = Profiler(trace_dir, trace_batches)
 
-        height, width = input_size, input_size
-
-        self.model = retinaface(state_dict)
-        self.model.eval()
-        dump_inputs = torch.randn(1, 3, height, width)
-        self.model = torch.jit.trace(self.model, dump_inputs)
-        self.model = self.model.to(self.device)
-
-        self.tf = A.Compose(
-            [
-                A.LongestMaxSize(max_size=input_size),
-                A.PadIfNeeded(
-                    min_height=height,
-                    min_width=width,
-                    border_mode=cv2.BORDER_CONSTANT,
-                    value=0,
-                ),
-            ]
-        )
+        # High resolution mode: images larger than the network input are split
+        # into overlapping tiles at native scale, optionally with a coarse pass
+        # on the whole letterboxed image for faces larger than the tiles. Images
+        # needing more than `max_tiles` tiles (0: no limit) are downscaled first
+        self.tiling = tiling
+        self.tile_overlap = tile_overlap
+        self.coarse_pass = coarse_pass
+        self.max_tiles = max_tiles
+
+        # Adaptive mode: each image runs at the smallest of these network input
+        # sizes keeping faces of `min_face_size` px detectable, so small images
+        # are not upscaled into large inputs
+        self.adaptive_sizes = sorted(adaptive_sizes) if adaptive_sizes else None
+        self.min_face_size = min_face_size
+
+        if anonymization == "pixelize":
+            self.anonymize = partial(pixelize_boxes, blocks=pixelize_blocks)
+        elif anonymization == "emoji":
+            self.anonymize = EmojiAnonymizer(emoji_path)
+        else:
+            raise ValueError(f"Unknown anonymization: {anonymization}")
+
+        # Pipelined mode: faces are anonymized in a thread pool (OpenCV and
+        # numpy release the GIL), concurrently across the images of a batch and,
+        # with `pipeline`, with the detection of the next batch
+        self.executor = None
+        if anonymize_threads > 0:
+            self.executor = ThreadPoolExecutor(anonymize_threads)
+
+        # Anonymized images are written to new arrays by default. Reused
+        # outputs are per-position buffers, overwritten by the next call
+        self.reuse_outputs = reuse_outputs
+        self.buffers = {}
+        # float copies of the preprocessed images, per thread since calls may
+        # be concurrent (micro-batching, pipeline), for the last few shapes
+        self.float_buffers = threading.local()
+        self.max_float_buffers = 4
+
+        # Video mode: imgs are consecutive frames of a stream, faces are
+        # detected on the full frame on keyframes only. In between, they are
+        # tracked ("track") or re-detected around their last position ("roi").
+        # Each stream (key given to calls) has its own state, frames of
+        # different streams must never share one: faces of a stream would be
+        # looked for where the other stream had them
+        self.stream_mode = None
+        if keyframe_interval > 1:
+            if stream_mode not in ["track", "roi"]:
+                raise ValueError(f"Unknown stream mode: {stream_mode}")
+            self.stream_mode = stream_mode
+        self.keyframe_interval = keyframe_interval
+        self.roi_input_size = roi_input_size
+        self.roi_scale = roi_scale
+        self.streams = {}
+        self.streams_lock = threading.Lock()
 
-        self.priors = get_prior_box(height, width).to(self.device)
-        self.boxes_scale = torch.Tensor([width, height] * 2).to(self.device)
+        # letterbox transforms per network input size
+        self.tfs = {}
+
+        if backend not in ["torchscript", "onnx"]:
+            raise ValueError(f"Unknown backend: {backend}")
+        if quantize and backend == "onnx":
+            raise ValueError("Quantization is not supported by the onnx backend")
+        if mmap_weights:
+            # checked before a lazy setup, so workers fail at start
+            if not mmap_supported():
+                raise ValueError("Memory-mapped weights require torch >= 2.1")
+            if backend != "torchscript" or quantize or torchscript_cache is not None:
+                raise ValueError(
+                    "Memory-mapped weights are only used by the traced model: "
+                    + "frozen (torchscript cache), exported and quantized models "
+                    + "hold their own copy"
+                )
+        setup_backend = partial(
+            self.setup_backend,
+            backend,
+            input_size,
+            state_dict,
+            weights,
+            mmap_weights,
+            quantize,
+            calibration_images,
+            min_quantized_recall,
+            torchscript_cache,
+            onnx_path,
+            intra_op_threads,
+            inter_op_threads,
+        )
+        # Lazy mode: the model is built (and its weights loaded) on first use,
+        # so idle workers start fast and hold no weights
+        if lazy_init:
+            self.model = LazyBackend(setup_backend)
+        else:
+            self.model = setup_backend()
 
         print(f"Face pixelizer setup! (on {self.device})")
 
-    def __call__(self, imgs: List[np.ndarray]) -> List[np.ndarray]:
-        # Be sure we not modify inputs
-        imgs = copy.copy(imgs)
+    def setup_backend(
+        self,
+        backend: str,
+        input_size: int,
+        state_dict: str,
+        weights: Dict[str, torch.Tensor],
+        mmap_weights: bool,
+        quantize: bool,
+        calibration_images: str,
+        min_quantized_recall: float,
+        torchscript_cache: str,
+        onnx_path: str,
+        intra_op_threads: int,
+        inter_op_threads: int,
+    ):
+        """Build the inference backend (see `__init__` arguments)."""
+        if backend == "torchscript":
+            artifact = None
+            if torchscript_cache is not None and not quantize:
+                artifact = torchscript_artifact(
+                    state_dict, input_size, self.device, torchscript_cache, self.top_k
+                )
+
+            model = None
+            if artifact is not None and os.path.isfile(artifact):
+                try:
+                    model = torch.jit.load(artifact, map_location=self.device)
+                except Exception as error:
+                    # e.g. truncated by a crash, rebuilt and saved again
+                    print(f"Can not load the cached torchscript model: {error}")
 
-        # transforms imgs to tensors
+            if model is None:
+                model = retinaface(state_dict, weights, mmap_weights)
+                model.eval()
+                if quantize:
+                    model = self.quantize(
+                        model, calibration_images, min_quantized_recall
+                    )
+                model = RetinaFaceDetector(model, self.top_k).eval()
+                model = trace_retinaface(
+                    model, input_size, self.device, freeze=artifact is not None
+                )
+                if artifact is not None:
+                    try:
+                        save_atomically(artifact, partial(torch.jit.save, model))
+                    except OSError as error:
+                        print(f"Can not cache the torchscript model: {error}")
+            return TorchScriptBackend(model)
+
+        if onnx_path is None:
+            onnx_path = onnx_artifact(state_dict, self.top_k)
+        if not os.path.isfile(onnx_path):
+            # one time export, following starts only load the onnx model
+            model = RetinaFaceDetector(
+                retinaface(state_dict, weights, mmap_weights), self.top_k
+            ).eval()
+            save_atomically(
+                onnx_path, lambda path: export_onnx(model, path, input_size)
+            )
+        return OnnxRuntimeBackend(onnx_path, intra_op_threads, inter_op_threads)
+
+    def quantize(
+        self, model: torch.nn.Module, calibration_images: str, min_recall: float
+    ) -> torch.nn.Module:
+        """Quantize RetinaFace to INT8, in place, and check its recall.
+
+        Every 4th calibration image is held out: the float32 faces found on
+        them must be found by the quantized model at `min_recall` at least.
+
+        Args:
+            model (torch.nn.Module): float32 RetinaFace in eval mode
+            calibration_images (str): glob of representative images
+            min_recall (float): recall vs float32 required on the held out images
+        Return:
+            the quantized model
+        """
+        paths = sorted(glob.glob(calibration_images))
+        if len(paths) < MIN_CALIBRATION_IMAGES:
+            raise ValueError(
+                f"Quantization needs {MIN_CALIBRATION_IMAGES} calibration images "
+                + f"at least, {len(paths)} found: {calibration_images}"
+            )
+        validation = paths[::4]
+        calibration = [p for i, p in enumerate(paths) if i % 4 != 0]
+
+        def find_boxes(model):
+            backend = TorchScriptBackend(RetinaFaceDetector(model, self.top_k).eval())
+            boxes = []
+            for path in validation:
+                img = cv2.imread(path)
+                outputs = backend(self.preprocess([img]), self.score_threshold)
+                boxes.append(self.postprocess([img], *outputs)[0][0])
+            return boxes
 
+        reference = find_boxes(model)
+        calibration_batches = (self.preprocess([cv2.imread(p)]) for p in calibration)
+        model = quantize_retinaface(model, calibration_batches)
+        recall = detection_recall(reference, find_boxes(model))
+        print(f"INT8 recall vs float32: {recall:.3f} ({len(validation)} images)")
+        if recall < min_recall:
+            raise ValueError(
+                f"INT8 recall vs float32 is {recall:.3f} < {min_recall}, "
+                + "use more representative calibration images or float32"
+            )
+        return model
+
+    def letterbox(self, size: int) -> A.Compose:
+        """Resize and pad images in a square of the given size."""
+        if size not in self.tfs:
+            self.tfs[size] = A.Compose(
+                [
+                    A.LongestMaxSize(max_size=size),
+                    A.PadIfNeeded(
+                        min_height=size,
+                        min_width=size,
+                        border_mode=cv2.BORDER_CONSTANT,
+                        value=0,
+                    ),
+                ]
+            )
+        return self.tfs[size]
+
+    def float_buffer(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """Float32 buffer of an image shape, owned by the calling thread."""
+        buffers = getattr(self.float_buffers, "buffers", None)
+        if buffers is None:
+            buffers = self.float_buffers.buffers = {}
+        if shape not in buffers:
+            if len(buffers) == self.max_float_buffers:
+                # least recently allocated shape
+                buffers.pop(next(iter(buffers)))
+            buffers[shape] = np.empty(shape, np.float32)
+        return buffers[shape]
+
+    def preprocess(self, imgs: List[np.ndarray], size: int = None) -> torch.Tensor:
+        """Letterbox images into a batch of network inputs (default: input_size)."""
+        tf = self.letterbox(size or self.input_size)
         tensors = []
         for img in imgs:
-            img = img.astype(np.float32) - (104, 117, 123)
-            img = self.tf(image=img)["image"]
+            buffer = self.float_buffer(img.shape)
+            img = np.subtract(img, (104, 117, 123), out=buffer)
+            img = tf(image=img)["image"]
+            if np.may_share_memory(img, buffer):
+                img = img.copy()
             tensor = torch.from_numpy(img).permute(2, 0, 1)
             tensors.append(tensor.unsqueeze(0))
-        tensors = torch.cat(tensors).type(torch.FloatTensor).to(self.device)
+        return torch.cat(tensors).type(torch.FloatTensor).to(self.device)
+
+    def detect(self, imgs: List[np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Detect faces.
+
+        Returns:
+            For each image, the boxes in [x1, y1, x2, y2] image coordinates
+            (int, Shape: [num_faces, 4]) and their scores (Shape: [num_faces]).
+        """
+        if self.tiling:
+            return self.detect_tiled(imgs)
+        if self.adaptive_sizes is None:
+            return self.detect_at(imgs, self.input_size)
+
+        # one sub-batch per input size
+        sizes = [self.adaptive_size(img.shape[:2]) for img in imgs]
+        faces = [None] * len(imgs)
+        for size in sorted(set(sizes)):
+            inds = [i for i, s in enumerate(sizes) if s == size]
+            detections = self.detect_at([imgs[i] for i in inds], size)
+            for i, detection in zip(inds, detections):
+                faces[i] = detection
+        return faces
+
+    def adaptive_size(self, shape: Tuple[int, int]) -> int:
+        """Smallest adaptive input size keeping `min_face_size` faces detectable.
+
+        The smallest anchors of RetinaFace are 16 px, faces of `min_face_size`
+        px must be kept above once letterboxed (the largest size at most).
+        """
+        required = max(shape) * 16 / self.min_face_size
+        for size in self.adaptive_sizes:
+            if size >= required:
+                return size
+        return self.adaptive_sizes[-1]
+
+    def detect_at(
+        self, imgs: List[np.ndarray], size: int
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Detect faces with a given network input size."""
+
+        # transforms imgs to tensors
+
+        with self.profiler.stage("preprocess"):
+            tensors = self.preprocess(imgs, size)
 
         # Inferences
 
-        with torch.no_grad():
-            boxes, scores = self.model(tensors)
+        with self.profiler.stage("model"):
+            boxes, scores, counts = self.model(tensors, self.score_threshold)
 
         # Analyze outputs
 
-        variances = [0.1, 0.2]
-        boxes = decode_boxes(boxes, self.priors, variances)
-        boxes = boxes * self.boxes_scale
-        scores = scores[:, :, 1]
+        with self.profiler.stage("postprocess"):
+            return self.postprocess(imgs, boxes, scores, counts, size)
 
-        processed_imgs = []
-        for img, boxes_per_img, scores_per_img in zip(imgs, boxes, scores):
-            # Remove low scores
-            inds = torch.gt(scores_per_img, self.score_threshold)
-            boxes_per_img = boxes_per_img[inds]
-            scores_per_img = scores_per_img[inds]
+    def postprocess(
+        self,
+        imgs: List[np.ndarray],
+        boxes: torch.Tensor,
+        scores: torch.Tensor,
+        counts: torch.Tensor,
+        size: int = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """NMS and map the model detections back to image coordinates."""
+        faces = []
+        for img, boxes_per_img, scores_per_img, count in zip(
+            imgs, boxes, scores, counts.tolist()
+        ):
+            # Remove low scores (sorted by score)
+            boxes_per_img = boxes_per_img[:count]
+            scores_per_img = scores_per_img[:count]
 
             # NMS
             keep = torchvision.ops.boxes.nms(
@@ -98,31 +452,554 @@ class FacePixelizer:
             boxes_per_img = boxes_per_img[keep]
 
             # Deaugmente results
-            original_shape = img.shape[:2]
-            scale = self.input_size / max(original_shape)
-            padding = int((self.input_size - min(original_shape) * scale) / 2)
-            for box in boxes_per_img:
-                # Remove padding
-                start_coord = 0 if np.argmax(original_shape) == 0 else 1
-                box[start_coord] -= padding
-                box[start_coord + 2] -= padding
-                # Remove scale
-                box = box / scale
-                box = box.type(torch.int)
-
-                # Apply pixelization on faces TODO: turn to correctly sized emojis
-                img[box[1] : box[3], box[0] : box[2]] = pixelize(
-                    img[box[1] : box[3], box[0] : box[2]]
+            boxes_per_img = self.unletterbox(boxes_per_img, img.shape[:2], size)
+            boxes_per_img = boxes_per_img.type(torch.int)
+            faces.append((boxes_per_img.cpu().numpy(), scores_per_img.cpu().numpy()))
+
+        return faces
+
+    def unletterbox(
+        self, boxes: torch.Tensor, shape: Tuple[int, int], size: int = None
+    ) -> torch.Tensor:
+        """Map boxes of a letterboxed network input back to the image, in place."""
+        size = size or self.input_size
+        scale = size / max(shape)
+        padding = int((size - min(shape) * scale) / 2)
+        # Remove padding
+        start_coord = 0 if np.argmax(shape) == 0 else 1
+        boxes[:, [start_coord, start_coord + 2]] -= padding
+        # Remove scale
+        return boxes / scale
+
+    def tile_origins(self, height: int, width: int) -> List[Tuple[int, int]]:
+        """Top left (x, y) corners of overlapping tiles covering an image."""
+        size = self.input_size
+        stride = max(int(size * (1 - self.tile_overlap)), 1)
+
+        def starts(length):
+            if length <= size:
+                return [0]
+            return list(range(0, length - size, stride)) + [length - size]
+
+        return [(x, y) for y in starts(height) for x in starts(width)]
+
+    def tiling_scale(self, height: int, width: int) -> float:
+        """Largest scale (at most 1) of an image tiled in `max_tiles` tiles."""
+        if self.max_tiles <= 0:
+            return 1.0
+        if len(self.tile_origins(height, width)) <= self.max_tiles:
+            return 1.0
+        size = self.input_size
+        stride = max(int(size * (1 - self.tile_overlap)), 1)
+        # n tiles cover up to size + (n - 1) * stride px along a side
+        return max(
+            min(
+                (size + (cols - 1) * stride) / width,
+                (size + (self.max_tiles // cols - 1) * stride) / height,
+            )
+            for cols in range(1, self.max_tiles + 1)
+        )
+
+    def detect_tiled(
+        self, imgs: List[np.ndarray]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Detect faces in overlapping tiles at native scale.
+
+        Tiles of every image (and their coarse letterboxed versions) have the
+        network input size and go through the model in a single batch, so the
+        cost grows linearly with the image area, up to `max_tiles` tiles per
+        image: larger images are downscaled to fit. Detections are merged
+        across tiles with NMS, and boxes cut by a tile border are dropped when
+        they are mostly covered by an uncut detection (the same face, from
+        another tile or the coarse pass).
+
+        Returns:
+            For each image, the boxes in [x1, y1, x2, y2] image coordinates
+            (int, Shape: [num_faces, 4]) and their scores (Shape: [num_faces]).
+        """
+        size = self.input_size
+
+        with self.profiler.stage("preprocess"):
+            # small images gain nothing from tiling, they only get the coarse pass
+            tiled = [max(img.shape[:2]) > size for img in imgs]
+            coarse = [i for i, t in enumerate(tiled) if self.coarse_pass or not t]
+
+            tiles, tile_owners, tile_origins = [], [], []
+            scales, shapes = [1.0] * len(imgs), [img.shape[:2] for img in imgs]
+            for i, img in enumerate(imgs):
+                if not tiled[i]:
+                    continue
+                h, w = img.shape[:2]
+                scales[i] = self.tiling_scale(h, w)
+                if scales[i] < 1:
+                    h, w = int(h * scales[i]), int(w * scales[i])
+                    img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+                    shapes[i] = (h, w)
+                normalized = img.astype(np.float32) - np.float32((104, 117, 123))
+                for x, y in self.tile_origins(h, w):
+                    # zero padding of the tiles overflowing a small side
+                    tile = np.zeros((size, size, 3), dtype=np.float32)
+                    crop = normalized[y : y + size, x : x + size]
+                    tile[: crop.shape[0], : crop.shape[1]] = crop
+                    tiles.append(torch.from_numpy(tile).permute(2, 0, 1))
+                    tile_owners.append(i)
+                    tile_origins.append((x, y))
+
+            tensors = [self.preprocess([imgs[i] for i in coarse])] if coarse else []
+            if tiles:
+                tensors.append(torch.stack(tiles).to(self.device))
+            tensors = torch.cat(tensors)
+
+        with self.profiler.stage("model"):
+            boxes, scores, counts = self.model(tensors, self.score_threshold)
+
+        with self.profiler.stage("postprocess"):
+            counts = counts.tolist()
+            detections = [[] for _ in imgs]
+
+            for row, i in enumerate(coarse):
+                count = counts[row]
+                img_boxes = self.unletterbox(boxes[row, :count], imgs[i].shape[:2])
+                cut = torch.zeros(count, dtype=torch.bool, device=boxes.device)
+                detections[i].append((img_boxes, scores[row, :count], cut))
+
+            for row, i, (x, y) in zip(
+                range(len(coarse), len(tensors)), tile_owners, tile_origins
+            ):
+                count = counts[row]
+                tile_boxes = boxes[row, :count]
+                h, w = shapes[i]
+                # borders shared with another tile, image borders do not cut faces
+                cut = torch.zeros(count, dtype=torch.bool, device=boxes.device)
+                margin = size // 32
+                if x > 0:
+                    cut |= tile_boxes[:, 0] <= margin
+                if y > 0:
+                    cut |= tile_boxes[:, 1] <= margin
+                if x + size < w:
+                    cut |= tile_boxes[:, 2] >= size - margin
+                if y + size < h:
+                    cut |= tile_boxes[:, 3] >= size - margin
+                tile_boxes = tile_boxes + tile_boxes.new_tensor([x, y, x, y])
+                tile_boxes = tile_boxes / scales[i]
+                detections[i].append((tile_boxes, scores[row, :count], cut))
+
+            faces = []
+            for img_detections in detections:
+                img_boxes, img_scores, cut = map(torch.cat, zip(*img_detections))
+                img_boxes, img_scores = self.merge_tiles(img_boxes, img_scores, cut)
+                faces.append(
+                    (
+                        img_boxes.type(torch.int).cpu().numpy(),
+                        img_scores.cpu().numpy(),
+                    )
                 )
-            processed_imgs.append(img)
+            return faces
+
+    def merge_tiles(
+        self, boxes: torch.Tensor, scores: torch.Tensor, cut: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Cross-tile NMS, then drop cut boxes mostly covered by an uncut one."""
+        keep = torchvision.ops.boxes.nms(boxes, scores, self.nms_threshold)
+        boxes, scores, cut = boxes[keep], scores[keep], cut[keep]
+        if not cut.any() or cut.all():
+            return boxes, scores
+
+        top_left = torch.max(boxes[:, None, :2], boxes[None, :, :2])
+        bottom_right = torch.min(boxes[:, None, 2:], boxes[None, :, 2:])
+        inter = (bottom_right - top_left).clamp(min=0).prod(dim=2)
+        areas = (boxes[:, 2:] - boxes[:, :2]).prod(dim=1).clamp(min=1)
+        covered = inter / areas[:, None]
+        # only complete faces can cover a part of a face
+        covered[:, cut] = 0
+        covered.fill_diagonal_(0)
+        keep = ~(cut & (covered.max(dim=1).values > 0.5))
+        return boxes[keep], scores[keep]
+
+    def stream_state(self, stream: Hashable = None) -> StreamState:
+        """State of a video stream, created on its first frame."""
+        with self.streams_lock:
+            if stream not in self.streams:
+                tracker = None
+                if self.stream_mode == "track":
+                    tracker = FaceTracker(self.keyframe_interval)
+                self.streams[stream] = StreamState(tracker)
+            return self.streams[stream]
+
+    def track(
+        self, img: np.ndarray, state: StreamState
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the faces of a video frame, running the detector only if needed.
+
+        Returns:
+            boxes in [x1, y1, x2, y2] image coordinates (int, Shape: [num_faces, 4])
+            and their scores on the last keyframe (Shape: [num_faces])
+        """
+        with self.profiler.stage("track"):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            boxes = state.tracker.propagate(gray)
+        if boxes is None:
+            boxes, state.prev_scores = self.detect([img])[0]
+            state.tracker.reset(gray, boxes)
+        return boxes.astype(int), state.prev_scores
+
+    def detect_rois(
+        self, img: np.ndarray, prev_boxes: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Re-detect faces in square crops around previously seen faces.
+
+        All crops are resized to `roi_input_size` and go through the network in
+        a single batch, detections are then mapped back to the frame and merged
+        with NMS since crops of close faces overlap.
+
+        Returns:
+            boxes in [x1, y1, x2, y2] image coordinates (int, Shape: [num_faces, 4])
+            and their scores (Shape: [num_faces])
+        """
+        if len(prev_boxes) == 0:
+            return np.zeros((0, 4), dtype=int), np.zeros(0, dtype=np.float32)
+
+        size = self.roi_input_size
+        centers = (prev_boxes[:, :2] + prev_boxes[:, 2:]) / 2
+        sides = np.maximum((prev_boxes[:, 2:] - prev_boxes[:, :2]).max(axis=1), 1)
+        sides = np.ceil(sides * self.roi_scale).astype(int)
+        origins = (centers - sides[:, None] / 2).astype(int)
+
+        with self.profiler.stage("roi_preprocess"):
+            tensors = self.crop_rois(img, origins, sides)
+
+        with self.profiler.stage("roi_model"):
+            boxes, scores, counts = self.model(tensors, self.score_threshold)
+
+        with self.profiler.stage("roi_postprocess"):
+            # crop pixels to frame coordinates
+            ratios = torch.from_numpy(sides / size).float().to(self.device)
+            origins = torch.from_numpy(origins).float().to(self.device)
+            boxes = boxes * ratios[:, None, None] + origins.repeat(1, 2)[:, None]
+
+            # Remove low scores (sorted by score)
+            inds = torch.arange(scores.shape[1], device=scores.device)[None]
+            inds = inds < counts[:, None].to(scores.device)
+            boxes, scores = boxes[inds], scores[inds]
+            keep = torchvision.ops.boxes.nms(boxes, scores, self.nms_threshold)
+            return (
+                boxes[keep].type(torch.int).cpu().numpy(),
+                scores[keep].cpu().numpy(),
+            )
+
+    def crop_rois(
+        self, img: np.ndarray, origins: np.ndarray, sides: np.ndarray
+    ) -> torch.Tensor:
+        """Zero padded square crops, resized into a batch of network inputs."""
+        h, w = img.shape[:2]
+        size = self.roi_input_size
+        crops = []
+        for (x1, y1), side in zip(origins, sides):
+            # zero padding outside the frame, as for the letterbox
+            crop = np.zeros((side, side, 3), dtype=np.float32)
+            cx1, cy1 = max(x1, 0), max(y1, 0)
+            cx2, cy2 = min(x1 + side, w), min(y1 + side, h)
+            if cx1 < cx2 and cy1 < cy2:
+                crop[cy1 - y1 : cy2 - y1, cx1 - x1 : cx2 - x1] = img[
+                    cy1:cy2, cx1:cx2
+                ] - np.float32((104, 117, 123))
+            crop = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+            crops.append(torch.from_numpy(crop).permute(2, 0, 1))
+        return torch.stack(crops).to(self.device)
+
+    def redetect(
+        self, img: np.ndarray, state: StreamState
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the faces of a video frame, scanning the full frame on keyframes.
+
+        Returns:
+            boxes in [x1, y1, x2, y2] image coordinates (int, Shape: [num_faces, 4])
+            and their scores (Shape: [num_faces])
+        """
+        if (
+            state.prev_boxes is None
+            or state.prev_shape != img.shape
+            or state.since_keyframe + 1 >= self.keyframe_interval
+        ):
+            boxes, scores = self.detect([img])[0]
+            state.since_keyframe = 0
+        else:
+            boxes, scores = self.detect_rois(img, state.prev_boxes)
+            state.since_keyframe += 1
+
+        state.prev_boxes, state.prev_shape = boxes, img.shape
+        return boxes, scores
+
+    def reset_stream(self, stream: Hashable = None):
+        """End a stream in video mode, its next frame would be a keyframe."""
+        with self.streams_lock:
+            self.streams.pop(stream, None)
+
+    def find_detections(
+        self, imgs: List[np.ndarray], stream: Hashable = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Get the face boxes and scores of each image, according to the stream mode.
+
+        Args:
+            imgs: BGR images, consecutive frames of `stream` in video mode
+            stream: Optional; key of the video stream of the frames
+        """
+        if self.stream_mode == "track":
+            state = self.stream_state(stream)
+            detections = [self.track(img, state) for img in imgs]
+        elif self.stream_mode == "roi":
+            state = self.stream_state(stream)
+            detections = [self.redetect(img, state) for img in imgs]
+        else:
+            detections = self.detect(imgs)
+
+        for boxes, _ in detections:
+            self.profiler.add_faces(len(boxes))
+        return detections
+
+    def find_faces(
+        self, imgs: List[np.ndarray], stream: Hashable = None
+    ) -> List[np.ndarray]:
+        """Get the face boxes of each image, according to the stream mode."""
+        return [boxes for boxes, _ in self.find_detections(imgs, stream)]
+
+    def output_buffers(
+        self,
+        imgs: List[np.ndarray],
+        inplace: bool = False,
+        outputs: List[np.ndarray] = None,
+        slot: int = 0,
+    ) -> List[np.ndarray]:
+        """Arrays the anonymized images are written to.
+
+        Args:
+            imgs: images to anonymize
+            inplace: the images themselves
+            outputs: Optional; caller provided buffers, of the images shapes
+            slot: set of reused buffers (with `reuse_outputs`)
+        """
+        if inplace:
+            if outputs is not None:
+                raise ValueError("Outputs can not be given in place")
+            return imgs
+
+        if outputs is not None:
+            if len(outputs) != len(imgs) or any(
+                output.shape != img.shape or output.dtype != img.dtype
+                for img, output in zip(imgs, outputs)
+            ):
+                raise ValueError("Outputs must have the shapes of the images")
+            return outputs
+
+        if not self.reuse_outputs:
+            return [np.empty_like(img) for img in imgs]
+
+        buffers = self.buffers.setdefault(slot, [])
+        for i, img in enumerate(imgs):
+            if i == len(buffers):
+                buffers.append(np.empty_like(img))
+            elif buffers[i].shape != img.shape or buffers[i].dtype != img.dtype:
+                buffers[i] = np.empty_like(img)
+        return buffers[: len(imgs)]
+
+    def anonymize_image(
+        self, img: np.ndarray, boxes: np.ndarray, output: np.ndarray
+    ) -> np.ndarray:
+        with self.profiler.stage("anonymize"):
+            if output is not img:
+                np.copyto(output, img)
+            return self.anonymize(output, boxes)
+
+    def submit(
+        self,
+        imgs: List[np.ndarray],
+        outputs: List[np.ndarray],
+        stream: Hashable = None,
+    ) -> List:
+        """Detect faces and start their anonymization in the thread pool."""
+        faces = self.find_faces(imgs, stream)
+        return [
+            self.executor.submit(self.anonymize_image, img, boxes, output)
+            for img, boxes, output in zip(imgs, faces, outputs)
+        ]
+
+    def __call__(
+        self,
+        imgs: List[np.ndarray],
+        inplace: bool = False,
+        outputs: List[np.ndarray] = None,
+        stream: Hashable = None,
+    ) -> List[np.ndarray]:
+        """Anonymize images.
+
+        Args:
+            imgs: BGR images
+            inplace: anonymize the images themselves, no output is allocated
+            outputs: Optional; buffers the anonymized images are written to,
+                of the images shapes. By default, new arrays, or buffers reused
+                across calls (valid until the next one) with `reuse_outputs`
+            stream: Optional; key of the video stream of the frames (video mode)
+        Returns:
+            the anonymized images, `imgs` in place or `outputs` if given
+        """
+        with self.profiler.batch(len(imgs)):
+            outputs = self.output_buffers(imgs, inplace, outputs)
+            if self.executor is not None:
+                futures = self.submit(imgs, outputs, stream)
+                return [future.result() for future in futures]
+
+            # Anonymize faces
+            processed_imgs = []
+            faces = self.find_faces(imgs, stream)
+            for img, boxes, output in zip(imgs, faces, outputs):
+                processed_imgs.append(self.anonymize_image(img, boxes, output))
 
         return processed_imgs
 
+    def pipeline(
+        self,
+        batches: Iterable[List[np.ndarray]],
+        inplace: bool = False,
+        stream: Hashable = None,
+    ) -> Iterator[List[np.ndarray]]:
+        """Anonymize a stream of batches, in order.
+
+        With `anonymize_threads`, faces of a batch are anonymized in the thread
+        pool while the next batch is preprocessed and run through the model.
+        Each batch is accounted with the wait for the previous one's faces.
+        With `reuse_outputs`, outputs are valid until the next batch is read.
+
+        Args:
+            batches: batches of BGR images
+            inplace: anonymize the images themselves (see `__call__`)
+            stream: Optional; key of the video stream of the frames (video mode)
+        """
+        if self.executor is None:
+            for imgs in batches:
+                yield self(imgs, inplace, stream=stream)
+            return
+
+        pending = None
+        for i, imgs in enumerate(batches):
+            with self.profiler.batch(len(imgs)):
+                # two sets of buffers, the previous batch is still anonymized
+                outputs = self.output_buffers(imgs, inplace, slot=1 + i % 2)
+                futures = self.submit(imgs, outputs, stream)
+                if pending is not None:
+                    with self.profiler.stage("anonymize wait"):
+                        processed_imgs = [future.result() for future in pending]
+            if pending is not None:
+                yield processed_imgs
+            pending = futures
+
+        if pending is not None:
+            yield [future.result() for future in pending]
+
+    def patches(
+        self, imgs: List[np.ndarray], stream: Hashable = None
+    ) -> List[List[Tuple[Tuple[int, int], np.ndarray]]]:
+        """Anonymize images in place and get their modified regions only.
+
+        Clients having the original images only need these patches to rebuild
+        the anonymized images. Patches hold the final pixels, so overlapping
+        ones can be pasted in any order.
+
+        Args:
+            imgs: BGR images
+            stream: Optional; key of the video stream of the frames (video mode)
+        Returns:
+            For each image, the (x, y) origin and pixels of each modified region
+        """
+        with self.profiler.batch(len(imgs)):
+            outputs = []
+            for img, boxes in zip(imgs, self.find_faces(imgs, stream)):
+                with self.profiler.stage("anonymize"):
+                    if isinstance(self.anonymize, EmojiAnonymizer):
+                        regions = self.anonymize.regions(boxes, img.shape[:2])
+                    else:
+                        regions = clip_boxes(boxes, img.shape[:2])
+                    self.anonymize(img, boxes)
+                    outputs.append(
+                        [
+                            ((x1, y1), img[y1:y2, x1:x2])
+                            for x1, y1, x2, y2 in regions
+                            if x1 < x2 and y1 < y2
+                        ]
+                    )
+
+        return outputs
+
+    def stats(self, reset: bool = False) -> dict:
+        """Per-stage timings, batch sizes and faces per image since the last reset.
+
+        Args:
+            reset: start a new accounting period once the stats are read
+        """
+        return self.profiler.stats(reset)
+
+    def warmup(
+        self,
+        batch_sizes: List[int] = [1],
+        shapes: List[Tuple[int, int]] = [(720, 1280)],
+        iterations: int = 3,
+    ) -> Dict[Tuple[int, int, int], Tuple[float, float]]:
+        """Run representative batches before serving real requests.
+
+        The first calls for a given shape pay for allocator growth and JIT
+        profiling passes, warming up keeps this cost off the first requests.
+
+        Args:
+            batch_sizes: batch sizes to warm up
+            shapes: images (height, width) to warm up
+            iterations: steady state calls after the first one (0 to disable)
+        Returns:
+            first call and median steady state latencies (secs) per
+            (batch size, height, width)
+        """
+        stats = {}
+        if iterations <= 0:
+            return stats
+
+        if self.adaptive_sizes is not None:
+            # also images running at each adaptive size
+            sides = [size * self.min_face_size // 16 for size in self.adaptive_sizes]
+            shapes = list(shapes) + [(side, side) for side in sides]
+
+        for batch_size, (height, width) in product(batch_sizes, shapes):
+            imgs = [
+                np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+                for _ in range(batch_size)
+            ]
+            # in "roi" stream mode, the crops batch also needs a warm-up
+            boxes = np.array([[0, 0, height // 4, height // 4]] * batch_size)
+
+            durations = []
+            for _ in range(iterations + 1):
+                start = time.perf_counter()
+                self.detect(imgs)
+                if self.stream_mode == "roi":
+                    self.detect_rois(imgs[0], boxes)
+                durations.append(time.perf_counter() - start)
+
+            first, steady = durations[0], float(np.median(durations[1:]))
+            stats[(batch_size, height, width)] = (first, steady)
+            print(
+                f"warm-up {batch_size} x {height}x{width}: first call "
+                + f"{first * 1e3:.1f} ms, steady state {steady * 1e3:.1f} ms"
+            )
+
+        # warm-up calls are not representative of the served requests
+        self.profiler.reset()
+        return stats
+
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--image_path", type=str)
+    parser.add_argument(
+        "--anonymization", default="pixelize", choices=["pixelize", "emoji"]
+    )
     args = parser.parse_args()
 
     if not os.path.isfile(args.image_path):
@@ -136,7 +1013,10 @@ if __name__ == "__main__":
     # Setup model
 
     face_pixelizer = FacePixelizer(
-        input_size=512, state_dict="retinaface_mobilenet_0.25.pth"
+        input_size=512,
+        state_dict="retinaface_mobilenet_0.25.pth",
+        anonymization=args.anonymization,
+        emoji_path="imgs/emoji.png",
     )
 
     # Inference
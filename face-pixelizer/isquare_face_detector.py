@@ -0,0 +1,28 @@
+from archipel.workers.worker import ImagesToDictsWorker
+import numpy as np
+
+from isquare_worker import FacePixelizerWorker
+
+
+__task_class_name__ = "ArchipelFaceDetector"
+
+
+class ArchipelFaceDetector(FacePixelizerWorker, ImagesToDictsWorker):
+    """Send back face detections only, images are anonymized by the client.
+
+    For each image: {"boxes": [[x1, y1, x2, y2], ...], "scores": [...]}, a few
+    bytes per face instead of a whole re-encoded image.
+    """
+
+    def process(self, imgs):
+        with self.model.profiler.batch(len(imgs)):
+            detections = self.model.find_detections(imgs)
+        self.log_stats()
+
+        return [
+            {
+                "boxes": boxes.astype(int).tolist(),
+                "scores": np.round(scores.astype(float), 3).tolist(),
+            }
+            for boxes, scores in detections
+        ]
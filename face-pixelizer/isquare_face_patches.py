@@ -0,0 +1,29 @@
+from archipel.workers.worker import ImagesToDictsWorker
+import cv2
+
+from isquare_worker import FacePixelizerWorker
+
+
+__task_class_name__ = "ArchipelFacePatches"
+
+
+class ArchipelFacePatches(FacePixelizerWorker, ImagesToDictsWorker):
+    """Send back the anonymized regions only, pasted on the images by the client.
+
+    For each image: {"origins": [[x, y], ...], "patches": [png, ...]}, with
+    lossless PNG patches (flat pixelized blocks compress well).
+    """
+
+    def process(self, imgs):
+        outputs = []
+        for patches in self.model.patches(imgs):
+            outputs.append(
+                {
+                    "origins": [[int(x), int(y)] for (x, y), _ in patches],
+                    "patches": [
+                        cv2.imencode(".png", patch)[1].tobytes() for _, patch in patches
+                    ],
+                }
+            )
+        self.log_stats()
+        return outputs
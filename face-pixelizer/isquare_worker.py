@@ -0,0 +1,362 @@
+import time
+
+from batching import MicroBatcher
+from face_pixelizer import FacePixelizer
+from replicas import FacePixelizerPool
+
+
+class FacePixelizerWorker:
+    """Arguments, FacePixelizer setup and stats logging shared by face workers.
+
+    Mixed in archipel workers, e.g. `class Worker(FacePixelizerWorker,
+    ImagesToImagesWorker)`, which only have to implement `process`, the
+    processing of a batch (micro-batched across requests if enabled).
+    """
+
+    def add_model_specific_args(self, parent_parser):
+        parent_parser.add_argument(
+            "--input-size",
+            default=256,
+            type=int,
+            help="Network input size, imgs will resized in a square of this size",
+        )
+        parent_parser.add_argument(
+            "--score-threshold",
+            default=0.4,
+            type=float,
+            help="Discords all results with confidence score < score-threshold",
+        )
+        parent_parser.add_argument(
+            "--nms-threshold",
+            default=0.4,
+            type=float,
+            help="Discards all overlapping boxes with IoU > nms-threshold",
+        )
+        parent_parser.add_argument(
+            "--top-k",
+            default=750,
+            type=int,
+            help="Best scored boxes kept per image before NMS, several per face. "
+            + "Crowds of 200+ faces at input sizes above 512 need more",
+        )
+        parent_parser.add_argument(
+            "--state-dict",
+            default="/opt/face_pixelizer/retinaface_mobilenet_0.25.pth",
+            type=str,
+            help="Path to pretrained weights",
+        )
+        parent_parser.add_argument(
+            "--pixelize-blocks",
+            default=6,
+            type=int,
+            help="Number of blocks per side used to pixelize each face",
+        )
+        parent_parser.add_argument(
+            "--anonymization",
+            default="pixelize",
+            choices=["pixelize", "emoji"],
+            type=str,
+            help="How faces are anonymized: pixelized or covered by an emoji",
+        )
+        parent_parser.add_argument(
+            "--emoji-path",
+            default="/opt/face_pixelizer/imgs/emoji.png",
+            type=str,
+            help="Path to the BGRA emoji used with '--anonymization emoji'",
+        )
+        parent_parser.add_argument(
+            "--quantize",
+            action="store_true",
+            help="Run an INT8 quantized model (cpu only, experimental: its recall "
+            + "vs float32 depends on the calibration images, see the README)",
+        )
+        parent_parser.add_argument(
+            "--calibration-images",
+            default="/opt/face_pixelizer/calibration/*.jpg",
+            type=str,
+            help="Glob of the images used to calibrate the quantized model: "
+            + "representative images of the deployment, 32 at least",
+        )
+        parent_parser.add_argument(
+            "--min-quantized-recall",
+            default=0.95,
+            type=float,
+            help="Recall vs float32 the quantized model must reach on the held out "
+            + "calibration images, or the worker fails at start",
+        )
+        parent_parser.add_argument(
+            "--backend",
+            default="torchscript",
+            choices=["torchscript", "onnx"],
+            type=str,
+            help="Inference backend, onnx runs with onnxruntime on cpu",
+        )
+        parent_parser.add_argument(
+            "--torchscript-cache",
+            default="/opt/face_pixelizer/torchscript",
+            type=str,
+            help="Directory of frozen TorchScript models (keyed by weights hash, "
+            + "input size and device), the model is traced and saved there if "
+            + "missing (empty to disable)",
+        )
+        parent_parser.add_argument(
+            "--onnx-path",
+            default=None,
+            type=str,
+            help="ONNX model, exported from the state dict if missing",
+        )
+        parent_parser.add_argument(
+            "--intra-op-threads",
+            default=0,
+            type=int,
+            help="onnxruntime threads used inside an operator (0: default)",
+        )
+        parent_parser.add_argument(
+            "--inter-op-threads",
+            default=0,
+            type=int,
+            help="onnxruntime threads used across operators (0: default)",
+        )
+        parent_parser.add_argument(
+            "--keyframe-interval",
+            default=1,
+            type=int,
+            help="Video mode: scan full frames for faces every N frames only, "
+            + "requires '--single-stream'",
+        )
+        parent_parser.add_argument(
+            "--single-stream",
+            action="store_true",
+            help="Video mode: the worker serves a single client stream. Requests "
+            + "can not be told apart by client, frames of several streams would "
+            + "share the same video state and faces could be missed",
+        )
+        parent_parser.add_argument(
+            "--stream-mode",
+            default="track",
+            choices=["track", "roi"],
+            type=str,
+            help="Video mode: between keyframes, track faces with optical flow "
+            + "or re-detect them in crops around their last position",
+        )
+        parent_parser.add_argument(
+            "--roi-input-size",
+            default=128,
+            type=int,
+            help="Video mode 'roi': network input size of the crops",
+        )
+        parent_parser.add_argument(
+            "--tiling",
+            action="store_true",
+            help="Detect faces of images larger than the input size in "
+            + "overlapping tiles at native scale, batched in a single forward. "
+            + "The cost grows with the image area: a 4K image is 60 tiles at input "
+            + "size 512, about 25x the letterbox latency, see --max-tiles",
+        )
+        parent_parser.add_argument(
+            "--tile-overlap",
+            default=0.25,
+            type=float,
+            help="Tiling: overlap between neighbour tiles, relative to their size",
+        )
+        parent_parser.add_argument(
+            "--no-coarse-pass",
+            action="store_true",
+            help="Tiling: skip the full image pass catching faces larger than tiles",
+        )
+        parent_parser.add_argument(
+            "--max-tiles",
+            default=16,
+            type=int,
+            help="Tiling: images needing more tiles are downscaled to fit (0: no "
+            + "limit). 16 keeps 1080p images at native scale and halves 4K ones, "
+            + "about 5x the letterbox latency",
+        )
+        parent_parser.add_argument(
+            "--adaptive-sizes",
+            default=None,
+            type=int,
+            nargs="+",
+            help="Run each image at the smallest of these input sizes keeping "
+            + "faces of '--min-face-size' px detectable (instead of '--input-size')",
+        )
+        parent_parser.add_argument(
+            "--min-face-size",
+            default=16,
+            type=int,
+            help="Adaptive sizes: smallest faces to detect, in image px",
+        )
+        parent_parser.add_argument(
+            "--mmap-weights",
+            action="store_true",
+            help="Memory-map the state dict, shared with other processes through "
+            + "the page cache. Requires torch >= 2.1 (not the pinned 1.7) and "
+            + "--torchscript-cache '' (frozen models fold their weights)",
+        )
+        parent_parser.add_argument(
+            "--lazy-init",
+            action="store_true",
+            help="Build the model on the first request (skips the warm-up)",
+        )
+        parent_parser.add_argument(
+            "--anonymize-threads",
+            default=0,
+            type=int,
+            help="Anonymize the images of a batch concurrently in N threads "
+            + "(0: sequentially)",
+        )
+        parent_parser.add_argument(
+            "--max-batch-size",
+            default=0,
+            type=int,
+            help="Micro-batching: gather concurrent requests in batches of up to "
+            + "N images (0 to disable, images of each request are then a batch)",
+        )
+        parent_parser.add_argument(
+            "--max-wait-ms",
+            default=10,
+            type=float,
+            help="Micro-batching: maximal time a request waits for others",
+        )
+        parent_parser.add_argument(
+            "--latency-budget-ms",
+            default=0,
+            type=float,
+            help="Micro-batching: adapt the batch size to keep the p99 request "
+            + "latency under this budget (0 to disable)",
+        )
+        parent_parser.add_argument(
+            "--replicas",
+            default=1,
+            type=int,
+            help="Run N model replicas in their own processes, pinned to "
+            + "disjoint core sets, batches being sharded across them",
+        )
+        parent_parser.add_argument(
+            "--threads-per-replica",
+            default=0,
+            type=int,
+            help="Replicas: torch threads of each replica (0: its number of cores)",
+        )
+
+        parent_parser.add_argument(
+            "--warmup-batch-sizes",
+            default=[1],
+            type=int,
+            nargs="+",
+            help="Batch sizes run before the worker is ready",
+        )
+        parent_parser.add_argument(
+            "--warmup-shapes",
+            default=["720x1280"],
+            type=str,
+            nargs="+",
+            help="Image shapes (HEIGHTxWIDTH) run before the worker is ready",
+        )
+        parent_parser.add_argument(
+            "--warmup-iterations",
+            default=3,
+            type=int,
+            help="Steady state calls per warm-up shape (0 to disable the warm-up)",
+        )
+        parent_parser.add_argument(
+            "--stats-interval",
+            default=60,
+            type=float,
+            help="Log per-stage timings every N secs (0 to disable)",
+        )
+        parent_parser.add_argument(
+            "--trace-dir",
+            default=None,
+            type=str,
+            help="Capture the first batches with the torch profiler, "
+            + "a chrome trace is saved in this directory",
+        )
+        parent_parser.add_argument(
+            "--trace-batches",
+            default=10,
+            type=int,
+            help="Number of batches captured with '--trace-dir'",
+        )
+
+    def setup_model(self):
+        if self.args.keyframe_interval > 1 and not self.args.single_stream:
+            raise ValueError(
+                "Video mode keeps the faces of the previous frames, it needs "
+                + "--single-stream (one client streaming to the worker)"
+            )
+        if self.args.max_batch_size > 0 and self.args.keyframe_interval > 1:
+            raise ValueError(
+                "Micro-batching mixes streams, it needs keyframe-interval 1"
+            )
+
+        kwargs = dict(
+            input_size=self.args.input_size,
+            score_threshold=self.args.score_threshold,
+            nms_threshold=self.args.nms_threshold,
+            top_k=self.args.top_k,
+            state_dict=self.args.state_dict,
+            pixelize_blocks=self.args.pixelize_blocks,
+            anonymization=self.args.anonymization,
+            emoji_path=self.args.emoji_path,
+            quantize=self.args.quantize,
+            calibration_images=self.args.calibration_images,
+            min_quantized_recall=self.args.min_quantized_recall,
+            backend=self.args.backend,
+            torchscript_cache=self.args.torchscript_cache or None,
+            onnx_path=self.args.onnx_path,
+            intra_op_threads=self.args.intra_op_threads,
+            inter_op_threads=self.args.inter_op_threads,
+            keyframe_interval=self.args.keyframe_interval,
+            stream_mode=self.args.stream_mode,
+            roi_input_size=self.args.roi_input_size,
+            trace_dir=self.args.trace_dir,
+            trace_batches=self.args.trace_batches,
+            tiling=self.args.tiling,
+            tile_overlap=self.args.tile_overlap,
+            coarse_pass=not self.args.no_coarse_pass,
+            max_tiles=self.args.max_tiles,
+            adaptive_sizes=self.args.adaptive_sizes,
+            min_face_size=self.args.min_face_size,
+            anonymize_threads=self.args.anonymize_threads,
+            mmap_weights=self.args.mmap_weights,
+            lazy_init=self.args.lazy_init,
+        )
+        if self.args.replicas > 1:
+            self.model = FacePixelizerPool(
+                self.args.replicas, self.args.threads_per_replica, **kwargs
+            )
+        else:
+            self.model = FacePixelizer(**kwargs)
+
+        # a warm-up would build the lazy model right away
+        if not self.args.lazy_init:
+            shapes = [tuple(map(int, s.split("x"))) for s in self.args.warmup_shapes]
+            self.model.warmup(
+                self.args.warmup_batch_sizes, shapes, self.args.warmup_iterations
+            )
+        self.last_stats = time.time()
+
+        self.batcher = None
+        if self.args.max_batch_size > 0:
+            self.batcher = MicroBatcher(
+                self.process,
+                self.args.max_batch_size,
+                self.args.max_wait_ms / 1e3,
+                self.args.latency_budget_ms / 1e3 or None,
+            )
+
+    def forward(self, imgs):
+        if self.batcher is not None:
+            return self.batcher(imgs)
+        return self.process(imgs)
+
+    def log_stats(self):
+        """Log the FacePixelizer stats every `--stats-interval` secs."""
+        elapsed = time.time() - self.last_stats
+        if 0 < self.args.stats_interval <= elapsed:
+            print(f"face pixelizer stats over the last {elapsed:.0f} secs:")
+            print(self.model.profiler.summary(reset=True))
+            if self.batcher is not None:
+                print(f"micro-batching batch size: {self.batcher.batch_size}")
+            self.last_stats = time.time()
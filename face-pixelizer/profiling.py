@@ -0,0 +1,144 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+import torch
+
+
+class Distribution:
+    """Count, mean and max of a stream of values, in constant memory."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def stats(self) -> dict:
+        if self.count == 0:
+            return {"mean": 0.0, "max": 0}
+        return {"mean": self.total / self.count, "max": self.max}
+
+
+class Profiler:
+    """Per-stage wall and cpu timers, with an optional torch profiler capture.
+
+    On cuda, kernels run asynchronously: their duration is accounted to the
+    first stage waiting for their results. Cpu times are the process ones, so
+    they include other threads running concurrently.
+
+    Args:
+        trace_dir: Optional; if given, the first `trace_batches` batches are
+            captured with the torch profiler and saved there as a chrome trace
+        trace_batches: number of batches in the capture
+    """
+
+    def __init__(self, trace_dir: str = None, trace_batches: int = 10):
+        self.trace_dir = trace_dir
+        self.trace_batches = trace_batches
+        self.traced_batches = 0
+        self.torch_profiler = None
+        # stages may be timed from several threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start a new accounting period."""
+        with self.lock:
+            self.clear()
+
+    def clear(self):
+        # called with the lock held
+        self.stages = defaultdict(lambda: {"calls": 0, "wall": 0.0, "cpu": 0.0})
+        self.batch_sizes = Distribution()
+        self.faces_per_image = Distribution()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage, also labeled in the torch profiler trace."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        with torch.autograd.profiler.record_function(name):
+            yield
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        with self.lock:
+            stage = self.stages[name]
+            stage["calls"] += 1
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+
+    @contextmanager
+    def batch(self, batch_size: int):
+        """Account a batch, captured by the torch profiler if still required."""
+        with self.lock:
+            self.batch_sizes.add(batch_size)
+
+        capture = self.trace_dir is not None
+        capture = capture and self.traced_batches < self.trace_batches
+        if capture and self.torch_profiler is None:
+            self.torch_profiler = torch.autograd.profiler.profile(record_shapes=True)
+            self.torch_profiler.__enter__()
+
+        with self.stage("total"):
+            yield
+
+        if capture:
+            self.traced_batches += 1
+            if self.traced_batches == self.trace_batches:
+                self.torch_profiler.__exit__(None, None, None)
+                os.makedirs(self.trace_dir, exist_ok=True)
+                path = os.path.join(self.trace_dir, "trace.json")
+                self.torch_profiler.export_chrome_trace(path)
+                print(f"torch profiler trace saved at: {path}")
+
+    def add_faces(self, num_faces: int):
+        with self.lock:
+            self.faces_per_image.add(num_faces)
+
+    def stats(self, reset: bool = False) -> dict:
+        """Stats accumulated since the last reset (durations in secs).
+
+        Args:
+            reset: start a new accounting period, atomically with the read
+        """
+        with self.lock:
+            items = [(name, dict(stage)) for name, stage in self.stages.items()]
+            batch_sizes, faces_per_image = self.batch_sizes, self.faces_per_image
+            if reset:
+                self.clear()
+        stages = {}
+        for name, stage in items:
+            stages[name] = {
+                **stage,
+                "wall_mean": stage["wall"] / stage["calls"],
+                "cpu_mean": stage["cpu"] / stage["calls"],
+            }
+        return {
+            "batches": batch_sizes.count,
+            "images": faces_per_image.count,
+            "batch_size": batch_sizes.stats(),
+            "faces_per_image": faces_per_image.stats(),
+            "stages": stages,
+        }
+
+    def summary(self, reset: bool = False) -> str:
+        """Human readable stats (see `stats`)."""
+        stats = self.stats(reset)
+        lines = [
+            f"{stats['batches']} batches (mean size: "
+            + f"{stats['batch_size']['mean']:.1f}, max: {stats['batch_size']['max']})"
+            + f", {stats['faces_per_image']['mean']:.1f} faces / img "
+            + f"(max: {stats['faces_per_image']['max']})"
+        ]
+        for name, stage in stats["stages"].items():
+            lines.append(
+                f"  {name:>15}: {stage['calls']:>6} calls, "
+                + f"wall {stage['wall_mean'] * 1e3:8.3f} ms, "
+                + f"cpu {stage['cpu_mean'] * 1e3:8.3f} ms"
+            )
+        return "\n".join(lines)
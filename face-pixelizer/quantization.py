@@ -0,0 +1,131 @@
+from typing import Iterable, List
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torchvision
+
+
+# Calibration images required to quantize, a quarter of them is held out to
+# measure the recall of the quantized model. Use a representative set of the
+# deployment images: dozens at least, hundreds preferably
+MIN_CALIBRATION_IMAGES = 32
+
+
+def fuse_retinaface(model: nn.Module) -> nn.Module:
+    """Fuse every Conv2d followed by a BatchNorm2d (and a ReLU), in place.
+
+    LeakyReLUs with a zero slope are ReLUs and fused as such. Other LeakyReLUs
+    have no fused quantized kernel and stay separate modules.
+
+    Args:
+        model (nn.Module): RetinaFace in eval mode
+    Return:
+        the fused model
+    """
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for name, layer in module.named_children():
+            if isinstance(layer, nn.LeakyReLU) and layer.negative_slope == 0:
+                setattr(module, name, nn.ReLU(inplace=True).train(layer.training))
+
+        layers = list(module.named_children())
+        to_fuse = []
+        for i, (name, layer) in enumerate(layers[:-1]):
+            if not isinstance(layer, nn.Conv2d):
+                continue
+            if not isinstance(layers[i + 1][1], nn.BatchNorm2d):
+                continue
+            group = [name, layers[i + 1][0]]
+            if i + 2 < len(layers) and isinstance(layers[i + 2][1], nn.ReLU):
+                group.append(layers[i + 2][0])
+            to_fuse.append(group)
+        if to_fuse:
+            torch.quantization.fuse_modules(module, to_fuse, inplace=True)
+    return model
+
+
+def quantize_retinaface(
+    model: nn.Module, calibration_batches: Iterable[torch.Tensor]
+) -> nn.Module:
+    """Static post-training INT8 quantization of RetinaFace, in place.
+
+    Dynamic quantization only covers Linear / recurrent layers, so the
+    convolutions are quantized statically: activation ranges are observed
+    on calibration batches before conversion. Weights are quantized per
+    channel for fbgemm.
+
+    The first, high resolution layers (backbone stage1) and the heads lose
+    most of the recall once quantized for little of the speed up, they run
+    in float32.
+
+    Args:
+        model (nn.Module): RetinaFace in eval mode, on cpu
+        calibration_batches: preprocessed images, Shape: [batch, 3, height, width]
+    Return:
+        the quantized model (cpu only)
+    """
+    if "fbgemm" in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = "fbgemm"
+    qconfig = torch.quantization.QConfig(
+        activation=torch.quantization.HistogramObserver.with_args(reduce_range=True),
+        weight=torch.quantization.default_per_channel_weight_observer,
+    )
+
+    model = fuse_retinaface(model.cpu().eval())
+    model.qconfig = qconfig
+
+    # inputs are quantized after stage1
+    model.quant.qconfig = None
+    stage1 = model.body.stage1
+    stage1.qconfig = None
+    stage1.add_module("quant", torch.quantization.QuantStub())
+    stage1.quant.qconfig = qconfig
+
+    # and dequantized before the heads
+    model.dequant.qconfig = None
+    for heads in [model.ClassHead, model.BboxHead]:
+        for i, head in enumerate(heads):
+            head.qconfig = None
+            heads[i] = nn.Sequential(torch.quantization.DeQuantStub(), head)
+            heads[i][0].qconfig = qconfig
+    model.cat_bbox.qconfig = None
+    model.cat_class.qconfig = None
+
+    torch.quantization.prepare(model, inplace=True)
+
+    calibrated = False
+    with torch.no_grad():
+        for batch in calibration_batches:
+            model(batch.cpu())
+            calibrated = True
+    if not calibrated:
+        raise ValueError("At least one calibration batch is required")
+
+    torch.quantization.convert(model, inplace=True)
+    return model
+
+
+def match_detections(reference, detections, iou_threshold=0.5):
+    """Count the detections matching a reference detection (IoU >= threshold)."""
+    if len(reference) == 0 or len(detections) == 0:
+        return 0
+    ious = torchvision.ops.box_iou(
+        torch.from_numpy(reference).float(), torch.from_numpy(detections).float()
+    )
+    return int((ious.max(dim=1).values >= iou_threshold).sum())
+
+
+def detection_recall(
+    references: List[np.ndarray], detections: List[np.ndarray]
+) -> float:
+    """Share of the reference boxes matched by the detections, over images."""
+    num_references = sum(len(reference) for reference in references)
+    if num_references == 0:
+        raise ValueError("No reference detection to measure the recall on")
+    matched = sum(
+        match_detections(reference, detection)
+        for reference, detection in zip(references, detections)
+    )
+    return matched / num_references
@@ -0,0 +1,282 @@
+from concurrent.futures import Future
+import inspect
+from itertools import count
+import os
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from face_pixelizer import FacePixelizer, builds_from_weights
+from profiling import Profiler
+
+
+def core_sets(replicas: int, cores: Sequence[int] = None) -> List[List[int]]:
+    """Split cores (default: the ones of this process) in contiguous sets."""
+    cores = sorted(os.sched_getaffinity(0)) if cores is None else list(cores)
+    if not 0 < replicas <= len(cores):
+        raise ValueError(f"Can not run {replicas} replicas on {len(cores)} cores")
+    return [[int(core) for core in cores] for cores in np.array_split(cores, replicas)]
+
+
+def run_replica(cores, num_threads, weights, kwargs, requests, results):
+    """Replica process: serve FacePixelizer method calls from `requests`."""
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+    try:
+        model = FacePixelizer(weights=weights, **kwargs)
+    except Exception as error:
+        results.put((None, False, error))
+        return
+    results.put((None, True, None))
+
+    for task, method, imgs, args in iter(requests.get, None):
+        try:
+            if imgs is not None:
+                # views of the shared memory images
+                imgs = [tensor.numpy() for tensor in imgs]
+                args = (imgs,) + args
+            if method == "__call__":
+                # anonymized images are sent back through the shared memory
+                model(imgs, inplace=True)
+                result = None
+            else:
+                result = getattr(model, method)(*args)
+            results.put((task, True, result))
+        except Exception as error:
+            results.put((task, False, error))
+
+
+class FacePixelizerPool:
+    """Data parallel FacePixelizer, on replicas in their own processes.
+
+    On many-core cpus, a single process with default torch threading scales
+    poorly past a few cores. Each replica runs pinned to its own set of cores
+    with `threads_per_replica` torch threads, and the images of a batch are
+    sharded across the least busy replicas. When replicas build the model from
+    the state dict (no frozen or exported model to load), weights are loaded
+    once and moved to shared memory (or memory-mapped by each replica with
+    `mmap_weights`), and the traced model uses them in place. Images
+    are copied once in shared memory, replicas anonymize them there, so the
+    inputs are left untouched.
+
+    Args:
+        replicas: number of model replicas
+        threads_per_replica: torch threads per replica (0: size of its core set)
+        cores: Optional; cores to spread replicas on (default: all available)
+        **kwargs: FacePixelizer arguments, stream modes are not supported since
+            consecutive frames would be spread across replicas
+    """
+
+    def __init__(
+        self,
+        replicas: int = 2,
+        threads_per_replica: int = 0,
+        cores: Sequence[int] = None,
+        **kwargs,
+    ):
+        if kwargs.get("keyframe_interval", 1) > 1:
+            raise ValueError("Replicas do not support stream modes")
+
+        params = inspect.signature(FacePixelizer).bind(**kwargs)
+        params.apply_defaults()
+        params = params.arguments
+
+        # memory-mapped weights are already shared through the page cache, and
+        # frozen or exported models loaded by replicas hold their own weights
+        weights = None
+        if not params["mmap_weights"] and builds_from_weights(
+            params["state_dict"],
+            params["input_size"],
+            params["quantize"],
+            params["backend"],
+            params["torchscript_cache"],
+            params["onnx_path"],
+            params["top_k"],
+        ):
+            weights = torch.load(params["state_dict"], map_location="cpu")
+            for tensor in weights.values():
+                tensor.share_memory_()
+
+        self.profiler = Profiler()
+        self.tasks = count()
+        self.pending = {}
+        self.outstanding = [0] * replicas
+        self.lock = threading.Lock()
+
+        # spawned since forking a process running torch threads may deadlock
+        context = mp.get_context("spawn")
+        self.results = context.Queue()
+        self.requests = []
+        self.processes = []
+        for cores in core_sets(replicas, cores):
+            requests = context.Queue()
+            process = context.Process(
+                target=run_replica,
+                args=(
+                    cores,
+                    threads_per_replica or len(cores),
+                    weights,
+                    kwargs,
+                    requests,
+                    self.results,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.requests.append(requests)
+            self.processes.append(process)
+
+        for _ in self.processes:
+            _, ready, error = self.results.get()
+            if not ready:
+                self.close()
+                raise error
+
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+        print(f"Face pixelizer pool setup! ({replicas} replicas)")
+
+    def collect(self):
+        """Set the futures of the tasks done by replicas."""
+        for task, done, result in iter(self.results.get, None):
+            with self.lock:
+                future, replica = self.pending.pop(task)
+                self.outstanding[replica] -= 1
+            if done:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def submit(
+        self,
+        method: str,
+        imgs: List[torch.Tensor] = None,
+        args: Tuple = (),
+        replica=None,
+    ) -> Future:
+        """Call a FacePixelizer method on a replica (default: the least busy one)."""
+        future = Future()
+        with self.lock:
+            if replica is None:
+                replica = int(np.argmin(self.outstanding))
+            task = next(self.tasks)
+            self.pending[task] = (future, replica)
+            self.outstanding[replica] += 1
+        self.requests[replica].put((task, method, imgs, args))
+        return future
+
+    def map(self, method: str, imgs: List[np.ndarray]) -> Tuple[List, List]:
+        """Shard images across replicas.
+
+        Returns:
+            the shared memory copies of the images and the method results
+        """
+        if len(imgs) == 0:
+            return [], []
+
+        shared = []
+        for img in imgs:
+            tensor = torch.empty(img.shape, dtype=torch.uint8).share_memory_()
+            tensor.numpy()[...] = img
+            shared.append(tensor)
+
+        shards = np.array_split(
+            np.arange(len(imgs)), min(len(imgs), len(self.requests))
+        )
+        futures = [self.submit(method, [shared[i] for i in shard]) for shard in shards]
+        results = []
+        for future in futures:
+            results.extend(future.result() or [])
+        return [tensor.numpy() for tensor in shared], results
+
+    def find_detections(
+        self, imgs: List[np.ndarray]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Get the face boxes and scores of each image."""
+        _, detections = self.map("find_detections", imgs)
+        for boxes, _ in detections:
+            self.profiler.add_faces(len(boxes))
+        return detections
+
+    def find_faces(self, imgs: List[np.ndarray]) -> List[np.ndarray]:
+        """Get the face boxes of each image."""
+        return [boxes for boxes, _ in self.find_detections(imgs)]
+
+    def __call__(
+        self,
+        imgs: List[np.ndarray],
+        inplace: bool = False,
+        outputs: List[np.ndarray] = None,
+    ) -> List[np.ndarray]:
+        """Anonymize images (see FacePixelizer).
+
+        By default, the anonymized images are the shared memory copies.
+        """
+        with self.profiler.batch(len(imgs)):
+            processed_imgs, _ = self.map("__call__", imgs)
+            if inplace:
+                outputs = imgs
+            if outputs is not None:
+                for output, processed_img in zip(outputs, processed_imgs):
+                    output[...] = processed_img
+                processed_imgs = outputs
+        return processed_imgs
+
+    def patches(
+        self, imgs: List[np.ndarray]
+    ) -> List[List[Tuple[Tuple[int, int], np.ndarray]]]:
+        """Get the modified regions of each anonymized image (see FacePixelizer).
+
+        Contrary to FacePixelizer, the given images are not modified.
+        """
+        with self.profiler.batch(len(imgs)):
+            _, outputs = self.map("patches", imgs)
+        return outputs
+
+    def stats(self, reset: bool = False) -> dict:
+        """Batch timings, sizes and faces per image since the last reset."""
+        return self.profiler.stats(reset)
+
+    def replica_stats(self, reset: bool = False) -> List[dict]:
+        """FacePixelizer per-stage stats of each replica."""
+        futures = [
+            self.submit("stats", args=(reset,), replica=replica)
+            for replica in range(len(self.requests))
+        ]
+        return [future.result() for future in futures]
+
+    def warmup(
+        self,
+        batch_sizes: List[int] = [1],
+        shapes: List[Tuple[int, int]] = [(720, 1280)],
+        iterations: int = 3,
+    ) -> Dict[Tuple[int, int, int], Tuple[float, float]]:
+        """Warm up every replica (see FacePixelizer), with shards of the batches.
+
+        Returns:
+            first call and median steady state latencies of the first replica
+        """
+        replicas = len(self.requests)
+        batch_sizes = sorted(
+            (
+                {size // replicas for size in batch_sizes}
+                | {-(-size // replicas) for size in batch_sizes}
+            )
+            - {0}
+        )
+        futures = [
+            self.submit("warmup", args=(batch_sizes, shapes, iterations), replica=i)
+            for i in range(len(self.requests))
+        ]
+        return [future.result() for future in futures][0]
+
+    def close(self):
+        """Stop the replicas."""
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
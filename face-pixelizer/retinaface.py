@@ -6,11 +6,16 @@ in our case
 """
 
 
+import inspect
+from typing import Dict
+
 import torch
 import torch.nn as nn
 import torchvision.models as models
 import torch.nn.functional as F
 
+from utils import decode_boxes, get_prior_box
+
 
 def conv_bn(inp, oup, stride=1, leaky=0):
     return nn.Sequential(
@@ -63,6 +68,8 @@ class SSH(nn.Module):
         )
         self.conv7x7_3 = conv_bn_no_relu(out_channel // 4, out_channel // 4, stride=1)
 
+        self.cat = nn.quantized.FloatFunctional()
+
     def forward(self, input):
         conv3X3 = self.conv3X3(input)
 
@@ -72,7 +79,7 @@ class SSH(nn.Module):
         conv7X7_2 = self.conv7X7_2(conv5X5_1)
         conv7X7 = self.conv7x7_3(conv7X7_2)
 
-        out = torch.cat([conv3X3, conv5X5, conv7X7], dim=1)
+        out = self.cat.cat([conv3X3, conv5X5, conv7X7], dim=1)
         out = F.relu(out)
         return out
 
@@ -96,6 +103,9 @@ class FPN(nn.Module):
         self.merge1 = conv_bn(out_channels, out_channels, leaky=leaky)
         self.merge2 = conv_bn(out_channels, out_channels, leaky=leaky)
 
+        self.add1 = nn.quantized.FloatFunctional()
+        self.add2 = nn.quantized.FloatFunctional()
+
     def forward(self, inputs):
         # names = list(input.keys())
         inputs = list(inputs.values())
@@ -107,13 +117,13 @@ class FPN(nn.Module):
         up3 = F.interpolate(
             output3, size=[output2.size(2), output2.size(3)], mode="nearest"
         )
-        output2 = output2 + up3
+        output2 = self.add2.add(output2, up3)
         output2 = self.merge2(output2)
 
         up2 = F.interpolate(
             output2, size=[output1.size(2), output1.size(3)], mode="nearest"
         )
-        output1 = output1 + up2
+        output1 = self.add1.add(output1, up2)
         output1 = self.merge1(output1)
 
         return [output1, output2, output3]
@@ -228,16 +238,24 @@ class RetinaFace(nn.Module):
         # for _ in range(fpn_num):
         # self.LandmarkHead.append(LandmarkHead(out_channels, anchor_num))
 
-    def forward(self, inputs):
+        # Identities until the model is quantized (see quantization.py)
+        self.quant = torch.quantization.QuantStub()
+        self.dequant = torch.quantization.DeQuantStub()
+        self.cat_bbox = nn.quantized.FloatFunctional()
+        self.cat_class = nn.quantized.FloatFunctional()
+
+    def features(self, inputs):
+        inputs = self.quant(inputs)
         out = self.body(inputs)
         fpn = self.fpn(out)
-        ssh = [self.ssh1(fpn[0]), self.ssh2(fpn[1]), self.ssh3(fpn[2])]
+        return [self.ssh1(fpn[0]), self.ssh2(fpn[1]), self.ssh3(fpn[2])]
 
+    def heads(self, ssh):
         bbox_regressions = [self.BboxHead[i](feat) for i, feat in enumerate(ssh)]
-        bbox_regressions = torch.cat(bbox_regressions, dim=1)
+        bbox_regressions = self.dequant(self.cat_bbox.cat(bbox_regressions, dim=1))
 
         classifications = [self.ClassHead[i](feat) for i, feat in enumerate(ssh)]
-        classifications = torch.cat(classifications, dim=1)
+        classifications = self.dequant(self.cat_class.cat(classifications, dim=1))
         if not self.training:
             classifications = F.softmax(classifications, dim=-1)
 
@@ -247,11 +265,82 @@ class RetinaFace(nn.Module):
         # return bbox_regressions, classifications, ldm_regressions
         return bbox_regressions, classifications
 
+    def forward(self, inputs):
+        return self.heads(self.features(inputs))
+
+
+class RetinaFaceDetector(nn.Module):
+    """RetinaFace with priors, box decoding, score thresholding and top-k.
+
+    Everything runs in the graph once traced, so getting detections is a single
+    call per batch. Priors are computed from the feature map sizes, the same
+    graph works with any input size.
+
+    Args:
+        model: RetinaFace in eval mode (float or quantized)
+        top_k: number of best scored boxes kept per image
+    """
+
+    def __init__(self, model: RetinaFace, top_k: int = 750):
+        super(RetinaFaceDetector, self).__init__()
+        self.model = model
+        self.top_k = top_k
 
-def retinaface(weights_path: str = None):
+    def forward(self, inputs, score_threshold):
+        """
+        :param inputs: images batch, Shape: [batch, 3, height, width]
+        :param score_threshold: 0-dim tensor
+        :return: per image, the top-k boxes in [x1, y1, x2, y2] input pixels
+            (Shape: [batch, top_k, 4]), their scores sorted in descending order
+            (Shape: [batch, top_k]) and the number of them with a score greater
+            than score_threshold (Shape: [batch])
+        """
+        ssh = self.model.features(inputs)
+        boxes, scores = self.model.heads(ssh)
+
+        # priors in pixels, so decoded boxes are in pixels
+        feature_maps = [[feat.shape[2], feat.shape[3]] for feat in ssh]
+        priors = get_prior_box(1, 1, feature_maps=feature_maps, device=inputs.device)
+        boxes = decode_boxes(boxes, priors, [0.1, 0.2])
+
+        # sort + slice instead of topk, since k can exceed the number of priors
+        scores, inds = scores[:, :, 1].sort(dim=1, descending=True)
+        scores, inds = scores[:, : self.top_k], inds[:, : self.top_k]
+        boxes = boxes.gather(1, inds[:, :, None].expand(-1, -1, 4))
+        counts = (scores > score_threshold).sum(dim=1)
+
+        return boxes, scores, counts
+
+
+def mmap_supported() -> bool:
+    """Whether `torch.load` can memory-map weights (torch >= 2.1)."""
+    return "mmap" in inspect.signature(torch.load).parameters
+
+
+def retinaface(
+    weights_path: str = None,
+    weights: Dict[str, torch.Tensor] = None,
+    mmap: bool = False,
+):
+    """RetinaFace, with pretrained weights loaded from `weights_path`.
+
+    Already loaded `weights` are used in place instead (not copied), so models
+    of several processes can share weights moved to shared memory. With `mmap`,
+    the weights file is memory-mapped on cpu and used in place: weights are
+    read on first use, and processes share their pages through the page cache.
+    """
     model = RetinaFace()
 
-    if weights_path is not None:
+    if weights is None and weights_path is not None and mmap:
+        if not mmap_supported():
+            raise ValueError("Memory-mapped weights require torch >= 2.1")
+        weights = torch.load(weights_path, map_location="cpu", mmap=True)
+
+    if weights is not None:
+        model.load_state_dict(weights)
+        for name, tensor in model.state_dict(keep_vars=True).items():
+            tensor.data = weights[name]
+    elif weights_path is not None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
         weights = torch.load(weights_path, map_location=torch.device(device))
         model.load_state_dict(weights)
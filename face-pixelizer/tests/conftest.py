@@ -0,0 +1,24 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# modules are scripts of the face-pixelizer directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STATE_DICT = os.path.join(ROOT, "retinaface_mobilenet_0.25.pth")
+EXAMPLE = os.path.join(ROOT, "imgs", "example_01.jpg")
+
+
+@pytest.fixture(scope="session")
+def example():
+    import cv2
+
+    return cv2.imread(EXAMPLE)
+
+
+@pytest.fixture
+def noise():
+    return np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)
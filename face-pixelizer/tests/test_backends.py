@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from backends import save_atomically, torchscript_artifact
+from conftest import STATE_DICT
+from face_pixelizer import FacePixelizer
+
+
+def test_save_atomically(tmp_path):
+    path = str(tmp_path / "model.pt")
+    save_atomically(path, lambda tmp: open(tmp, "w").write("saved"))
+    assert open(path).read() == "saved"
+
+    def fail(tmp):
+        open(tmp, "w").write("partial")
+        raise RuntimeError("zbl")
+
+    # the previous file is kept, the temporary one removed
+    with pytest.raises(RuntimeError):
+        save_atomically(path, fail)
+    assert open(path).read() == "saved"
+    assert os.listdir(tmp_path) == ["model.pt"]
+
+
+def test_corrupted_artifact_rebuilt(tmp_path, example):
+    cache = str(tmp_path)
+    expected = FacePixelizer(
+        input_size=256, state_dict=STATE_DICT, torchscript_cache=cache
+    ).detect([example])
+    artifact = torchscript_artifact(STATE_DICT, 256, "cpu", cache)
+    assert os.listdir(cache) == [os.path.basename(artifact)]
+
+    with open(artifact, "r+b") as f:
+        f.truncate(os.path.getsize(artifact) // 2)
+    model = FacePixelizer(
+        input_size=256, state_dict=STATE_DICT, torchscript_cache=cache
+    )
+    assert np.array_equal(model.detect([example])[0][0], expected[0][0])
+    # and saved again
+    torch.jit.load(artifact)
+    assert os.listdir(cache) == [os.path.basename(artifact)]
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_failed_batch_isolates_requests():
+    """A bad request batched with a good one only fails itself."""
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        if None in items:
+            raise ValueError("malformed image")
+        return [item * 2 for item in items]
+
+    # both requests wait for each other in a single batch
+    batcher = MicroBatcher(process, max_batch_size=3, max_wait=1.0)
+    with ThreadPoolExecutor(2) as executor:
+        good = executor.submit(batcher, [1, 2])
+        bad = executor.submit(batcher, [None])
+        assert good.result() == [2, 4]
+        with pytest.raises(ValueError, match="malformed"):
+            bad.result()
+
+    assert sorted(map(len, batches)) == [1, 2, 3]
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import pytest
+
+from backends import onnx_artifact, torchscript_artifact
+from conftest import STATE_DICT
+from face_pixelizer import FacePixelizer, builds_from_weights
+from quantization import detection_recall
+
+
+@pytest.fixture(scope="module")
+def faces(example):
+    """Faces of the example image, with a margin."""
+    model = FacePixelizer(state_dict=STATE_DICT)
+    crops = []
+    for x1, y1, x2, y2 in model.detect([example])[0][0]:
+        width, height = x2 - x1, y2 - y1
+        crops.append(
+            example[
+                max(0, y1 - height // 2) : y2 + height // 2,
+                max(0, x1 - width // 2) : x2 + width // 2,
+            ]
+        )
+    return crops
+
+
+def tile(faces, rows, size):
+    """rows x rows faces of size px, in a grid."""
+    crops = [cv2.resize(faces[i % len(faces)], (size, size)) for i in range(rows**2)]
+    return np.vstack(
+        [np.hstack(crops[i : i + rows]) for i in range(0, rows**2, rows)]
+    )
+
+
+@pytest.fixture(scope="module")
+def crowd(faces):
+    return tile(faces, 20, 25)
+
+
+@pytest.mark.parametrize("rows, size", [(10, 51), (20, 25)])
+def test_no_recall_loss_at_default_top_k(faces, rows, size):
+    """The densest crowds detected at the default input size fit in top-k."""
+    crowd = tile(faces, rows, size)
+    reference = FacePixelizer(state_dict=STATE_DICT, top_k=10000)
+    model = FacePixelizer(state_dict=STATE_DICT)
+    assert model.top_k == 750
+
+    # boxes above the score threshold, before NMS
+    tensors = reference.preprocess([crowd])
+    _, _, counts = reference.model(tensors, reference.score_threshold)
+    assert counts[0] < model.top_k
+
+    expected = reference.detect([crowd])[0][0]
+    assert len(expected) > rows**2 // 2
+    assert detection_recall([expected], [model.detect([crowd])[0][0]]) == 1.0
+
+
+def test_top_k_limits_faces(crowd):
+    model = FacePixelizer(state_dict=STATE_DICT, top_k=50)
+    _, scores, _ = model.model(model.preprocess([crowd]), model.score_threshold)
+    assert scores.shape[1] == 50
+    assert len(model.detect([crowd])[0][0]) <= 50
+
+
+def test_artifacts_keyed_by_top_k(tmp_path):
+    assert onnx_artifact(STATE_DICT) != onnx_artifact(STATE_DICT, 2000)
+    assert torchscript_artifact(STATE_DICT, 512, "cpu", "cache") != (
+        torchscript_artifact(STATE_DICT, 512, "cpu", "cache", 2000)
+    )
+
+    cache = str(tmp_path)
+    FacePixelizer(state_dict=STATE_DICT, torchscript_cache=cache)
+    assert not builds_from_weights(STATE_DICT, torchscript_cache=cache)
+    assert builds_from_weights(STATE_DICT, torchscript_cache=cache, top_k=2000)
+
+
+def test_positional_arguments():
+    """The documented positional call keeps its meaning, top_k is keyword only."""
+    model = FacePixelizer(256, 0.4, 0.3, STATE_DICT)
+    assert model.input_size == 256
+    assert (model.score_threshold, model.nms_threshold) == (0.4, 0.3)
+    assert model.top_k == 750
+    with pytest.raises(TypeError):
+        FacePixelizer(256, 0.4, 0.3, STATE_DICT, 1000)
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import STATE_DICT
+from face_pixelizer import FacePixelizer
+
+
+@pytest.fixture(scope="module")
+def lazy_model():
+    # preprocessing does not need the model
+    return FacePixelizer(input_size=256, state_dict=STATE_DICT, lazy_init=True)
+
+
+def test_concurrent_preprocess(lazy_model):
+    """Concurrent calls do not overwrite each other's inputs."""
+    rng = np.random.default_rng(0)
+    imgs = [rng.integers(0, 256, (256, 256, 3), dtype=np.uint8) for _ in range(8)]
+    expected = [lazy_model.preprocess([img]) for img in imgs]
+
+    def preprocess(i):
+        return i, lazy_model.preprocess([imgs[i]])
+
+    with ThreadPoolExecutor(4) as executor:
+        for i, tensor in executor.map(preprocess, [i % 8 for i in range(400)]):
+            assert torch.equal(tensor, expected[i])
+
+
+def test_float_buffers(lazy_model):
+    """Buffers are reused across alternating shapes."""
+    small = np.zeros((120, 160, 3), np.uint8)
+    large = np.zeros((240, 320, 3), np.uint8)
+
+    lazy_model.preprocess([small, large])
+    buffers = [
+        lazy_model.float_buffer(small.shape),
+        lazy_model.float_buffer(large.shape),
+    ]
+    lazy_model.preprocess([large, small])
+    assert lazy_model.float_buffer(small.shape) is buffers[0]
+    assert lazy_model.float_buffer(large.shape) is buffers[1]
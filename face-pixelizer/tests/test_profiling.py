@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import Distribution, Profiler
+
+
+def test_distribution():
+    distribution = Distribution()
+    assert distribution.stats() == {"mean": 0.0, "max": 0}
+    for value in [1, 4, 1]:
+        distribution.add(value)
+    assert distribution.count == 3
+    assert distribution.stats() == {"mean": 2.0, "max": 4}
+
+
+def test_constant_memory():
+    profiler = Profiler()
+    for i in range(10000):
+        with profiler.batch(i % 8 + 1):
+            profiler.add_faces(i % 3)
+
+    stats = profiler.stats()
+    assert stats["batches"] == stats["images"] == 10000
+    assert stats["batch_size"]["max"] == 8
+    assert stats["faces_per_image"] == {"mean": 9999 / 10000, "max": 2}
+    assert isinstance(profiler.batch_sizes, Distribution)
+    assert isinstance(profiler.faces_per_image, Distribution)
+
+
+def test_reset_on_read():
+    profiler = Profiler()
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(profiler.add_faces, [1] * 4000))
+
+    with profiler.batch(2):
+        pass
+    stats = profiler.stats(reset=True)
+    assert stats["images"] == 4000
+    assert stats["batches"] == 1
+    assert stats["stages"]["total"]["calls"] == 1
+
+    stats = profiler.stats()
+    assert stats["images"] == stats["batches"] == 0
+    assert stats["stages"] == {}
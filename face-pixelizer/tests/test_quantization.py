@@ -0,0 +1,82 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from conftest import STATE_DICT
+from face_pixelizer import FacePixelizer
+from quantization import MIN_CALIBRATION_IMAGES, detection_recall, fuse_retinaface
+
+
+@pytest.fixture(scope="module")
+def calibration_images(example, tmp_path_factory):
+    """Random crops and flips of the example image."""
+    directory = tmp_path_factory.mktemp("calibration")
+    rng = np.random.default_rng(0)
+    height, width = example.shape[:2]
+    for i in range(MIN_CALIBRATION_IMAGES):
+        y, x = rng.integers(0, height // 4), rng.integers(0, width // 4)
+        img = example[y : y + height * 3 // 4, x : x + width * 3 // 4]
+        if i % 2:
+            img = img[:, ::-1]
+        cv2.imwrite(str(directory / f"{i:02d}.jpg"), img)
+    return str(directory / "*.jpg")
+
+
+def test_fuse_relu():
+    model = nn.Sequential(
+        nn.Conv2d(3, 4, 3), nn.BatchNorm2d(4), nn.LeakyReLU(negative_slope=0)
+    ).eval()
+    inputs = torch.rand(1, 3, 8, 8)
+    expected = model(inputs)
+
+    fuse_retinaface(model)
+    assert isinstance(model[0], torch.nn.intrinsic.ConvReLU2d)
+    assert torch.allclose(model(inputs), expected, atol=1e-5)
+
+
+def test_detection_recall():
+    reference = [np.array([[0, 0, 10, 10], [20, 20, 30, 30]]), np.zeros((0, 4))]
+    detections = [np.array([[1, 1, 10, 10]]), np.array([[0, 0, 5, 5]])]
+    assert detection_recall(reference, detections) == 0.5
+    with pytest.raises(ValueError):
+        detection_recall([np.zeros((0, 4))], detections[:1])
+
+
+def test_too_few_calibration_images(tmp_path, example):
+    cv2.imwrite(str(tmp_path / "example.jpg"), example)
+    with pytest.raises(ValueError, match="calibration images"):
+        FacePixelizer(
+            input_size=256,
+            state_dict=STATE_DICT,
+            quantize=True,
+            calibration_images=os.path.join(tmp_path, "*.jpg"),
+        )
+
+
+def test_quantized_recall(calibration_images, example):
+    reference = FacePixelizer(input_size=512, state_dict=STATE_DICT)
+    quantized = FacePixelizer(
+        input_size=512,
+        state_dict=STATE_DICT,
+        quantize=True,
+        calibration_images=calibration_images,
+    )
+    faces = reference.detect([example])[0][0]
+    assert len(faces) > 0
+    recall = detection_recall([faces], [quantized.detect([example])[0][0]])
+    assert recall >= 0.9
+
+
+def test_recall_gate(calibration_images):
+    with pytest.raises(ValueError, match="recall"):
+        FacePixelizer(
+            input_size=256,
+            state_dict=STATE_DICT,
+            quantize=True,
+            calibration_images=calibration_images,
+            min_quantized_recall=1.01,
+        )
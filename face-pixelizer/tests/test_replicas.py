@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+from conftest import STATE_DICT
+from face_pixelizer import FacePixelizer, builds_from_weights
+from replicas import FacePixelizerPool
+
+
+def test_pool_warmup(example):
+    """Replicas warm up with the default batch sizes, outputs match in-process."""
+    # replicas may share cores on small machines
+    cores = sorted(os.sched_getaffinity(0)) * 2
+    pool = FacePixelizerPool(2, 1, cores, input_size=256, state_dict=STATE_DICT)
+    try:
+        stats = pool.warmup([1], [(120, 160)], iterations=1)
+        assert list(stats) == [(1, 120, 160)]
+
+        model = FacePixelizer(input_size=256, state_dict=STATE_DICT)
+        expected = model([example, example])
+        outputs = pool([example, example])
+        for output, expected_output in zip(outputs, expected):
+            assert np.array_equal(output, expected_output)
+    finally:
+        pool.close()
+
+
+def test_builds_from_weights(tmp_path):
+    """Frozen or exported models do not need the state dict weights."""
+    cache = str(tmp_path)
+    assert builds_from_weights(STATE_DICT, 256)
+    assert builds_from_weights(STATE_DICT, 256, torchscript_cache=cache)
+    FacePixelizer(input_size=256, state_dict=STATE_DICT, torchscript_cache=cache)
+    assert not builds_from_weights(STATE_DICT, 256, torchscript_cache=cache)
+    assert builds_from_weights(STATE_DICT, 256, quantize=True, torchscript_cache=cache)
+    assert builds_from_weights(STATE_DICT, 128, torchscript_cache=cache)
+
+    onnx_path = str(tmp_path / "model.onnx")
+    assert builds_from_weights(STATE_DICT, backend="onnx", onnx_path=onnx_path)
+    open(onnx_path, "wb").close()
+    assert not builds_from_weights(STATE_DICT, backend="onnx", onnx_path=onnx_path)
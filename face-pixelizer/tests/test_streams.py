@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from conftest import STATE_DICT
+from face_pixelizer import FacePixelizer
+
+
+@pytest.fixture(scope="module", params=["track", "roi"])
+def video_model(request):
+    return FacePixelizer(
+        input_size=256,
+        state_dict=STATE_DICT,
+        keyframe_interval=5,
+        stream_mode=request.param,
+    )
+
+
+def test_interleaved_streams(video_model, example):
+    """Frames of interleaved streams are processed as if streamed alone."""
+    streams = {"a": example, "b": np.ascontiguousarray(example[:, ::-1])}
+
+    alone = {}
+    for key, frame in streams.items():
+        alone[key] = [video_model.find_faces([frame], key)[0] for _ in range(8)]
+        video_model.reset_stream(key)
+    assert not np.array_equal(alone["a"][0], alone["b"][0])
+
+    interleaved = {key: [] for key in streams}
+    for _ in range(8):
+        for key, frame in streams.items():
+            interleaved[key] += video_model.find_faces([frame], key)
+
+    for key in streams:
+        for boxes, expected in zip(interleaved[key], alone[key]):
+            assert np.array_equal(boxes, expected)
+        video_model.reset_stream(key)
+    assert video_model.streams == {}
+
+
+def test_reset_stream(video_model, example):
+    """A reset stream starts again on a keyframe."""
+    first = video_model.find_faces([example])[0]
+    video_model.find_faces([example])
+    video_model.reset_stream()
+    assert video_model.streams == {}
+    assert np.array_equal(video_model.find_faces([example])[0], first)
+    video_model.reset_stream()
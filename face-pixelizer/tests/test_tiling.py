@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+import pytest
+
+from conftest import STATE_DICT
+from face_pixelizer import FacePixelizer
+
+
+@pytest.fixture(scope="module")
+def model():
+    return FacePixelizer(state_dict=STATE_DICT, tiling=True, coarse_pass=False)
+
+
+@pytest.mark.parametrize(
+    "shape, scale", [((1080, 1920), 1.0), ((2160, 3840), 0.533), ((600, 4000), 0.853)]
+)
+def test_tiling_scale(model, shape, scale):
+    assert model.tiling_scale(*shape) == pytest.approx(scale, abs=1e-3)
+    height, width = (int(side * model.tiling_scale(*shape)) for side in shape)
+    assert len(model.tile_origins(height, width)) <= model.max_tiles
+
+
+def test_no_tile_limit(model):
+    model.max_tiles = 0
+    try:
+        assert model.tiling_scale(2160, 3840) == 1.0
+    finally:
+        model.max_tiles = 16
+
+
+def test_downscaled_tiles(model, example):
+    """Boxes of downscaled tiles (no coarse pass) are mapped back to the image."""
+    large = cv2.resize(example, None, fx=3, fy=3)
+    height, width = large.shape[:2]
+    scale = model.tiling_scale(height, width)
+    assert scale < 1
+
+    small = cv2.resize(
+        large, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA
+    )
+    assert model.tiling_scale(*small.shape[:2]) == 1.0
+    expected = model.detect([small])[0][0]
+    boxes = model.detect([large])[0][0]
+    assert len(expected) > 0
+    np.testing.assert_allclose(boxes, expected / scale, atol=1 / scale + 1)
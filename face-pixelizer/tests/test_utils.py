@@ -0,0 +1,28 @@
+import numpy as np
+
+from utils import clip_boxes, pixelize, pixelize_boxes
+
+
+def test_pixelize_boxes():
+    """All boxes at once match the pixelization of each box."""
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (100, 120, 3), dtype=np.uint8)
+    # non overlapping, clipped, smaller than the blocks and empty boxes
+    boxes = np.array(
+        [[10, 20, 40, 50], [100, 90, 140, 130], [50, 5, 53, 8], [60, 60, 60, 70]]
+    )
+
+    expected = img.copy()
+    for x1, y1, x2, y2 in clip_boxes(boxes, img.shape[:2]):
+        pixelize(expected[y1:y2, x1:x2])
+    output = pixelize_boxes(img.copy(), boxes)
+    assert np.array_equal(output, expected)
+    assert (output[20:25, 10:15] == img[20:25, 10:15].mean((0, 1)).astype(int)).all()
+
+    gray = img[..., 0].copy()
+    expected = gray.copy()
+    for x1, y1, x2, y2 in clip_boxes(boxes, gray.shape):
+        pixelize(expected[y1:y2, x1:x2])
+    assert np.array_equal(pixelize_boxes(gray, boxes), expected)
+
+    assert np.array_equal(pixelize_boxes(img.copy(), np.zeros((0, 4))), img)
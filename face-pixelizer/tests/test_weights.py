@@ -0,0 +1,30 @@
+import pytest
+
+from conftest import ROOT, STATE_DICT
+from face_pixelizer import FacePixelizer
+
+
+def test_mmap_weights_checks():
+    """Memory-mapped weights fail fast when they would not be used."""
+    cache = f"{ROOT}/torchscript"
+    for kwargs in [
+        {"torchscript_cache": cache},
+        {"quantize": True},
+        {"backend": "onnx"},
+    ]:
+        with pytest.raises(ValueError):
+            FacePixelizer(
+                state_dict=STATE_DICT, mmap_weights=True, lazy_init=True, **kwargs
+            )
+
+    model = FacePixelizer(
+        input_size=256, state_dict=STATE_DICT, mmap_weights=True, lazy_init=True
+    )
+    assert model.model.backend is None
+
+
+def test_mmap_weights_unsupported_torch(monkeypatch):
+    """Torch versions without memory-mapped loading fail at setup."""
+    monkeypatch.setattr("face_pixelizer.mmap_supported", lambda: False)
+    with pytest.raises(ValueError):
+        FacePixelizer(state_dict=STATE_DICT, mmap_weights=True, lazy_init=True)
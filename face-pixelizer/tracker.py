@@ -0,0 +1,92 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class FaceTracker:
+    """Propagate face boxes between keyframes with sparse optical flow.
+
+    A grid of points inside each box is tracked with pyramidal Lucas-Kanade
+    (forward-backward checked) and boxes are shifted by the median flow of
+    their points. The detector is needed again on keyframes, or as soon as a
+    box loses too many points or moves too much between two frames.
+
+    Args:
+        keyframe_interval: run the detector at least every N frames
+        min_confidence: minimal ratio of reliably tracked points per box
+        max_motion: maximal box displacement between two frames, relative to
+            the box size
+        points_per_side: tracked points per box are a grid of this size
+    """
+
+    def __init__(
+        self,
+        keyframe_interval: int = 5,
+        min_confidence: float = 0.5,
+        max_motion: float = 0.25,
+        points_per_side: int = 4,
+    ):
+        self.keyframe_interval = keyframe_interval
+        self.min_confidence = min_confidence
+        self.max_motion = max_motion
+
+        # relative positions of the grid points, inside the box center region
+        steps = np.linspace(0.25, 0.75, points_per_side, dtype=np.float32)
+        self.grid = np.stack(np.meshgrid(steps, steps), axis=-1).reshape(-1, 2)
+
+        self.prev_gray = None
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.since_keyframe = 0
+
+    def reset(self, gray: np.ndarray, boxes: np.ndarray):
+        """Start tracking from a keyframe and its detections."""
+        self.prev_gray = gray
+        self.boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        self.since_keyframe = 0
+
+    def propagate(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        """Propagate the boxes to a new frame.
+
+        Args:
+            gray (np.array): new frame in grayscale
+        Return:
+            propagated boxes in [x1, y1, x2, y2] format (Shape: [num_faces, 4]),
+            or None when the detector must run on this frame
+        """
+        if (
+            self.prev_gray is None
+            or self.prev_gray.shape != gray.shape
+            or self.since_keyframe + 1 >= self.keyframe_interval
+        ):
+            return None
+
+        if len(self.boxes) > 0:
+            sizes = self.boxes[:, 2:] - self.boxes[:, :2]
+            points = self.boxes[:, None, :2] + self.grid[None] * sizes[:, None]
+            points = points.reshape(-1, 1, 2)
+
+            next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                self.prev_gray, gray, points, None
+            )
+            back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(
+                gray, self.prev_gray, next_points, None
+            )
+            errors = np.linalg.norm(back_points - points, axis=-1)
+            valid = (status[:, 0] == 1) & (back_status[:, 0] == 1) & (errors[:, 0] < 1)
+            valid = valid.reshape(len(self.boxes), -1)
+            if (valid.mean(axis=1) < self.min_confidence).any():
+                return None
+
+            flows = (next_points - points).reshape(len(self.boxes), -1, 2)
+            flows = np.where(valid[..., None], flows, np.nan)
+            displacements = np.nanmedian(flows, axis=1)
+            motions = np.abs(displacements) / np.maximum(sizes, 1)
+            if (motions > self.max_motion).any():
+                return None
+
+            self.boxes = self.boxes + np.tile(displacements, 2)
+
+        self.prev_gray = gray
+        self.since_keyframe += 1
+        return self.boxes
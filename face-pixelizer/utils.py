@@ -1,4 +1,3 @@
-from itertools import product
 from math import ceil
 
 import cv2
@@ -12,25 +11,48 @@ def get_prior_box(
     min_sizes=[[16, 32], [64, 128], [256, 512]],
     steps=[8, 16, 32],
     clip=False,
+    feature_maps=None,
+    device="cpu",
 ):
     """Compute prior box.
 
-    <TODO> vectorize to increase speed
+    Vectorized with tensor ops only, so it can also be traced inside a model,
+    with the feature map sizes (and image size) taken from its tensors.
+
+    Args:
+        height: image height, priors are normalized by it (1 for pixel priors)
+        width: image width, priors are normalized by it (1 for pixel priors)
+        min_sizes: anchor sizes of each feature map
+        steps: stride of each feature map
+        clip: clamp priors in [0, 1]
+        feature_maps: Optional; [height, width] of each feature map, computed
+            from `height` and `width` by default
+        device: device of the priors
+    Return:
+        priors in center-offset form, Shape: [num_priors, 4]
     """
 
-    feature_maps = [[ceil(height / step), ceil(width / step)] for step in steps]
+    if feature_maps is None:
+        feature_maps = [[ceil(height / step), ceil(width / step)] for step in steps]
 
     anchors = []
-    for k, f in enumerate(feature_maps):
-        for i, j in product(range(f[0]), range(f[1])):
-            for min_size in min_sizes[k]:
-                s_kx = min_size / width
-                s_ky = min_size / height
-                dense_cx = [x * steps[k] / width for x in [j + 0.5]]
-                dense_cy = [y * steps[k] / height for y in [i + 0.5]]
-                for cy, cx in product(dense_cy, dense_cx):
-                    anchors += [cx, cy, s_kx, s_ky]
-    output = torch.Tensor(anchors).view(-1, 4)
+    for (f_height, f_width), step, sizes in zip(feature_maps, steps, min_sizes):
+        cy = (torch.arange(f_height, dtype=torch.float, device=device) + 0.5) * step
+        cx = (torch.arange(f_width, dtype=torch.float, device=device) + 0.5) * step
+        sizes = torch.tensor(sizes, dtype=torch.float, device=device)
+
+        shape = (f_height, f_width, len(sizes))
+        anchors_per_map = torch.stack(
+            [
+                (cx / width)[None, :, None].expand(shape),
+                (cy / height)[:, None, None].expand(shape),
+                (sizes / width).expand(shape),
+                (sizes / height).expand(shape),
+            ],
+            dim=-1,
+        )
+        anchors.append(anchors_per_map.reshape(-1, 4))
+    output = torch.cat(anchors)
 
     if clip:
         output.clamp_(max=1, min=0)
@@ -92,31 +114,99 @@ def decode_boxes(boxes, priors, variances):
 
 
 def pixelize(img, blocks=6):
-    """Pixelize an imagee.
+    """Pixelize an image in place.
 
-    taken from:
+    Block sums are read from the integral image and painted back with a nearest
+    upsample, instead of one `cv2.mean` / `cv2.rectangle` call per block.
+
+    inspired by:
         pyimagesearch.com/2020/04/06/blur-and-anonymize-faces-with-opencv-and-python
 
     Args:
         img (np.array): image to pixellize
-        blocks: number of different blocks
+        blocks: number of different blocks per side
     """
     h, w = img.shape[:2]
-    x_steps = np.linspace(0, w, blocks + 1, dtype="int")
-    y_steps = np.linspace(0, h, blocks + 1, dtype="int")
-    for y in range(1, len(y_steps)):
-        for x in range(1, len(x_steps)):
-            # compute the starting and ending (x, y)-coordinates
-            # for the current block
-            x_start = x_steps[x - 1]
-            y_start = y_steps[y - 1]
-            x_end = x_steps[x]
-            y_end = y_steps[y]
-
-            # extract the ROI using NumPy array slicing, compute the
-            # mean of the ROI, and then draw a rectangle with the
-            # mean RGB values over the ROI in the original img
-            roi = img[y_start:y_end, x_start:x_end]
-            (B, G, R) = [int(x) for x in cv2.mean(roi)[:3]]
-            cv2.rectangle(img, (x_start, y_start), (x_end, y_end), (B, G, R), -1)
+    if h == 0 or w == 0:
+        return img
+
+    y_steps = np.arange(blocks + 1) * h // blocks
+    x_steps = np.arange(blocks + 1) * w // blocks
+    heights, widths = np.diff(y_steps), np.diff(x_steps)
+
+    integral = cv2.integral(img, sdepth=cv2.CV_64F)[y_steps[:, None], x_steps]
+    sums = integral[1:, 1:] - integral[:-1, 1:] - integral[1:, :-1] + integral[:-1, :-1]
+    # empty blocks (image smaller than blocks) are dropped by np.repeat below
+    areas = np.maximum(np.outer(heights, widths), 1)
+    means = sums // areas.reshape(areas.shape + (1,) * (img.ndim - 2))
+
+    img[:] = np.repeat(np.repeat(means.astype(img.dtype), heights, 0), widths, 1)
     return img
+
+
+def pixelize_boxes(img, boxes, blocks=6):
+    """Pixelize several regions of an image in place.
+
+    Block sums of every box are computed together: the block corners of all
+    boxes are gathered from their integral images in a single array, sums and
+    means are then computed for all boxes at once. The integral images are
+    per box, an integral of the whole image costs more than the faces
+    themselves. Means are computed from the input pixels, so overlapping boxes
+    are pixelized from the original image rather than one after the other.
+
+    Args:
+        img (np.array): image to pixellize
+        boxes (np.array): regions to pixelize in [x1, y1, x2, y2] format,
+            Shape: [num_boxes, 4]
+        blocks: number of different blocks per side
+    """
+    boxes = clip_boxes(boxes, img.shape[:2])
+    boxes = boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+    if len(boxes) == 0:
+        return img
+    if len(boxes) == 1:
+        x1, y1, x2, y2 = boxes[0]
+        pixelize(img[y1:y2, x1:x2], blocks)
+        return img
+
+    # block edges of each box, relative to the box
+    steps = np.arange(blocks + 1)
+    y_steps = steps * (boxes[:, 3] - boxes[:, 1])[:, None] // blocks
+    x_steps = steps * (boxes[:, 2] - boxes[:, 0])[:, None] // blocks
+
+    corners = []
+    for (x1, y1, x2, y2), ys, xs in zip(boxes, y_steps, x_steps):
+        # int32 sums unless a box could overflow them
+        depth = cv2.CV_32S if (y2 - y1) * (x2 - x1) < 2**31 // 255 else cv2.CV_64F
+        integral = cv2.integral(img[y1:y2, x1:x2], sdepth=depth)
+        corners.append(integral[ys[:, None], xs])
+    corners = np.stack(corners).astype(np.int64)
+
+    sums = (
+        corners[:, 1:, 1:]
+        - corners[:, :-1, 1:]
+        - corners[:, 1:, :-1]
+        + corners[:, :-1, :-1]
+    )
+    heights, widths = np.diff(y_steps, axis=1), np.diff(x_steps, axis=1)
+    # empty blocks (boxes smaller than blocks) are dropped by np.repeat below
+    areas = np.maximum(heights[:, :, None] * widths[:, None, :], 1)
+    areas = areas.reshape(areas.shape + (1,) * (img.ndim - 2))
+    means = (sums // areas).astype(img.dtype)
+
+    for (x1, y1, x2, y2), box_means, box_heights, box_widths in zip(
+        boxes, means, heights, widths
+    ):
+        img[y1:y2, x1:x2] = np.repeat(
+            np.repeat(box_means, box_heights, 0), box_widths, 1
+        )
+    return img
+
+
+def clip_boxes(boxes, shape):
+    """Clip [x1, y1, x2, y2] boxes to an image of shape (height, width)."""
+    h, w = shape
+    boxes = np.array(boxes, dtype=int).reshape(-1, 4)
+    boxes[:, 0::2] = boxes[:, 0::2].clip(0, w)
+    boxes[:, 1::2] = boxes[:, 1::2].clip(0, h)
+    return boxes
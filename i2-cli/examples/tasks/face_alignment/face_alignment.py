@@ -7,25 +7,121 @@ permission of the copyright holders. If you encounter this file and do not have
 permission, please contact the copyright holders and delete this file.
 """
 
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
+import numpy as np
+import torch
 from archipel.workers.worker import ImagesToDictsWorker
 
 sys.path.append("/opt/3ddfa")
+import models  # noqa
 from FaceBoxes.FaceBoxes_ONNX import FaceBoxes_ONNX as FaceBoxes  # noqa
 from TDDFA_ONNX import TDDFA_ONNX as TDDFA  # noqa
-from utils.functions import cv_draw_landmark  # noqa
+from utils.functions import crop_img, cv_draw_landmark  # noqa
+from utils.functions import parse_roi_box_from_bbox  # noqa
 from utils.render_ctypes import render  # noqa
+from utils.tddfa_util import load_model  # noqa
 
 __task_class_name__ = "FaceAlignementWorker"
 
 
+def export_batched_onnx(onnx_fp, **cfg):
+    """Export TDDFA to ONNX with a dynamic batch size.
+
+    The 3DDFA conversion exports a batch of one, a single call could then not
+    regress the faces of all the images of a batch.
+    """
+    model = getattr(models, cfg["arch"])(
+        num_classes=cfg["num_params"],
+        widen_factor=cfg["widen_factor"],
+        size=cfg["size"],
+        mode="small",
+    )
+    model = load_model(model, cfg["checkpoint_fp"])
+    model.eval()
+
+    dummy_input = torch.randn(1, 3, cfg["size"], cfg["size"])
+    torch.onnx.export(
+        model,
+        (dummy_input,),
+        onnx_fp,
+        input_names=["input"],
+        output_names=["output"],
+        dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+        do_constant_folding=True,
+    )
+
+
+class BatchedTDDFA(TDDFA):
+    """TDDFA_ONNX regressing the faces of several images in a single call.
+
+    Faces are cropped, normalized and their parameters rescaled as by
+    `TDDFA_ONNX.__call__`, which runs the model once per face. The model must
+    be exported with a dynamic batch size (`export_batched_onnx`).
+    """
+
+    def preprocess(self, img, roi_box):
+        """Face crop, as TDDFA input (see `TDDFA_ONNX.__call__`)."""
+        crop = crop_img(img, roi_box)
+        crop = cv2.resize(
+            crop, dsize=(self.size, self.size), interpolation=cv2.INTER_LINEAR
+        )
+        return (crop.astype(np.float32).transpose(2, 0, 1) - 127.5) / 128.0
+
+    def batch(self, imgs, objs_lst):
+        """Regress the faces of a batch of images.
+
+        Args:
+            imgs: images, BGR
+            objs_lst: face boxes of each image, as given to `TDDFA_ONNX.__call__`
+        Returns:
+            per image, the parameters and roi boxes `TDDFA_ONNX.__call__` returns
+        """
+        roi_box_lsts = [
+            [parse_roi_box_from_bbox(obj) for obj in objs] for objs in objs_lst
+        ]
+        crops = [
+            self.preprocess(img, roi_box)
+            for img, roi_box_lst in zip(imgs, roi_box_lsts)
+            for roi_box in roi_box_lst
+        ]
+        params = np.zeros((0, self.param_mean.size), dtype=np.float32)
+        if len(crops) > 0:
+            params = self.session.run(None, {"input": np.stack(crops)})[0]
+            params = params.reshape(len(crops), -1).astype(np.float32)
+            params = params * self.param_std + self.param_mean
+
+        # split per image
+        splits = np.cumsum([len(roi_box_lst) for roi_box_lst in roi_box_lsts])
+        param_lsts = [list(p) for p in np.split(params, splits[:-1])]
+        return param_lsts, roi_box_lsts
+
+
 class FaceAlignementWorker(ImagesToDictsWorker):
     """Apply  detector worker for Coco dataset."""
 
+    def add_model_specific_args(self, parent_parser):
+        parent_parser.add_argument(
+            "--detection-threads",
+            default=4,
+            type=int,
+            help="Detect the faces of the images of a batch in N threads",
+        )
+        parent_parser.add_argument(
+            "--no-batch-alignment",
+            action="store_false",
+            dest="batch_alignment",
+            help="Regress the faces one at a time with TDDFA_ONNX.__call__",
+        )
+
     def setup_model(self):
         self.face_detector = FaceBoxes()
+        # FaceBoxes runs on one image at a time (see `forward`), images of a
+        # batch are detected concurrently instead (onnxruntime releases the GIL)
+        self.executor = ThreadPoolExecutor(self.args.detection_threads)
 
         cfg = {
             "arch": "mobilenet",
@@ -35,16 +131,30 @@ class FaceAlignementWorker(ImagesToDictsWorker):
             "size": 120,
             "num_params": 62,
         }
-        self.tddfa = TDDFA(**cfg)
+        if self.args.batch_alignment:
+            onnx_fp = cfg["checkpoint_fp"].replace(".pth", "_batch.onnx")
+            if not os.path.isfile(onnx_fp):
+                export_batched_onnx(onnx_fp, **cfg)
+            self.tddfa = BatchedTDDFA(onnx_fp=onnx_fp, **cfg)
+        else:
+            self.tddfa = TDDFA(**cfg)
 
     def forward(self, imgs):
-        outputs = []
-        for img in imgs:
-            faces = self.face_detector(img)
-            params, roi_boxes = self.tddfa(img, faces)
-            vertexes = self.tddfa.recon_vers(params, roi_boxes, dense_flag=False)
-            outputs.append(vertexes)
-        return outputs
+        # FaceBoxes_ONNX.__call__ rescales each image to fit 720x1080, builds
+        # the priors of that size and decodes a single output: images of other
+        # sizes can not be stacked in one input without changing the detections
+        faces = list(self.executor.map(self.face_detector, imgs))
+
+        if self.args.batch_alignment:
+            # the faces of all the images are regressed in a single call
+            aligned = zip(*self.tddfa.batch(imgs, faces))
+        else:
+            aligned = [self.tddfa(img, objs) for img, objs in zip(imgs, faces)]
+
+        return [
+            self.tddfa.recon_vers(param_lst, roi_box_lst, dense_flag=False)
+            for param_lst, roi_box_lst in aligned
+        ]
 
 
 if __name__ == "__main__":
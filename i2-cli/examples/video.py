@@ -9,17 +9,39 @@ permission, please contact the copyright holders and delete this file.
 
 import argparse
 import asyncio
+from contextlib import AsyncExitStack
+from functools import partial
 from pathlib import Path
 
-import cv2
-
 from i2_client import I2Client
+from i2_client.faces import anonymize_faces
+from i2_client.video import process_video
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--url", type=str, help="", required=True)
 parser.add_argument("--access_uuid", type=str, help="", required=True)
 parser.add_argument("--video_path", type=str, help="", required=True)
 parser.add_argument("--save_path", type=str, help="", default=None)
+parser.add_argument(
+    "--connections",
+    type=int,
+    help="Connections to the worker, i.e. frames in flight",
+    default=4,
+)
+parser.add_argument(
+    "--keyframe_interval",
+    type=int,
+    help="Face detection workers: only send one frame out of N, faces of the "
+    + "frames in between are interpolated and pixelized locally",
+    default=1,
+)
+parser.add_argument(
+    "--scene_threshold",
+    type=float,
+    help="Face detection workers: also send frames with a histogram distance "
+    + "(0 to 1) to the previous one above this",
+    default=None,
+)
 args = parser.parse_args()
 
 # Check arguments
@@ -31,67 +53,52 @@ if not path.is_file():
 valid_suffixes = [".mp4"]
 if path.suffix not in valid_suffixes:
     raise TypeError(
-        "The video has an suffix. Valid suffixes: {' ,'.join(valid_suffixes)}"
+        f"The video has an invalid suffix. Valid suffixes: {', '.join(valid_suffixes)}"
     )
 
 if args.save_path is None:
     save_path = path.parent / f"{path.stem}_processed.mp4"
 else:
-    save_path = Path(args.save)
+    save_path = Path(args.save_path)
     if save_path.is_file():
         raise FileExistsError("The save path is already exist")
 
 # Main function
 
 
-async def main():
-    """Main async function."""
-
-    async with I2Client(args.url, args.access_uuid) as client:
-        # Start video reader
-        cap = cv2.VideoCapture(str(path))
-        if not cap.isOpened():
-            raise ValueError("Error opening video")
-
-        # Make the first inference to get inference output size
-        ok, frame = cap.read()
-        if not ok:
-            raise ValueError("Error reading video")
-
-        outputs = await client.async_inference(frame)
-
-        # Start video writer
-        fourcc = cv2.VideoWriter_fourcc(*"MP4V")
-        fps = 25
-        output_shape = (outputs[0].shape[0], outputs[0].shape[1])
-        out = cv2.VideoWriter(str(save_path), fourcc, fps, output_shape)
+def log_progress(count):
+    """Log the number of processed frames."""
+    if not bool(count % 25):
+        print(f"processed {count} frames")
 
-        out.write(outputs[0])
-        count = 1
 
-        # Inference until video is completly processed
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                # End of the video
-                break
-
-            outputs = await client.async_inference(frame)
-
-            success, output = outputs[0]
-            if not success:
-                raise RuntimeError(output)
-            out.write(output)
-
-            count += 1
-            if not bool(count % 25):
-                print(f"processed {count} frames")
-
-        # Release reader and writer
-        cap.release()
-        out.release()
+async def main():
+    """Main async function."""
 
-        print(f"processed video saved at: {save_path}")
+    async with AsyncExitStack() as stack:
+        clients = [
+            await stack.enter_async_context(I2Client(args.url, args.access_uuid))
+            for _ in range(args.connections)
+        ]
+
+        # the worker returns face detections, rendered locally
+        render = None
+        if args.keyframe_interval > 1 or args.scene_threshold is not None:
+            render = partial(anonymize_faces, inplace=True)
+
+        # decoding, inferences and encoding are pipelined
+        count = await process_video(
+            clients,
+            path,
+            save_path,
+            fourcc="mp4v",
+            progress=log_progress,
+            render=render,
+            keyframe_interval=args.keyframe_interval,
+            scene_threshold=args.scene_threshold,
+        )
+
+    print(f"processed video ({count} frames) saved at: {save_path}")
 
 
 asyncio.run(main())
@@ -9,7 +9,7 @@ permission, please contact the copyright holders and delete this file.
 
 import argparse
 import asyncio
-import time
+from contextlib import AsyncExitStack
 
 import cv2
 import imutils
@@ -18,68 +18,66 @@ from rich.live import Live
 from rich.spinner import Spinner
 
 from i2_client import I2Client
+from i2_client.stream import LiveStream
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--url", type=str, help="", required=True)
 parser.add_argument("--access_uuid", type=str, help="", required=True)
-parser.add_argument("--frame_rate", type=int, help="", default=15)
+parser.add_argument(
+    "--frame_rate", type=int, help="Maximal submission rate", default=15
+)
 parser.add_argument("--resize_width", type=int, help="", default=None)
+parser.add_argument(
+    "--connections",
+    type=int,
+    help="Connections to the worker, i.e. frames in flight",
+    default=1,
+)
 args = parser.parse_args()
 
 
+def resize(frame):
+    """Resize webcam frames, on the capture thread."""
+    return imutils.resize(frame, width=args.resize_width)
+
+
 async def main():
     """Main async function."""
 
     cam = cv2.VideoCapture(0)
-    prev = 0
+    transform = resize if args.resize_width is not None else None
 
-    async with I2Client(args.url, args.access_uuid) as client:
+    async with AsyncExitStack() as stack:
+        clients = [
+            await stack.enter_async_context(I2Client(args.url, args.access_uuid))
+            for _ in range(args.connections)
+        ]
 
         spinner = Spinner("dots2", "connecting...")
         with Live(spinner, refresh_per_second=20):
 
-            durations = []
-
-            while True:
-
-                # 1. get webcam frame
-
-                time_elapsed = time.time() - prev
-                check, frame = cam.read()
-                if time_elapsed < 1.0 / args.frame_rate:
-                    # force the webcam frame rate so the bottleneck is the
-                    # inference, not the camera performance.
-                    continue
-                prev = time.time()
-
-                if args.resize_width is not None:
-                    frame = imutils.resize(frame, width=args.resize_width)
-
-                # 2. inference
-
-                start = time.time()
-                outputs = await client.async_inference(frame)
-                durations.append(time.time() - start)
-
-                # 3. show
-
-                spinner.text = (
-                    f"send + infer + receive: {durations[-1]:.4f} secs "
-                    + f"(mean: {np.mean(durations):.4f}, std: {np.std(durations):.4f}, "
-                    + f"min: {np.min(durations):.4f}, max: {np.max(durations):.4f})"
-                )
-
-                success, output = outputs[0]
-                if not success:
-                    raise RuntimeError(output)
-                h, w, _ = frame.shape
-                frame = cv2.resize(frame, (w * 2, h * 2))
-                output = cv2.resize(output, (w * 2, h * 2))
-                concatenate_imgs = np.concatenate((frame, output), axis=1)
-                cv2.imshow("original / inference ", concatenate_imgs)
-                key = cv2.waitKey(1)
-                if key == 27:
-                    break
+            # frames captured during inferences are dropped, not queued: the
+            # latency does not grow when the model is slower than the webcam
+            async with LiveStream(
+                cam, clients, max_fps=args.frame_rate, transform=transform
+            ) as stream:
+                async for frame, output, latency in stream:
+                    stats = stream.stats()
+                    spinner.text = (
+                        f"capture to display: {latency:.4f} secs "
+                        + f"(p50: {stats['latency_p50']:.4f}, "
+                        + f"p99: {stats['latency_p99']:.4f}), "
+                        + f"{stats['fps']:.1f} fps, {stats['dropped']} dropped"
+                    )
+
+                    h, w, _ = frame.shape
+                    frame = cv2.resize(frame, (w * 2, h * 2))
+                    output = cv2.resize(output, (w * 2, h * 2))
+                    concatenate_imgs = np.concatenate((frame, output), axis=1)
+                    cv2.imshow("original / inference ", concatenate_imgs)
+                    key = cv2.waitKey(1)
+                    if key == 27:
+                        break
 
         cam.release()
         cv2.destroyAllWindows()
@@ -8,13 +8,16 @@ permission, please contact the copyright holders and delete this file.
 """
 
 import asyncio
+import inspect
 import logging
-from typing import Any, Callable, List, Tuple
+from typing import Any, Callable, List, Tuple, Union
 
 import archipel_utils as utils
 import msgpack
 import websockets
 
+from .faces import composite_patches
+
 log = logging.getLogger(__name__)
 
 
@@ -49,6 +52,7 @@ class I2Client:
         decode_functions = {
             "dict": lambda x: x,
             "numpy.ndarray": utils.deserialize_array,
+            "patches": composite_patches,
         }
         self.available_transforms = {
             "encode": encode_functions,
@@ -122,14 +126,20 @@ class I2Client:
         await self._conn.__aexit__(*args, **kwargs)
 
     async def async_inference(
-        self, inputs: Any, encode: Callable = None, decode: Callable = None
+        self,
+        inputs: Any,
+        encode: Union[str, Callable] = None,
+        decode: Union[str, Callable] = None,
     ) -> List[Tuple[bool, Any]]:
         """Send inference to archipel in async way.
 
         Args:
             inputs: The inputs to send to the worker.
-            encode: Optional; Specify a specific input encoding.
-            decode: Optional; Specify a specific output decoding.
+            encode: Optional; Specify a specific input encoding, a function or
+                the name of an available one.
+            decode: Optional; Specify a specific output decoding, a function or
+                the name of an available one (e.g. "patches"). Decodings taking
+                two arguments also get the input, e.g. to paste patches on it.
 
         Returns:
             List of Tuple composed of two values: bool to indicate whether inference
@@ -137,7 +147,8 @@ class I2Client:
 
         Raises:
             ValueError: There was an error encoding or packing the given
-                input (the specific error is printed).
+                input (the specific error is printed), or the given encoding /
+                decoding is unknown.
             RuntimeError: Ther was an error during the inference (the
                 specific error message is printed).
         """
@@ -149,9 +160,13 @@ class I2Client:
             encode = self.transforms["encode"]
         if decode is None and "decode" in self.transforms:
             decode = self.transforms["decode"]
+        encode = self._get_transform("encode", encode)
+        decode = self._get_transform("decode", decode)
+        decode_with_input = decode is not None and _num_params(decode) > 1
 
         outputs = []
-        for inp in inputs:
+        for raw_inp in inputs:
+            inp = raw_inp
             if encode is not None:
                 try:
                     inp = encode(inp)
@@ -172,7 +187,9 @@ class I2Client:
 
             if decoded_msg["status"] == "success":
                 inference = decoded_msg["data"]
-                if decode is not None:
+                if decode_with_input:
+                    inference = decode(inference, raw_inp)
+                elif decode is not None:
                     inference = decode(inference)
                 outputs.append((True, inference))
             else:
@@ -181,14 +198,20 @@ class I2Client:
         return outputs
 
     def inference(
-        self, inputs: Any, encode: Callable = None, decode: Callable = None
+        self,
+        inputs: Any,
+        encode: Union[str, Callable] = None,
+        decode: Union[str, Callable] = None,
     ) -> List[Tuple[bool, Any]]:
         """Send inference to archipel in sync way.
 
         Args:
             inputs: The inputs to send to the worker.
-            encode: Optional; Specify a specific input encoding.
-            decode: Optional; Specify a specific output decoding.
+            encode: Optional; Specify a specific input encoding, a function or
+                the name of an available one.
+            decode: Optional; Specify a specific output decoding, a function or
+                the name of an available one (e.g. "patches"). Decodings taking
+                two arguments also get the input, e.g. to paste patches on it.
 
         Returns:
             List of Tuple composed of two values: bool to indicate whether inference
@@ -205,3 +228,22 @@ class I2Client:
             return outputs
 
         return asyncio.run(_inference(self, inputs))
+
+    def _get_transform(
+        self, arg: str, transform: Union[str, Callable, None]
+    ) -> Union[Callable, None]:
+        """Get an available transform from its name."""
+        if not isinstance(transform, str):
+            return transform
+        if transform not in self.available_transforms[arg]:
+            available = ", ".join(self.available_transforms[arg])
+            raise ValueError(f"Unknown {arg} '{transform}'. Available: {available}")
+        return self.available_transforms[arg][transform]
+
+
+def _num_params(func: Callable) -> int:
+    """Number of parameters of a function (0 if not inspectable)."""
+    try:
+        return len(inspect.signature(func).parameters)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,169 @@
+"""Copyright (C) Square Factory SA - All Rights Reserved.
+
+This source code is protected under international copyright law. All rights
+reserved and protected by the copyright holders.
+This file is confidential and only available to authorized individuals with the
+permission of the copyright holders. If you encounter this file and do not have
+permission, please contact the copyright holders and delete this file.
+"""
+
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+
+def pixelize(img: np.ndarray, blocks: int = 6) -> np.ndarray:
+    """Pixelize an image in place.
+
+    Args:
+        img: The image (or image region) to pixelize.
+        blocks: Optional; Number of blocks per side.
+
+    Returns:
+        The pixelized image.
+
+    Raises:
+        None.
+    """
+    h, w = img.shape[:2]
+    if h == 0 or w == 0:
+        return img
+
+    y_steps = np.arange(blocks + 1) * h // blocks
+    x_steps = np.arange(blocks + 1) * w // blocks
+    heights, widths = np.diff(y_steps), np.diff(x_steps)
+
+    # block means from the integral image
+    integral = cv2.integral(img, sdepth=cv2.CV_64F)[y_steps[:, None], x_steps]
+    sums = integral[1:, 1:] - integral[:-1, 1:] - integral[1:, :-1] + integral[:-1, :-1]
+    areas = np.maximum(np.outer(heights, widths), 1)
+    means = sums // areas.reshape(areas.shape + (1,) * (img.ndim - 2))
+
+    img[:] = np.repeat(np.repeat(means.astype(img.dtype), heights, 0), widths, 1)
+    return img
+
+
+def anonymize_faces(
+    img: np.ndarray,
+    detections: Dict[str, List],
+    blocks: int = 6,
+    inplace: bool = False,
+) -> np.ndarray:
+    """Pixelize the faces returned by a face detection worker.
+
+    Args:
+        img: The image sent to the worker.
+        detections: The worker output for this image, with face boxes in
+            [x1, y1, x2, y2] format under the "boxes" key.
+        blocks: Optional; Number of blocks per side of each face.
+        inplace: Optional; Pixelize the given image instead of a copy.
+
+    Returns:
+        The anonymized image.
+
+    Raises:
+        ValueError: The detections have no "boxes".
+    """
+    if "boxes" not in detections:
+        raise ValueError("Detections must contain face 'boxes'.")
+
+    if not inplace:
+        img = img.copy()
+
+    h, w = img.shape[:2]
+    boxes = np.array(detections["boxes"], dtype=int).reshape(-1, 4)
+    boxes[:, 0::2] = boxes[:, 0::2].clip(0, w)
+    boxes[:, 1::2] = boxes[:, 1::2].clip(0, h)
+    for x1, y1, x2, y2 in boxes:
+        pixelize(img[y1:y2, x1:x2], blocks)
+    return img
+
+
+def interpolate_detections(
+    first: Dict[str, List],
+    second: Dict[str, List],
+    t: float,
+    max_distance: float = 1.5,
+) -> Dict[str, List]:
+    """Face boxes of a frame between two frames with detections.
+
+    Boxes are matched greedily by the distance of their centers, relative to
+    their size, and matched boxes are linearly interpolated. Unmatched boxes
+    (faces entering or leaving) are kept as is: anonymization errs on the side
+    of covering.
+
+    Args:
+        first: Detections of the previous frame, boxes in [x1, y1, x2, y2]
+            format under the "boxes" key.
+        second: Detections of the next frame.
+        t: Position of the frame between the two, from 0 (first) to 1 (second).
+        max_distance: Optional; Maximal distance between the centers of
+            matched boxes, relative to the largest side of the boxes.
+
+    Returns:
+        The interpolated detections, with "boxes" only.
+
+    Raises:
+        ValueError: The detections have no "boxes".
+    """
+    if "boxes" not in first or "boxes" not in second:
+        raise ValueError("Detections must contain face 'boxes'.")
+
+    first_boxes = np.array(first["boxes"], dtype=float).reshape(-1, 4)
+    second_boxes = np.array(second["boxes"], dtype=float).reshape(-1, 4)
+
+    def centers_and_sizes(boxes):
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+        return centers, np.maximum(sizes, 1)
+
+    first_centers, first_sizes = centers_and_sizes(first_boxes)
+    second_centers, second_sizes = centers_and_sizes(second_boxes)
+    distances = np.linalg.norm(first_centers[:, None] - second_centers[None], axis=2)
+    costs = distances / np.maximum(first_sizes[:, None], second_sizes[None])
+
+    boxes = []
+    first_left = set(range(len(first_boxes)))
+    second_left = set(range(len(second_boxes)))
+    for i, j in zip(*np.unravel_index(np.argsort(costs, axis=None), costs.shape)):
+        if costs[i, j] > max_distance:
+            break
+        if i in first_left and j in second_left:
+            boxes.append((1 - t) * first_boxes[i] + t * second_boxes[j])
+            first_left.remove(i)
+            second_left.remove(j)
+    boxes += [first_boxes[i] for i in sorted(first_left)]
+    boxes += [second_boxes[j] for j in sorted(second_left)]
+
+    boxes = np.round(np.array(boxes).reshape(-1, 4)).astype(int)
+    return {"boxes": boxes.tolist()}
+
+
+def composite_patches(output: Dict[str, List], img: np.ndarray) -> np.ndarray:
+    """Paste the patches returned by a face patches worker, in place.
+
+    Can be used as `decode` transform of `I2Client.async_inference`, which then
+    pastes the patches on each input image.
+
+    Args:
+        output: The worker output for this image, PNG encoded patches under the
+            "patches" key and their [x, y] origins under the "origins" key.
+        img: The image sent to the worker.
+
+    Returns:
+        The anonymized image (the given one, modified in place).
+
+    Raises:
+        ValueError: Invalid patches.
+    """
+    if "patches" not in output or "origins" not in output:
+        raise ValueError("Output must contain 'patches' and their 'origins'.")
+
+    for (x, y), encoded in zip(output["origins"], output["patches"]):
+        patch = cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_UNCHANGED)
+        if patch is None:
+            raise ValueError("Patches must be PNG encoded.")
+        h, w = patch.shape[:2]
+        img[y : y + h, x : x + w] = patch.reshape(img[y : y + h, x : x + w].shape)
+    return img
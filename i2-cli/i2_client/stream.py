@@ -0,0 +1,221 @@
+"""Copyright (C) Square Factory SA - All Rights Reserved.
+
+This source code is protected under international copyright law. All rights
+reserved and protected by the copyright holders.
+This file is confidential and only available to authorized individuals with the
+permission of the copyright holders. If you encounter this file and do not have
+permission, please contact the copyright holders and delete this file.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, NamedTuple, Union
+
+import numpy as np
+
+from .client import I2Client
+
+
+class LiveFrame(NamedTuple):
+    """A frame of a live stream and its inference."""
+
+    frame: Any
+    output: Any
+    latency: float
+
+
+class LiveStream:
+    """Stream a live source to workers, the latest frame wins.
+
+    Frames are captured on a dedicated thread, which only keeps the newest one:
+    frames captured while every client is busy are dropped instead of queued,
+    so the latency does not grow with the inference time. Each client submits
+    the newest frame as soon as its previous inference is done, and outputs
+    older than an already delivered one are dropped as late.
+
+    Usage:
+        async with LiveStream(cv2.VideoCapture(0), clients) as stream:
+            async for frame, output, latency in stream:
+                ...
+
+    Args:
+        capture: The source, with a blocking `read()` returning a success bool
+            and a frame (e.g. `cv2.VideoCapture`).
+        clients: Connected clients, one frame in flight per client.
+        encode: Optional; Input encoding, see `I2Client.async_inference`.
+        decode: Optional; Output decoding, see `I2Client.async_inference`.
+        max_fps: Optional; Maximal submission rate (frames per second).
+        transform: Optional; Applied to frames on the capture thread
+            (e.g. resize).
+        window: Optional; Number of latencies in the stats.
+    """
+
+    def __init__(
+        self,
+        capture: Any,
+        clients: List[I2Client],
+        encode: Union[str, Callable] = None,
+        decode: Union[str, Callable] = None,
+        max_fps: float = None,
+        transform: Callable = None,
+        window: int = 100,
+    ):
+        if len(clients) == 0:
+            raise ValueError("At least one client is required.")
+
+        self.capture = capture
+        self.clients = clients
+        self.encode = encode
+        self.decode = decode
+        self.min_interval = 1 / max_fps if max_fps else 0
+        self.transform = transform
+
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.latest = None
+        self.next_submit = 0.0
+        self.last_delivered = 0
+        self.counts = {"captured": 0, "dropped": 0, "processed": 0, "late": 0}
+        self.latencies = deque(maxlen=window)
+        self.start = time.perf_counter()
+
+    async def __aenter__(self):
+        """Start capturing and processing frames.
+
+        Returns:
+            The stream, to iterate on.
+
+        Raises:
+            None.
+        """
+        loop = asyncio.get_running_loop()
+        self.new_frame = asyncio.Event()
+        self.results = asyncio.Queue()
+
+        self.thread = threading.Thread(
+            target=self.capture_frames, args=(loop,), daemon=True
+        )
+        self.thread.start()
+        self.tasks = [asyncio.ensure_future(self.infer(c)) for c in self.clients]
+        self.running = len(self.tasks)
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        """Stop capturing and cancel the inferences in flight.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+        """
+        self.stopped.set()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+
+    def capture_frames(self, loop: asyncio.AbstractEventLoop):
+        """Capture thread: keep the newest frame until the source ends."""
+        while not self.stopped.is_set():
+            ok, frame = self.capture.read()
+            timestamp = time.perf_counter()
+            if not ok:
+                break
+            if self.transform is not None:
+                frame = self.transform(frame)
+
+            with self.lock:
+                if self.latest is not None:
+                    self.counts["dropped"] += 1
+                self.counts["captured"] += 1
+                self.latest = (self.counts["captured"], timestamp, frame)
+            loop.call_soon_threadsafe(self.new_frame.set)
+
+        self.stopped.set()
+        loop.call_soon_threadsafe(self.new_frame.set)
+
+    def take(self):
+        """Take the newest frame not submitted yet, if any."""
+        with self.lock:
+            latest, self.latest = self.latest, None
+        return latest
+
+    async def next_frame(self):
+        """Wait for a new frame (None once the source ended)."""
+        while True:
+            delay = self.next_submit - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.new_frame.clear()
+            latest = self.take()
+            if latest is not None:
+                self.next_submit = time.perf_counter() + self.min_interval
+                return latest
+            if self.stopped.is_set():
+                return None
+            await self.new_frame.wait()
+
+    async def infer(self, client: I2Client):
+        """Submit the newest frame whenever the client is available."""
+        try:
+            while True:
+                latest = await self.next_frame()
+                if latest is None:
+                    break
+                index, timestamp, frame = latest
+                outputs = await client.async_inference(frame, self.encode, self.decode)
+                success, output = outputs[0]
+                if not success:
+                    raise RuntimeError(output)
+                await self.results.put((index, timestamp, frame, output))
+        except Exception as error:
+            await self.results.put(error)
+        finally:
+            await self.results.put(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> LiveFrame:
+        """The next output, newer than the previous one.
+
+        Raises:
+            RuntimeError: An inference failed.
+        """
+        while self.running > 0:
+            result = await self.results.get()
+            if result is None:
+                self.running -= 1
+                continue
+            if isinstance(result, Exception):
+                raise result
+
+            index, timestamp, frame, output = result
+            if index < self.last_delivered:
+                self.counts["late"] += 1
+                continue
+            self.last_delivered = index
+            self.counts["processed"] += 1
+            latency = time.perf_counter() - timestamp
+            self.latencies.append(latency)
+            return LiveFrame(frame, output, latency)
+        raise StopAsyncIteration
+
+    def stats(self) -> Dict[str, float]:
+        """Frame counts, delivered fps and glass-to-glass latencies (secs).
+
+        Latencies are measured from the capture of frames to the delivery of
+        their outputs, over the last `window` ones.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        stats["fps"] = stats["processed"] / (time.perf_counter() - self.start)
+        latencies = list(self.latencies) or [0.0]
+        stats["latency_mean"] = float(np.mean(latencies))
+        stats["latency_p50"] = float(np.percentile(latencies, 50))
+        stats["latency_p99"] = float(np.percentile(latencies, 99))
+        return stats
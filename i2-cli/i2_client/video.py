@@ -0,0 +1,266 @@
+"""Copyright (C) Square Factory SA - All Rights Reserved.
+
+This source code is protected under international copyright law. All rights
+reserved and protected by the copyright holders.
+This file is confidential and only available to authorized individuals with the
+permission of the copyright holders. If you encounter this file and do not have
+permission, please contact the copyright holders and delete this file.
+"""
+
+import asyncio
+import queue
+import threading
+from typing import Callable, List, Union
+
+import cv2
+import numpy as np
+
+from .client import I2Client
+from .faces import interpolate_detections
+
+
+def histogram(frame: np.ndarray) -> np.ndarray:
+    """Color histogram of a downscaled frame, compared to detect scene changes."""
+    small = cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA)
+    hist = cv2.calcHist([small], [0, 1, 2], None, [8, 8, 8], [0, 256] * 3)
+    return cv2.normalize(hist, hist)
+
+
+async def process_video(
+    clients: List[I2Client],
+    video_path: str,
+    save_path: str,
+    queue_size: int = 32,
+    fourcc: str = "mp4v",
+    encode: Union[str, Callable] = None,
+    decode: Union[str, Callable] = None,
+    progress: Callable[[int], None] = None,
+    render: Callable = None,
+    keyframe_interval: int = 1,
+    scene_threshold: float = None,
+) -> int:
+    """Process the frames of a video with workers and save the outputs as a video.
+
+    Three pipelined stages: a decoder thread, the inference of one frame in
+    flight per client, and an encoder thread. The throughput is the one of the
+    slowest stage. Outputs are written in the order of the frames, at the fps
+    of the source video.
+
+    With a `render` function, the worker returns detections and outputs are
+    rendered locally, e.g. `functools.partial(anonymize_faces, inplace=True)`.
+    Only keyframes are then sent to the workers: every `keyframe_interval`
+    frames, and on scene changes if `scene_threshold` is set. The detections
+    of the frames in between are interpolated from the surrounding keyframes
+    (held across scene changes), so round trips drop by `keyframe_interval`
+    while the output keeps every frame. Frames in between are buffered until
+    their next keyframe is processed.
+
+    Args:
+        clients: Connected clients, e.g. several connections to the same worker.
+        video_path: The video to process.
+        save_path: Where to write the output video.
+        queue_size: Optional; Maximal number of frames between two stages.
+        fourcc: Optional; Codec of the output video.
+        encode: Optional; Input encoding, see `I2Client.async_inference`.
+        decode: Optional; Output decoding, see `I2Client.async_inference`.
+        progress: Optional; Called with the number of frames written so far,
+            from the encoder thread.
+        render: Optional; Called with a frame and its detections (worker
+            output), returns the output frame. Called from the encoder thread.
+        keyframe_interval: Optional; Send one frame out of N to the workers,
+            requires `render`.
+        scene_threshold: Optional; Also send frames whose histogram distance
+            (Bhattacharyya, from 0 to 1) to the previous one exceeds this,
+            requires `render`.
+
+    Returns:
+        The number of processed frames.
+
+    Raises:
+        ValueError: The video can not be read, no client is given, or
+            keyframes without `render`.
+        RuntimeError: An inference failed.
+    """
+    if len(clients) == 0:
+        raise ValueError("At least one client is required.")
+    if keyframe_interval < 1:
+        raise ValueError("The keyframe interval must be positive.")
+    if render is None and (keyframe_interval > 1 or scene_threshold is not None):
+        raise ValueError("Keyframes require a render function of detections.")
+
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise ValueError(f"Error opening video {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    frames = asyncio.Queue(queue_size)
+    # frame futures in frame order, bounding the frames in flight and reordered
+    ordered = asyncio.Queue(queue_size)
+    todo = asyncio.Queue()
+    results = queue.Queue(queue_size)
+    written = 0
+    errors = []
+    # set once the encoder failed, the decoder then stops without its sentinel
+    failed = asyncio.Event()
+
+    def decoder():
+        since_keyframe = keyframe_interval
+        previous = None
+        while not stop.is_set():
+            ok, frame = cap.read()
+            item = None
+            if ok:
+                cut = False
+                if scene_threshold is not None:
+                    hist = histogram(frame)
+                    if previous is not None:
+                        distance = cv2.compareHist(
+                            previous, hist, cv2.HISTCMP_BHATTACHARYYA
+                        )
+                        cut = distance > scene_threshold
+                    previous = hist
+                keyframe = cut or since_keyframe >= keyframe_interval
+                since_keyframe = 0 if keyframe else since_keyframe
+                since_keyframe += 1
+                item = (frame, keyframe, cut)
+            asyncio.run_coroutine_threadsafe(frames.put(item), loop).result()
+            if item is None:
+                break
+
+    def encoder():
+        nonlocal written
+        writer = None
+        try:
+            while True:
+                try:
+                    output = results.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        break
+                    continue
+                if output is None:
+                    break
+                if render is not None:
+                    output = render(*output)
+                if writer is None:
+                    height, width = output.shape[:2]
+                    codec = cv2.VideoWriter_fourcc(*fourcc)
+                    writer = cv2.VideoWriter(
+                        str(save_path), codec, fps, (width, height)
+                    )
+                writer.write(output)
+                written += 1
+                if progress is not None:
+                    progress(written)
+        except Exception as error:
+            errors.append(error)
+            stop.set()
+            loop.call_soon_threadsafe(failed.set)
+        finally:
+            if writer is not None:
+                writer.release()
+
+    async def dispatch():
+        while True:
+            item = await frames.get()
+            if item is None:
+                break
+            frame, keyframe, cut = item
+            future = None
+            if keyframe:
+                future = loop.create_future()
+                # failures after the first one are not awaited
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            await ordered.put((frame, future, cut))
+            if future is not None:
+                await todo.put((frame, future))
+        await ordered.put(None)
+        for _ in clients:
+            await todo.put(None)
+
+    async def infer(client):
+        while True:
+            item = await todo.get()
+            if item is None:
+                break
+            frame, future = item
+            try:
+                outputs = await client.async_inference(frame, encode, decode)
+                success, output = outputs[0]
+                if not success:
+                    raise RuntimeError(output)
+                future.set_result(output)
+            except Exception as error:
+                future.set_exception(error)
+
+    def put_output(output):
+        # the encoder may have stopped on an error
+        while not stop.is_set():
+            try:
+                results.put(output, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    async def collect():
+        # detections of the last keyframe, and frames since then
+        previous = None
+        between = []
+        while not stop.is_set():
+            item = await ordered.get()
+            if item is None:
+                break
+            frame, future, cut = item
+            if future is None:
+                between.append(frame)
+                continue
+
+            output = await future
+            for i, other in enumerate(between):
+                t = (i + 1) / (len(between) + 1)
+                detections = previous
+                if not cut:
+                    detections = interpolate_detections(previous, output, t)
+                await loop.run_in_executor(None, put_output, (other, detections))
+            between = []
+            previous = output
+            if render is not None:
+                output = (frame, output)
+            await loop.run_in_executor(None, put_output, output)
+
+        # no next keyframe, the last detections are held
+        for other in between:
+            await loop.run_in_executor(None, put_output, (other, previous))
+        await loop.run_in_executor(None, put_output, None)
+
+    threads = [threading.Thread(target=decoder), threading.Thread(target=encoder)]
+    for thread in threads:
+        thread.start()
+
+    tasks = [asyncio.ensure_future(infer(client)) for client in clients]
+    tasks += [asyncio.ensure_future(dispatch()), asyncio.ensure_future(collect())]
+    pipeline = asyncio.gather(*tasks)
+    failure = asyncio.ensure_future(failed.wait())
+    try:
+        # stages waiting for frames that will never come are cancelled below
+        await asyncio.wait([pipeline, failure], return_when=asyncio.FIRST_COMPLETED)
+        if not errors:
+            pipeline.result()
+    finally:
+        stop.set()
+        failure.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(pipeline, failure, return_exceptions=True)
+        # unblock the decoder on a full queue
+        while not frames.empty():
+            frames.get_nowait()
+        for thread in threads:
+            await loop.run_in_executor(None, thread.join)
+        cap.release()
+
+    if errors:
+        raise errors[0]
+    return written
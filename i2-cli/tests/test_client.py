@@ -11,6 +11,7 @@ import asyncio
 import socket
 from contextlib import closing
 
+import cv2
 import msgpack
 import numpy as np
 import pytest
@@ -263,3 +264,50 @@ async def test_archipel_client_connection_async_got_inference_fail(setup, mocker
 
     finally:
         await close_all_tasks()
+
+
+@pytest.mark.asyncio
+async def test_archipel_client_connection_async_decode_patches(setup):
+    """Test patches decoding, pasted on the inputs."""
+
+    url, host, port = setup
+    fake_data = np.zeros((50, 60, 3), dtype=np.uint8)
+    patch = np.full((10, 20, 3), 255, dtype=np.uint8)
+
+    async def fake_user():
+        await asyncio.sleep(0.1)
+        async with I2Client(url, "good:access_key") as client:
+            with pytest.raises(ValueError):
+                await client.async_inference(fake_data, decode="zbl")
+
+            outputs = await client.async_inference(fake_data, decode="patches")
+            success, output = outputs[0]
+            assert success
+            assert output is fake_data
+            assert (output[5:15, 30:50] == 255).all()
+            assert output.sum() == patch.sum()
+
+    async def fake_cld(websocket, path):
+        await websocket.recv()
+        data = {
+            "input_type": "numpy.ndarray",
+            "input_size": "variable",
+            "output_type": "dict",
+        }
+        await websocket.send(msgpack.packb({"status": "success", "data": data}))
+
+        await websocket.recv()
+        data = {
+            "origins": [[30, 5]],
+            "patches": [cv2.imencode(".png", patch)[1].tobytes()],
+        }
+        await websocket.send(msgpack.packb({"status": "success", "data": data}))
+
+    start_server = websockets.serve(fake_cld, host, port)
+
+    try:
+        gather = asyncio.gather(fake_user(), start_server)
+        await asyncio.wait_for(gather, timeout=5.0)
+
+    finally:
+        await close_all_tasks()
@@ -0,0 +1,79 @@
+"""Copyright (C) Square Factory SA - All Rights Reserved.
+
+This source code is protected under international copyright law. All rights
+reserved and protected by the copyright holders.
+This file is confidential and only available to authorized individuals with the
+permission of the copyright holders. If you encounter this file and do not have
+permission, please contact the copyright holders and delete this file.
+"""
+import importlib.util
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# 3DDFA_V2 is cloned in /opt/3ddfa by the example Dockerfile
+sys.path.append("/opt/3ddfa")
+pytest.importorskip("archipel")
+pytest.importorskip("TDDFA_ONNX")
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "examples")
+TASK = os.path.join(EXAMPLES, "tasks", "face_alignment", "face_alignment.py")
+CFG = {
+    "arch": "mobilenet",
+    "widen_factor": 1.0,
+    "checkpoint_fp": "/opt/3ddfa/weights/mb1_120x120.pth",
+    "bfm_fp": "/opt/3ddfa/configs/bfm_noneck_v3.pkl",
+    "size": 120,
+    "num_params": 62,
+}
+
+
+@pytest.fixture(scope="module")
+def task():
+    spec = importlib.util.spec_from_file_location("face_alignment", TASK)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module")
+def batched(task, tmp_path_factory):
+    onnx_fp = str(tmp_path_factory.mktemp("tddfa") / "mb1_120x120_batch.onnx")
+    task.export_batched_onnx(onnx_fp, **CFG)
+    return task.BatchedTDDFA(onnx_fp=onnx_fp, **CFG)
+
+
+def test_batch_matches_tddfa(task, batched):
+    """The batched path regresses the faces as `TDDFA_ONNX.__call__` does."""
+    tddfa = task.TDDFA(**CFG)
+    img = cv2.imread(os.path.join(EXAMPLES, "test.jpg"))
+    faces = task.FaceBoxes()(img)
+    assert len(faces) > 0
+
+    expected_params, expected_roi_boxes = tddfa(img, faces)
+
+    # alone, and batched with a flipped copy holding faces too
+    flipped = np.ascontiguousarray(img[:, ::-1])
+    flipped_faces = task.FaceBoxes()(flipped)
+    param_lsts, roi_box_lsts = batched.batch([img, flipped], [faces, flipped_faces])
+    assert len(param_lsts[1]) == len(flipped_faces)
+    for params, roi_boxes in [
+        batched.batch([img], [faces]),
+        ([param_lsts[0]], [roi_box_lsts[0]]),
+    ]:
+        assert roi_boxes[0] == expected_roi_boxes
+        np.testing.assert_allclose(params[0], expected_params, rtol=1e-4, atol=1e-4)
+
+    vertexes = batched.recon_vers(param_lsts[0], roi_box_lsts[0], dense_flag=False)
+    expected = tddfa.recon_vers(expected_params, expected_roi_boxes, dense_flag=False)
+    np.testing.assert_allclose(vertexes, expected, rtol=1e-3, atol=1e-2)
+
+
+def test_batch_without_faces(batched):
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    param_lsts, roi_box_lsts = batched.batch([img, img], [[], []])
+    assert param_lsts == [[], []]
+    assert roi_box_lsts == [[], []]
@@ -0,0 +1,96 @@
+"""Copyright (C) Square Factory SA - All Rights Reserved.
+
+This source code is protected under international copyright law. All rights
+reserved and protected by the copyright holders.
+This file is confidential and only available to authorized individuals with the
+permission of the copyright holders. If you encounter this file and do not have
+permission, please contact the copyright holders and delete this file.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from i2_client.faces import (
+    anonymize_faces,
+    composite_patches,
+    interpolate_detections,
+    pixelize,
+)
+
+
+def test_pixelize():
+    """Test pixelization block means."""
+    img = np.zeros((4, 6, 3), dtype=np.uint8)
+    img[:2, :3] = 100
+    img[0, 0] = 104
+
+    pixelize(img, blocks=2)
+
+    assert (img[:2, :3] == 100).all()
+    assert (img[2:] == 0).all()
+    assert (img[:, 3:] == 0).all()
+
+
+def test_anonymize_faces():
+    """Test local anonymization of detections."""
+    img = np.random.randint(0, 255, (100, 120, 3), dtype=np.uint8)
+    detections = {"boxes": [[10, 20, 40, 50], [100, 90, 140, 130]], "scores": [1, 1]}
+
+    output = anonymize_faces(img, detections, blocks=1)
+
+    # input is left untouched, faces are replaced by their mean
+    assert not np.array_equal(output, img)
+    assert (output[20:50, 10:40] == img[20:50, 10:40].mean((0, 1)).astype(int)).all()
+    # boxes are clipped to the image
+    assert (output[90:, 100:] == output[90, 100]).all()
+    output[20:50, 10:40] = img[20:50, 10:40]
+    output[90:, 100:] = img[90:, 100:]
+    assert np.array_equal(output, img)
+
+    no_face = anonymize_faces(img, {"boxes": [], "scores": []})
+    assert np.array_equal(no_face, img)
+
+    anonymize_faces(img, detections, inplace=True)
+    assert not np.array_equal(no_face, img)
+
+    with pytest.raises(ValueError):
+        anonymize_faces(img, {"scores": []})
+
+
+def test_interpolate_detections():
+    """Test boxes are matched and interpolated, unmatched ones kept."""
+    first = {"boxes": [[0, 0, 10, 10], [100, 100, 120, 120]], "scores": [1, 1]}
+    second = {"boxes": [[300, 300, 310, 310], [10, 0, 20, 10]], "scores": [1, 1]}
+
+    detections = interpolate_detections(first, second, 0.25)
+
+    assert detections == {
+        "boxes": [[2, 0, 12, 10], [100, 100, 120, 120], [300, 300, 310, 310]]
+    }
+    assert interpolate_detections(first, second, 0)["boxes"][0] == [0, 0, 10, 10]
+    assert interpolate_detections({"boxes": []}, {"boxes": []}, 0.5)["boxes"] == []
+
+    with pytest.raises(ValueError):
+        interpolate_detections(first, {"scores": []}, 0.5)
+
+
+def test_composite_patches():
+    """Test patches are pasted in place."""
+    img = np.zeros((100, 120, 3), dtype=np.uint8)
+    patches = [np.full((10, 20, 3), 50, np.uint8), np.full((5, 5, 3), 9, np.uint8)]
+    output = {
+        "origins": [[10, 20], [115, 95]],
+        "patches": [cv2.imencode(".png", patch)[1].tobytes() for patch in patches],
+    }
+
+    assert composite_patches(output, img) is img
+    assert (img[20:30, 10:30] == 50).all()
+    assert (img[95:, 115:] == 9).all()
+    assert img.sum() == 50 * 10 * 20 * 3 + 9 * 5 * 5 * 3
+
+    with pytest.raises(ValueError):
+        composite_patches({"patches": []}, img)
+
+    with pytest.raises(ValueError):
+        composite_patches({"origins": [[0, 0]], "patches": [b"zbl"]}, img)
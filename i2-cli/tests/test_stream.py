@@ -0,0 +1,92 @@
+"""Copyright (C) Square Factory SA - All Rights Reserved.
+
+This source code is protected under international copyright law. All rights
+reserved and protected by the copyright holders.
+This file is confidential and only available to authorized individuals with the
+permission of the copyright holders. If you encounter this file and do not have
+permission, please contact the copyright holders and delete this file.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from i2_client.stream import LiveStream
+
+
+class FakeCamera:
+    """Frames filled with their index, at a fixed frame rate."""
+
+    def __init__(self, num_frames: int, fps: float = 200):
+        self.num_frames = num_frames
+        self.interval = 1 / fps
+        self.count = 0
+
+    def read(self):
+        time.sleep(self.interval)
+        if self.count == self.num_frames:
+            return False, None
+        self.count += 1
+        return True, np.full((4, 4, 3), self.count, dtype=np.uint8)
+
+
+class FakeClient:
+    """Slow inference, failing on a given call."""
+
+    def __init__(self, delay: float, fail_on: int = None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.calls = 0
+
+    async def async_inference(self, frame, encode=None, decode=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.calls == self.fail_on:
+            return [(False, "zbl")]
+        return [(True, frame + 1)]
+
+
+@pytest.mark.asyncio
+async def test_live_stream():
+    """Test frames captured during inferences are dropped, not queued."""
+    clients = [FakeClient(0.03), FakeClient(0.03)]
+    async with LiveStream(FakeCamera(100), clients) as stream:
+        indices = []
+        async for frame, output, latency in stream:
+            assert (output == frame + 1).all()
+            indices.append(frame[0, 0, 0])
+            # latency does not grow with the frames waiting for the slow model
+            assert latency < 0.1
+
+    stats = stream.stats()
+    assert (np.diff(indices) > 0).all()
+    assert stats["processed"] == len(indices)
+    assert stats["dropped"] > 0
+    assert stats["captured"] == 100
+    assert stats["dropped"] + stats["processed"] + stats["late"] == 100
+    assert 0 < stats["latency_p50"] <= stats["latency_p99"] < 0.1
+
+
+@pytest.mark.asyncio
+async def test_live_stream_max_fps():
+    """Test the submission rate limit."""
+    client = FakeClient(0)
+    start = time.perf_counter()
+    async with LiveStream(FakeCamera(40), [client], max_fps=50) as stream:
+        async for _ in stream:
+            pass
+    assert client.calls <= 50 * (time.perf_counter() - start) + 1
+
+
+@pytest.mark.asyncio
+async def test_live_stream_errors():
+    """Test inference failures."""
+    with pytest.raises(RuntimeError):
+        async with LiveStream(FakeCamera(100), [FakeClient(0.01, 3)]) as stream:
+            async for _ in stream:
+                pass
+
+    with pytest.raises(ValueError):
+        LiveStream(FakeCamera(1), [])
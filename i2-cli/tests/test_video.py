@@ -0,0 +1,207 @@
+"""Copyright (C) Square Factory SA - All Rights Reserved.
+
+This source code is protected under international copyright law. All rights
+reserved and protected by the copyright holders.
+This file is confidential and only available to authorized individuals with the
+permission of the copyright holders. If you encounter this file and do not have
+permission, please contact the copyright holders and delete this file.
+"""
+
+import asyncio
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from i2_client.video import process_video
+
+
+class FakeClient:
+    """Inverts frames after a random delay, failing on a given call."""
+
+    def __init__(self, fail_on: int = None):
+        self.fail_on = fail_on
+        self.calls = 0
+
+    async def async_inference(self, frame, encode=None, decode=None):
+        self.calls += 1
+        await asyncio.sleep(random.uniform(0, 0.01))
+        if self.calls == self.fail_on:
+            return [(False, "zbl")]
+        return [(True, 255 - frame)]
+
+
+class FakeDetector(FakeClient):
+    """Detects a box whose x is the frame mean."""
+
+    async def async_inference(self, frame, encode=None, decode=None):
+        self.calls += 1
+        await asyncio.sleep(random.uniform(0, 0.01))
+        x = frame.mean()
+        return [(True, {"boxes": [[x, 0, x + 64, 48]], "scores": [1]})]
+
+
+def write_video(path, num_frames, fps=10, values=None):
+    """Video whose frame i is filled with values[i], i * 8 by default."""
+    values = values if values is not None else [i * 8 for i in range(num_frames)]
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (64, 48))
+    for value in values:
+        writer.write(np.full((48, 64, 3), value, dtype=np.uint8))
+    writer.release()
+
+
+@pytest.mark.asyncio
+async def test_process_video(tmp_path):
+    """Test frames are processed in order, at the source fps."""
+    write_video(tmp_path / "in.mp4", 20)
+    clients = [FakeClient() for _ in range(4)]
+    progress = []
+
+    num_frames = await process_video(
+        clients,
+        tmp_path / "in.mp4",
+        tmp_path / "out.mp4",
+        queue_size=4,
+        progress=progress.append,
+    )
+
+    assert num_frames == 20
+    assert progress == list(range(1, 21))
+    # frames are spread across clients
+    assert sum(client.calls for client in clients) == 20
+    assert all(client.calls > 0 for client in clients)
+
+    cap = cv2.VideoCapture(str(tmp_path / "out.mp4"))
+    assert cap.get(cv2.CAP_PROP_FPS) == 10
+    means = []
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        means.append(frame.mean())
+    cap.release()
+    # frames of decreasing intensity, up to the lossy compression
+    assert len(means) == 20
+    assert (np.diff(means) < 0).all()
+    assert np.allclose(means, 255 - np.arange(20) * 8, atol=6)
+
+
+@pytest.mark.asyncio
+async def test_process_video_keyframes(tmp_path):
+    """Test only keyframes are inferred, detections in between interpolated."""
+    write_video(tmp_path / "in.mp4", 22)
+    clients = [FakeDetector() for _ in range(2)]
+    rendered = []
+
+    def render(frame, detections):
+        rendered.append(detections["boxes"][0][0])
+        return frame
+
+    num_frames = await process_video(
+        clients,
+        tmp_path / "in.mp4",
+        tmp_path / "out.mp4",
+        render=render,
+        keyframe_interval=4,
+    )
+
+    assert num_frames == 22
+    # frames 0, 4, ..., 20
+    assert sum(client.calls for client in clients) == 6
+    # boxes follow the frames, the last ones are held
+    assert len(rendered) == 22
+    assert np.allclose(rendered[:21], np.arange(21) * 8, atol=6)
+    assert rendered[21] == rendered[20]
+
+    cap = cv2.VideoCapture(str(tmp_path / "out.mp4"))
+    assert cap.get(cv2.CAP_PROP_FRAME_COUNT) == 22
+    cap.release()
+
+
+@pytest.mark.asyncio
+async def test_process_video_scene_changes(tmp_path):
+    """Test scene changes are keyframes, detections are not interpolated across."""
+    write_video(tmp_path / "in.mp4", 20, values=[0] * 10 + [200] * 10)
+    client = FakeDetector()
+    rendered = []
+
+    def render(frame, detections):
+        rendered.append(detections["boxes"][0][0])
+        return frame
+
+    await process_video(
+        [client],
+        tmp_path / "in.mp4",
+        tmp_path / "out.mp4",
+        render=render,
+        keyframe_interval=100,
+        scene_threshold=0.5,
+    )
+
+    assert client.calls == 2
+    assert np.allclose(rendered[:10], 0, atol=6)
+    assert np.allclose(rendered[10:], 200, atol=6)
+
+
+@pytest.mark.asyncio
+async def test_process_video_errors(tmp_path):
+    """Test inference failures and invalid videos."""
+    write_video(tmp_path / "in.mp4", 50)
+
+    with pytest.raises(RuntimeError):
+        await process_video(
+            [FakeClient(fail_on=10), FakeClient(fail_on=10)],
+            tmp_path / "in.mp4",
+            tmp_path / "out.mp4",
+            queue_size=2,
+        )
+
+    with pytest.raises(ValueError):
+        await process_video([FakeClient()], tmp_path / "zbl.mp4", tmp_path / "o.mp4")
+
+    with pytest.raises(ValueError):
+        await process_video([], tmp_path / "in.mp4", tmp_path / "out.mp4")
+
+    with pytest.raises(ValueError):
+        await process_video(
+            [FakeClient()], tmp_path / "in.mp4", tmp_path / "o.mp4", keyframe_interval=4
+        )
+
+
+@pytest.mark.asyncio
+async def test_process_video_encoder_errors(tmp_path):
+    """Test errors of the encoder thread propagate instead of hanging."""
+    write_video(tmp_path / "in.mp4", 50)
+
+    def progress(written):
+        if written == 5:
+            raise KeyError("zbl")
+
+    def render(frame, detections):
+        raise KeyError("zbl")
+
+    with pytest.raises(KeyError):
+        await asyncio.wait_for(
+            process_video(
+                [FakeClient(), FakeClient()],
+                tmp_path / "in.mp4",
+                tmp_path / "out.mp4",
+                queue_size=2,
+                progress=progress,
+            ),
+            10,
+        )
+
+    with pytest.raises(KeyError):
+        await asyncio.wait_for(
+            process_video(
+                [FakeDetector()],
+                tmp_path / "in.mp4",
+                tmp_path / "out.mp4",
+                queue_size=2,
+                render=render,
+                keyframe_interval=4,
+            ),
+            10,
+        )